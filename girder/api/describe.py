@@ -123,7 +123,8 @@ class Description(object):
         self._params.append(param)
         return self
 
-    def pagingParams(self, defaultSort, defaultSortDir=1, defaultLimit=50):
+    def pagingParams(self, defaultSort, defaultSortDir=1, defaultLimit=50,
+                     keyset=False):
         """
         Adds the limit, offset, sort, and sortdir parameter documentation to
         this route handler.
@@ -134,6 +135,9 @@ class Description(object):
         :type defaultSortDir: int
         :param defaultLimit: The default page size.
         :type defaultLimit: int
+        :param keyset: Whether the route also supports keyset pagination with
+            the "after" parameter.
+        :type keyset: bool
         """
         self.param('limit', 'Result set size limit.', default=defaultLimit,
                    required=False, dataType='int')
@@ -147,6 +151,12 @@ class Description(object):
                 'sortdir', 'Sort order: 1 for ascending, -1 for descending.',
                 required=False, dataType='int', enum=(1, -1),
                 default=defaultSortDir)
+
+        if keyset:
+            self.param(
+                'after', 'Token from the Girder-After header of the previous '
+                'page; returns the page that follows it. This is faster than '
+                'offset for deep pages.', required=False)
         return self
 
     def consumes(self, value):
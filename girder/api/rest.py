@@ -17,6 +17,8 @@
 #  limitations under the License.
 ###############################################################################
 
+import base64
+import bson.json_util
 import cherrypy
 import collections
 import datetime
@@ -136,8 +138,7 @@ def getCurrentToken(allowCookie=False):
     if not tokenStr:
         return None
 
-    return ModelImporter.model('token').load(tokenStr, force=True,
-                                             objectId=False)
+    return ModelImporter.model('token').loadCached(tokenStr)
 
 
 @_cacheAuthUser
@@ -174,7 +175,7 @@ def getCurrentUser(returnToken=False):
         except AccessException:
             return retVal(None, token)
 
-        user = ModelImporter.model('user').load(token['userId'], force=True)
+        user = ModelImporter.model('token').loadCachedUser(token)
         return retVal(user, token)
 
 
@@ -222,9 +223,14 @@ class loadmodel(ModelImporter):  # noqa: class name
     :type level: AccessType
     :param force:
     :type force: bool
+    :param projection: If True, only the fields that the model's filter method
+        could expose to the current user are loaded. This should only be used
+        on endpoints that return the document through ``filtermodel`` without
+        modifying or saving it.
+    :type projection: bool
     """
     def __init__(self, map=None, model=None, plugin='_core', level=None,
-                 force=False):
+                 force=False, projection=False):
         if map is None:
             self.map = {'id': model}
         else:
@@ -232,6 +238,7 @@ class loadmodel(ModelImporter):  # noqa: class name
 
         self.level = level
         self.force = force
+        self.projection = projection
         self.modelName = model
         self.plugin = plugin
 
@@ -247,17 +254,21 @@ class loadmodel(ModelImporter):  # noqa: class name
         @six.wraps(fun)
         def wrapped(*args, **kwargs):
             model = self.model(self.modelName, self.plugin)
+            loadKwargs = {}
+            if self.projection:
+                loadKwargs['fields'] = model.filterProjection(getCurrentUser())
 
             for raw, converted in six.viewitems(self.map):
                 id = self._getIdValue(kwargs, raw)
 
                 if self.force:
-                    kwargs[converted] = model.load(id, force=True)
+                    kwargs[converted] = model.load(id, force=True, **loadKwargs)
                 elif self.level is not None:
                     kwargs[converted] = model.load(
-                        id=id, level=self.level, user=getCurrentUser())
+                        id=id, level=self.level, user=getCurrentUser(),
+                        **loadKwargs)
                 else:
-                    kwargs[converted] = model.load(id)
+                    kwargs[converted] = model.load(id, **loadKwargs)
 
                 if kwargs[converted] is None:
                     raise RestException(
@@ -499,6 +510,45 @@ def _setCommonCORSHeaders():
     if origins:
         cherrypy.response.headers['Access-Control-Allow-Origin'] = origins
         cherrypy.response.headers['Access-Control-Allow-Credentials'] = 'true'
+        cherrypy.response.headers['Access-Control-Expose-Headers'] = \
+            'Girder-After, Server-Timing, X-Girder-Db-Ops'
+
+
+def _getField(doc, field):
+    """
+    Return the value of a possibly nested field of a document, or None if it
+    is missing.
+    """
+    for key in field.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def _keysetQuery(sort, values):
+    """
+    Build the query matching the documents that come after the given sort key
+    values in the given sort order.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prevField: prevValue for (prevField, _), prevValue in
+                  zip(sort[:i], values[:i])}
+        if values[i] is not None:
+            if direction == SortDir.DESCENDING:
+                # Missing values sort last, so they come after any other value
+                clauses.append(dict(clause, **{field: None}))
+            op = '$gt' if direction == SortDir.ASCENDING else '$lt'
+            clause[field] = {op: values[i]}
+        elif direction == SortDir.ASCENDING:
+            # Missing values sort first, so anything else comes after them
+            clause[field] = {'$ne': None}
+        else:
+            continue
+        clauses.append(clause)
+
+    return {'$or': clauses} if clauses else {'_id': {'$in': []}}
 
 
 class RestException(Exception):
@@ -853,6 +903,65 @@ class Resource(ModelImporter):
 
         return limit, offset, sort
 
+    def getKeysetParameters(self, params, sort):
+        """
+        Support keyset pagination of a listing, where the client passes an
+        opaque "after" token instead of an offset so that every page costs the
+        same no matter how deep it is. Call this with the sort returned by
+        getPagingParameters, and call setKeysetHeader on the results.
+
+        :param params: The URL query parameters.
+        :type params: dict
+        :param sort: The sort order of the listing.
+        :type sort: list or None
+        :returns: A tuple of the sort order to use, which always ends with _id
+            so that it is total, and a query dict that restricts the listing to
+            the documents after the "after" token (empty if there is none).
+        """
+        sort = list(sort or [])
+        if '_id' not in [field for field, _ in sort]:
+            sort.append(('_id', sort[-1][1] if sort else SortDir.ASCENDING))
+
+        if not params.get('after'):
+            return sort, {}
+
+        try:
+            token = bson.json_util.loads(base64.urlsafe_b64decode(
+                str(params['after'])).decode('utf8'))
+            fields, values = token['s'], token['v']
+        except Exception:
+            raise RestException('Invalid "after" token.', extra='after')
+        if fields != [field for field, _ in sort] or \
+                len(values) != len(sort):
+            raise RestException(
+                'The "after" token does not match the sort order.',
+                extra='after')
+
+        return sort, _keysetQuery(sort, values)
+
+    def setKeysetHeader(self, results, sort, limit):
+        """
+        If a listing returned a full page, set the Girder-After response header
+        to the token that fetches the next page.
+
+        :param results: The documents of the page, before they are filtered.
+        :type results: list
+        :param sort: The sort order returned by getKeysetParameters.
+        :type sort: list
+        :param limit: The page size.
+        :type limit: int
+        """
+        if not limit or len(results) < limit:
+            return
+
+        values = [_getField(results[-1], field) for field, _ in sort]
+        token = bson.json_util.dumps({
+            's': [field for field, _ in sort],
+            'v': values
+        })
+        cherrypy.response.headers['Girder-After'] = \
+            base64.urlsafe_b64encode(token.encode('utf8')).decode('utf8')
+
     def ensureTokenScopes(self, scope):
         """
         Ensure that the token passed to this request is authorized for the
@@ -50,7 +50,7 @@ class Collection(Resource):
         .responseClass('Collection')
         .param('text', "Pass this to perform a text search for collections.",
                required=False)
-        .pagingParams(defaultSort='name')
+        .pagingParams(defaultSort='name', keyset=True)
     )
     def find(self, params):
         user = self.getCurrentUser()
@@ -58,10 +58,17 @@ class Collection(Resource):
 
         if 'text' in params:
             return list(self.model('collection').textSearch(
-                params['text'], user=user, limit=limit, offset=offset))
-
-        return list(self.model('collection').list(
-            user=user, offset=offset, limit=limit, sort=sort))
+                params['text'], user=user, limit=limit, offset=offset,
+                fields=self.model('collection').filterProjection(user)))
+
+        sort, afterQuery = self.getKeysetParameters(params, sort)
+        fields = self.model('collection').filterProjection(
+            user, [field for field, _ in sort])
+        collections = list(self.model('collection').list(
+            user=user, offset=offset, limit=limit, sort=sort,
+            filters=afterQuery, fields=fields))
+        self.setKeysetHeader(collections, sort, limit)
+        return collections
 
     @access.user
     @filtermodel(model='collection')
@@ -91,7 +98,7 @@ class Collection(Resource):
             public=public, creator=user)
 
     @access.public
-    @loadmodel(model='collection', level=AccessType.READ)
+    @loadmodel(model='collection', level=AccessType.READ, projection=True)
     @filtermodel(model='collection')
     @describeRoute(
         Description('Get a collection by ID.')
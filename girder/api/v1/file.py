@@ -50,7 +50,7 @@ class File(Resource):
         self.route('PUT', (':id', 'contents'), self.updateFileContents)
 
     @access.public
-    @loadmodel(model='file', level=AccessType.READ)
+    @loadmodel(model='file', level=AccessType.READ, projection=True)
     @filtermodel(model='file')
     @describeRoute(
         Description('Get a file\'s information.')
@@ -76,6 +76,13 @@ class File(Resource):
         .param('reference', 'If included, this information is passed to the '
                'data.process event when the upload is complete.',
                required=False)
+        .param('parallel', 'Whether the chunks of the upload may be sent in '
+               'any order and concurrently, each at its own offset.',
+               dataType='boolean', default=False, required=False)
+        .param('sha512', 'The SHA-512 checksum of the file, as hexadecimal. '
+               'If data of the same size and checksum that you can read is '
+               'already stored, the file is created right away without '
+               'sending any chunks.', required=False)
         .errorResponse()
         .errorResponse('Write access was denied on the parent folder.', 403)
         .errorResponse('Failed to create upload.', 500)
@@ -111,14 +118,18 @@ class File(Resource):
                 upload = self.model('upload').createUpload(
                     user=user, name=params['name'], parentType=parentType,
                     parent=parent, size=int(params['size']), mimeType=mimeType,
-                    reference=params.get('reference'))
+                    reference=params.get('reference'),
+                    parallel=self.boolParam('parallel', params, default=False),
+                    sha512=params.get('sha512'))
             except OSError as exc:
                 if exc.errno == errno.EACCES:
                     raise GirderException(
                         'Failed to create upload.',
                         'girder.api.v1.file.create-upload-failed')
                 raise
-            if upload['size'] > 0:
+            # Uploads of empty files and of data that is already stored have
+            # nothing left to receive.
+            if upload['received'] < upload['size']:
                 return upload
             else:
                 return self.model('file').filter(
@@ -168,11 +179,25 @@ class File(Resource):
         """
         This should be called when resuming an interrupted upload. It will
         report the offset into the upload that should be used to resume.
+        For parallel uploads, it reports the byte ranges that have been
+        received instead, so that the client can send the missing ones.
         :param uploadId: The _id of the temp upload record being resumed.
         :returns: The offset in bytes that the client should use.
         """
         self.requireParams('uploadId', params)
         upload = self.model('upload').load(params['uploadId'], exc=True)
+
+        if upload.get('parallel'):
+            # There is no single offset to resume from; report which ranges
+            # of the file have been received instead. Ranges that are still
+            # being stored are left out.
+            return {
+                'received': upload['received'],
+                'ranges': [[r['start'], r['end']] for r in sorted(
+                    upload['ranges'], key=lambda r: r['start'])
+                    if not r.get('pending')]
+            }
+
         offset = self.model('upload').requestOffset(upload)
 
         if isinstance(offset, six.integer_types):
@@ -187,8 +212,9 @@ class File(Resource):
         Description('Upload a chunk of a file with multipart/form-data.')
         .consumes('multipart/form-data')
         .param('uploadId', 'The ID of the upload record.', paramType='form')
-        .param('offset', 'Offset of the chunk in the file.', dataType='integer',
-               paramType='form')
+        .param('offset', 'Offset of the chunk in the file. Unless this is a '
+               'parallel upload, it must be the number of bytes received so '
+               'far.', dataType='integer', paramType='form')
         .param('chunk', 'The actual bytes of the chunk. For external upload '
                'behaviors, this may be set to an opaque string that will be '
                'handled by the assetstore adapter.',
@@ -206,7 +232,9 @@ class File(Resource):
         must remain logged in when passing each chunk, to authenticate that
         the writer of the chunk is the same as the person who initiated the
         upload. The passed offset is a verification mechanism for ensuring the
-        server and client agree on the number of bytes sent/received.
+        server and client agree on the number of bytes sent/received. Chunks
+        of parallel uploads may be sent in any order, and are stored at the
+        passed offset.
         """
         self.requireParams(('offset', 'uploadId', 'chunk'), params)
 
@@ -218,15 +246,15 @@ class File(Resource):
         if upload['userId'] != user['_id']:
             raise AccessException('You did not initiate this upload.')
 
-        if upload['received'] != offset:
+        if upload['received'] != offset and not upload.get('parallel'):
             raise RestException(
                 'Server has received %s bytes, but client sent offset %s.' % (
                     upload['received'], offset))
         try:
             if type(chunk) == cherrypy._cpreqbody.Part:
-                return self.model('upload').handleChunk(upload, chunk.file)
-            else:
-                return self.model('upload').handleChunk(upload, chunk)
+                chunk = chunk.file
+            return self.model('upload').handleChunk(
+                upload, chunk, offset=offset)
         except IOError as exc:
             if exc.errno == errno.EACCES:
                 raise Exception('Failed to store upload.')
@@ -354,6 +382,9 @@ class File(Resource):
         .param('reference', 'If included, this information is passed to the '
                'data.process event when the upload is complete.',
                required=False)
+        .param('parallel', 'Whether the chunks of the upload may be sent in '
+               'any order and concurrently, each at its own offset.',
+               dataType='boolean', default=False, required=False)
         .notes('After calling this, send the chunks just like you would with a '
                'normal file upload.')
     )
@@ -364,7 +395,8 @@ class File(Resource):
         # Create a new upload record into the existing file
         upload = self.model('upload').createUploadToFile(
             file=file, user=user, size=int(params['size']),
-            reference=params.get('reference'))
+            reference=params.get('reference'),
+            parallel=self.boolParam('parallel', params, default=False))
 
         if upload['size'] > 0:
             return upload
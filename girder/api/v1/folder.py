@@ -59,7 +59,7 @@ class Folder(Resource):
         .param('name', 'Pass to lookup a folder by exact name match. Must '
                'pass parentType and parentId as well when using this.',
                required=False)
-        .pagingParams(defaultSort='name')
+        .pagingParams(defaultSort='name', keyset=True)
         .errorResponse()
         .errorResponse('Read access was denied on the parent resource.', 403)
     )
@@ -71,7 +71,8 @@ class Folder(Resource):
         1. Searching by parentId and parentType, with optional additional
            filtering by the name field (exact match) or using full text search
            within a single parent folder. Pass a "name" parameter or "text"
-           parameter to invoke these additional filters.
+           parameter to invoke these additional filters. This mode supports
+           keyset pagination.
         2. Searching with full text search across all folders in the system.
            Simply pass a "text" parameter for this mode.
         """
@@ -96,13 +97,20 @@ class Folder(Resource):
             if params.get('name'):
                 filters['name'] = params['name']
 
-            return list(self.model('folder').childFolders(
+            sort, afterQuery = self.getKeysetParameters(params, sort)
+            filters.update(afterQuery)
+
+            folders = list(self.model('folder').childFolders(
                 parentType=parentType, parent=parent, user=user,
-                offset=offset, limit=limit, sort=sort, filters=filters))
+                offset=offset, limit=limit, sort=sort, filters=filters,
+                fields=self.model('folder').filterProjection(
+                    user, [field for field, _ in sort])))
+            self.setKeysetHeader(folders, sort, limit)
+            return folders
         elif 'text' in params:
             return list(self.model('folder').textSearch(
                 params['text'], user=user, limit=limit, offset=offset,
-                sort=sort))
+                sort=sort, fields=self.model('folder').filterProjection(user)))
         else:
             raise RestException('Invalid search mode.')
 
@@ -163,6 +171,10 @@ class Folder(Resource):
                enum=['folder', 'user', 'collection'])
         .param('parentId', 'Parent ID for the new parent of this folder.',
                required=False)
+        .param('progress', 'If the folder is moved to a different user or '
+               'collection, this controls whether progress notifications will '
+               'be sent while its contents are updated.', dataType='boolean',
+               default=False, required=False)
         .errorResponse('ID was invalid.')
         .errorResponse('Write access was denied for the folder or its new '
                        'parent object.', 403)
@@ -184,7 +196,14 @@ class Folder(Resource):
                 params['parentId'], level=AccessType.WRITE, user=user, exc=True)
             if (parentType, parent['_id']) !=\
                (folder['parentCollection'], folder['parentId']):
-                folder = self.model('folder').move(folder, parent, parentType)
+                progress = self.boolParam('progress', params, default=False)
+                with ProgressContext(progress, user=user, title='Moving folder',
+                                     message='Calculating progress...') as ctx:
+                    if progress:
+                        ctx.update(total=self.model('folder').subtreeCount(
+                            folder, includeItems=False))
+                    folder = self.model('folder').move(
+                        folder, parent, parentType, progress=ctx)
 
         return folder
 
@@ -281,7 +300,7 @@ class Folder(Resource):
             description=description, public=public)
 
     @access.public
-    @loadmodel(model='folder', level=AccessType.READ)
+    @loadmodel(model='folder', level=AccessType.READ, projection=True)
     @filtermodel(model='folder')
     @describeRoute(
         Description('Get a folder by ID.')
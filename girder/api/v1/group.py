@@ -52,7 +52,7 @@ class Group(Resource):
         Description('Search for groups or list all groups.')
         .param('text', "Pass this to perform a full-text search for groups.",
                required=False)
-        .pagingParams(defaultSort='name')
+        .pagingParams(defaultSort='name', keyset=True)
         .param('exact', 'If true, only return exact name matches. This is '
                'case sensitive.', required=False, dataType='boolean',
                default=False)
@@ -79,8 +79,11 @@ class Group(Resource):
                     {'name': params['text']}, offset=offset, limit=limit,
                     sort=sort)
         else:
-            groupList = self.model('group').list(user=user, offset=offset,
-                                                 limit=limit, sort=sort)
+            sort, afterQuery = self.getKeysetParameters(params, sort)
+            groupList = list(self.model('group').list(
+                user=user, offset=offset, limit=limit, sort=sort,
+                filters=afterQuery))
+            self.setKeysetHeader(groupList, sort, limit)
         return list(groupList)
 
     @access.user
@@ -53,7 +53,7 @@ class Item(Resource):
                required=False)
         .param('name', 'Pass to lookup an item by exact name match. Must '
                'pass folderId as well when using this.', required=False)
-        .pagingParams(defaultSort='lowerName')
+        .pagingParams(defaultSort='lowerName', keyset=True)
         .errorResponse()
         .errorResponse('Read access was denied on the parent folder.', 403)
     )
@@ -65,7 +65,7 @@ class Item(Resource):
         1. Searching by folderId, with optional additional filtering by the name
            field (exact match) or using full text search within a single parent
            folder. Pass a "name" parameter or "text" parameter to invoke these
-           additional filters.
+           additional filters. This mode supports keyset pagination.
         2. Searching with full text search across all items in the system.
            Simply pass a "text" parameter for this mode.
         """
@@ -83,18 +83,24 @@ class Item(Resource):
             if params.get('name'):
                 filters['name'] = params['name']
 
-            return list(self.model('folder').childItems(
+            sort, afterQuery = self.getKeysetParameters(params, sort)
+            filters.update(afterQuery)
+
+            items = list(self.model('folder').childItems(
                 folder=folder, limit=limit, offset=offset, sort=sort,
-                filters=filters))
+                filters=filters, fields=self.model('item').filterProjection(
+                    user, [field for field, _ in sort])))
+            self.setKeysetHeader(items, sort, limit)
+            return items
         elif 'text' in params:
             return list(self.model('item').textSearch(
                 params['text'], user=user, limit=limit, offset=offset,
-                sort=sort))
+                sort=sort, fields=self.model('item').filterProjection(user)))
         else:
             raise RestException('Invalid search mode.')
 
     @access.public
-    @loadmodel(model='item', level=AccessType.READ)
+    @loadmodel(model='item', level=AccessType.READ, projection=True)
     @filtermodel(model='item')
     @describeRoute(
         Description('Get an item by ID.')
@@ -131,6 +131,35 @@ class Resource(BaseResource):
             raise RestException('No resources specified.')
         return resources
 
+    def _loadResourceSet(self, resources, user, level, funcName=None):
+        """
+        Load all of the documents listed in a resource set, using a single
+        query per resource type.
+        :param resources: a resource dictionary as returned by
+                          _validateResourceSet.
+        :param user: the user that must have access to the resources.
+        :param level: the access level the user must have.
+        :param funcName: a function name to ensure that each model contains.
+        :returns: a dictionary with each key a model name and each value a
+                  list of documents, in the same order as the ids.
+        """
+        docs = {}
+        for kind in resources:
+            model = self._getResourceModel(kind, funcName)
+            if (isinstance(model, (acl_mixin.AccessControlMixin,
+                                   AccessControlledModel))):
+                docs[kind] = model.loadMany(
+                    resources[kind], user=user, level=level)
+            else:
+                docs[kind] = model.loadMany(resources[kind])
+            if len(docs[kind]) != len(resources[kind]):
+                found = {str(doc['_id']) for doc in docs[kind]}
+                for id in resources[kind]:
+                    if str(id) not in found:
+                        raise RestException('Resource %s %s not found.' %
+                                            (kind, id))
+        return docs
+
     def _getResourceModel(self, kind, funcName=None):
         """
         Load and return a model with a specific function or throw an exception.
@@ -261,12 +290,8 @@ class Resource(BaseResource):
         resources = self._validateResourceSet(params)
         # Check that all the resources are valid, so we don't download the zip
         # file if it would throw an error.
-        for kind in resources:
-            model = self._getResourceModel(kind, 'fileList')
-            for id in resources[kind]:
-                if not model.load(id=id, user=user, level=AccessType.READ):
-                    raise RestException('Resource %s %s not found.' %
-                                        (kind, id))
+        docs = self._loadResourceSet(
+            resources, user, AccessType.READ, 'fileList')
         metadata = self.boolParam('includeMetadata', params, default=False)
         cherrypy.response.headers['Content-Type'] = 'application/zip'
         cherrypy.response.headers['Content-Disposition'] = \
@@ -276,8 +301,7 @@ class Resource(BaseResource):
             zip = ziputil.ZipGenerator()
             for kind in resources:
                 model = self.model(kind)
-                for id in resources[kind]:
-                    doc = model.load(id=id, user=user, level=AccessType.READ)
+                for doc in docs[kind]:
                     for (path, file) in model.fileList(
                             doc=doc, user=user, includeMetadata=metadata,
                             subpath=True):
@@ -313,18 +337,11 @@ class Resource(BaseResource):
                              message='Calculating size...') as ctx:
             ctx.update(total=total)
             current = 0
+            docs = self._loadResourceSet(
+                resources, user, AccessType.ADMIN, 'remove')
             for kind in resources:
-                model = self._getResourceModel(kind, 'remove')
-                for id in resources[kind]:
-                    if (isinstance(model, (acl_mixin.AccessControlMixin,
-                                           AccessControlledModel))):
-                        doc = model.load(id=id, user=user,
-                                         level=AccessType.ADMIN)
-                    else:
-                        doc = model.load(id=id)
-                    if not doc:
-                        raise RestException('Resource %s %s not found.' %
-                                            (kind, id))
+                model = self.model(kind)
+                for doc in docs[kind]:
                     # Don't do a subtree count if we weren't asked for progress
                     if progress:
                         subtotal = model.subtreeCount(doc)
@@ -399,13 +416,11 @@ class Resource(BaseResource):
         with ProgressContext(progress, user=user, title='Moving resources',
                              message='Calculating requirements...',
                              total=total) as ctx:
+            docs = self._loadResourceSet(
+                resources, user, AccessType.WRITE, 'move')
             for kind in resources:
-                model = self._getResourceModel(kind, 'move')
-                for id in resources[kind]:
-                    doc = model.load(id=id, user=user, level=AccessType.WRITE)
-                    if not doc:
-                        raise RestException('Resource %s %s not found.' %
-                                            (kind, id))
+                model = self.model(kind)
+                for doc in docs[kind]:
                     ctx.update(message='Moving %s %s' % (
                         kind, doc.get('name', '')))
                     if kind == 'item':
@@ -444,24 +459,16 @@ class Resource(BaseResource):
         """
         user, resources, parent, parentType, progress = \
             self._prepareMoveOrCopy(params)
-        total = len(resources.get('item', []))
-        if 'folder' in resources:
-            model = self._getResourceModel('folder')
-            for id in resources['folder']:
-                folder = model.load(id=id, user=user,
-                                    level=AccessType.READ)
-                if folder:
-                    total += model.subtreeCount(folder)
+        docs = self._loadResourceSet(resources, user, AccessType.READ)
+        total = len(docs.get('item', []))
+        for folder in docs.get('folder', []):
+            total += self.model('folder').subtreeCount(folder)
         with ProgressContext(progress, user=user, title='Copying resources',
                              message='Calculating requirements...',
                              total=total) as ctx:
             for kind in resources:
-                model = self._getResourceModel(kind)
-                for id in resources[kind]:
-                    doc = model.load(id=id, user=user, level=AccessType.READ)
-                    if not doc:
-                        raise RestException('Resource not found. No %s with '
-                                            'id %s' % (kind, id))
+                model = self.model(kind)
+                for doc in docs[kind]:
                     ctx.update(message='Copying %s %s' % (
                         kind, doc.get('name', '')))
                     if kind == 'item':
@@ -345,52 +345,24 @@ class System(Resource):
         Description('Perform a variety of system checks to verify that all is '
                     'well.')
         .notes("""Must be a system administrator to call this.  This verifies
-               and corrects some issues, such as incorrect folder sizes.""")
+               and corrects some issues, such as orphaned items, folders, files,
+               and uploads, incorrect base parents, and incorrect sizes. Files
+               whose data is missing from their assetstores are reported but
+               not corrected.""")
         .param('progress', 'Whether to record progress on this task. Default '
                'is false.', required=False, dataType='boolean')
+        .param('report', 'If true, only report the problems that would be '
+               'corrected, without changing anything. Default is false.',
+               required=False, dataType='boolean')
         .errorResponse('You are not a system administrator.', 403)
     )
     def systemConsistencyCheck(self, params):
-        results = {}
         progress = self.boolParam('progress', params, default=False)
-        models = ('item', )
-        steps = 0
-        if progress:
-            for model in models:
-                count, changed = self.model(model).checkConsistency(
-                    stage='count')
-                steps += count
+        report = self.boolParam('report', params, default=False)
         with ProgressContext(progress, user=self.getCurrentUser(),
-                             title='Checking system', total=steps,
+                             title='Checking system',
                              message='Checking system...') as ctx:
-            for model in models:
-                count, removed = self.model(model).checkConsistency(
-                    stage='remove', progress=ctx)
-                if removed:
-                    results[model+'Removed'] = removed
-            revmodels = list(models)
-            revmodels.reverse()
-            for model in revmodels:
-                count, corrected = self.model(model).checkConsistency(
-                    stage='verify', progress=ctx)
-                if count:
-                    results[model+'Count'] = count
-                if corrected:
-                    results[model+'Corrected'] = corrected
-            # TODO:
-            # * check that all files are associated with an existing item
-            # * check that all files exist within their assetstore and are the
-            #   expected size
-            # * check that all folders have a valid ancestor tree leading to a
-            #   user or collection
-            # * check that all folders have the correct baseParentId and
-            #   baseParentType
-            # * check that all groups contain valid users
-            # * check that all resources validate
-            # * for filesystem assetstores, find files that are not tracked.
-            # * for gridfs assetstores, find chunks that are not tracked.
-            # * for s3 assetstores, find elements that are not tracked.
-        return results
+            return system.checkConsistency(progress=ctx, report=report)
 
     @access.admin
     @describeRoute(
@@ -60,16 +60,28 @@ class User(Resource):
         .responseClass('User')
         .param('text', "Pass this to perform a full text search for items.",
                required=False)
-        .pagingParams(defaultSort='lastName')
+        .pagingParams(defaultSort='lastName', keyset=True)
     )
     def find(self, params):
         limit, offset, sort = self.getPagingParameters(params, 'lastName')
-        return list(self.model('user').search(
-            text=params.get('text'), user=self.getCurrentUser(), offset=offset,
-            limit=limit, sort=sort))
+        user = self.getCurrentUser()
+
+        if 'text' in params:
+            return list(self.model('user').search(
+                text=params['text'], user=user, offset=offset, limit=limit,
+                sort=sort, fields=self.model('user').filterProjection(user)))
+
+        sort, afterQuery = self.getKeysetParameters(params, sort)
+        users = list(self.model('user').search(
+            user=user, offset=offset, limit=limit, sort=sort,
+            filters=afterQuery, fields=self.model('user').filterProjection(
+                user, [field for field, _ in sort])))
+        self.setKeysetHeader(users, sort, limit)
+        return users
 
     @access.public
-    @loadmodel(map={'id': 'userToGet'}, model='user', level=AccessType.READ)
+    @loadmodel(map={'id': 'userToGet'}, model='user', level=AccessType.READ,
+               projection=True)
     @filtermodel(model='user')
     @describeRoute(
         Description('Get a user by ID.')
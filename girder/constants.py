@@ -207,6 +207,9 @@ class CoreEventHandler(object):
     # For removing deleted user/group references from AccessControlledModel
     ACCESS_CONTROL_CLEANUP = 'core.cleanupDeletedEntity'
 
+    # For dropping stale tokens and users from the authentication cache.
+    AUTH_CACHE_INVALIDATE = 'core.invalidateAuthCache'
+
     # For updating an item's size to include a new file.
     FILE_PROPAGATE_SIZE = 'core.propagateSizeToItem'
 
@@ -217,6 +217,17 @@ def unbindAll():
     _mapping = {}
 
 
+def hasHandlers(eventName):
+    """
+    Return whether any listener is bound to the given event, for callers that
+    can skip work needed only to trigger it.
+
+    :param eventName: The name that identifies the event.
+    :type eventName: str
+    """
+    return bool(_mapping.get(eventName))
+
+
 @contextlib.contextmanager
 def bound(eventName, handlerName, handler):
     """
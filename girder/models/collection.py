@@ -33,7 +33,9 @@ class Collection(AccessControlledModel):
 
     def initialize(self):
         self.name = 'collection'
-        self.ensureIndices(['name'])
+        self.ensureIndices(['name', 'public', 'access.users.id',
+                            'access.groups.id',
+                            ([('name', 1), ('_id', 1)], {})])
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -81,35 +83,35 @@ class Collection(AccessControlledModel):
 
     def remove(self, collection, progress=None, **kwargs):
         """
-        Delete a collection recursively.
+        Delete a collection recursively. Its folders are marked as deleted and
+        removed in batches, and then the collection itself is removed; see
+        :py:class:`girder.models.deletion.Deletion`.
 
         :param collection: The collection document to delete.
         :type collection: dict
         :param progress: A progress context to record progress on.
         :type progress: girder.utility.progress.ProgressContext or None.
         """
-        # Delete all folders in the community recursively
-        folders = self.model('folder').find({
-            'parentId': collection['_id'],
-            'parentCollection': 'collection'
-        })
-        for folder in folders:
-            self.model('folder').remove(folder, progress=progress, **kwargs)
-
-        # Delete this collection
-        AccessControlledModel.remove(self, collection)
+        deletion = self.model('deletion').createDeletion(
+            collection, 'collection')
+        self.model('deletion').collect(deletion, progress=progress, **kwargs)
         if progress:
             progress.update(increment=1, message='Deleted collection ' +
                             collection['name'])
 
-    def list(self, user=None, limit=0, offset=0, sort=None):
+    def list(self, user=None, limit=0, offset=0, sort=None, fields=None,
+             filters=None):
         """
-        Search for collections with full text search.
+        List all collections that the user can see.
+
+        :param fields: The subset of fields to load from each document, or
+            None to load the full documents.
+        :param filters: Additional query operators to apply.
+        :type filters: dict
         """
-        cursor = self.find({}, sort=sort)
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
-            offset=offset)
+        return self.findWithPermissions(
+            filters or {}, sort=sort, user=user, level=AccessType.READ,
+            limit=limit, offset=offset, fields=fields)
 
     def createCollection(self, name, creator, description='', public=True):
         """
@@ -207,6 +209,27 @@ class Collection(AccessControlledModel):
             for folder in folders)
         return count
 
+    def checkConsistency(self, stage, progress=None, report=False):
+        """
+        Check all of the collections and make sure they are valid. Only the
+        propagate stage does anything: it corrects the size of each collection
+        to the total size of the folders under it, once the folder check has
+        corrected those.
+
+        :param stage: which stage of the check to run.
+        :param progress: an optional progress context to update.
+        :param report: if True, only find the problems; do not correct them.
+        :type report: bool
+        :returns: numCollections: number of collections processed,
+                  changed: a set of the _ids of the collections changed.
+        """
+        if stage != 'propagate':
+            return 0, set()
+        if progress is not None:
+            progress.update(message='Checking collection sizes')
+        return self.checkSizes(
+            self.model('folder'), 'baseParentId', report=report)
+
     def setAccessList(self, doc, access, save=False, recurse=False, user=None,
                       progress=noProgress, setPublic=None):
         """
@@ -238,18 +261,9 @@ class Collection(AccessControlledModel):
         doc = AccessControlledModel.setAccessList(self, doc, access, save=save)
 
         if recurse:
-            cursor = self.model('folder').find({
-                'parentId': doc['_id'],
-                'parentCollection': 'collection'
-            })
-
-            folders = self.filterResultsByPermission(
-                cursor=cursor, user=user, level=AccessType.ADMIN)
-
-            for folder in folders:
-                self.model('folder').setAccessList(
-                    folder, access, save=True, recurse=True, user=user,
-                    progress=progress, setPublic=setPublic)
+            self.model('folder').propagateAccessList(
+                doc, 'collection', user=user, progress=progress,
+                setPublic=setPublic)
 
         return doc
 
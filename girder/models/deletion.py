@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import collections
+import datetime
+import os
+import socket
+import threading
+import uuid
+
+from pymongo import ReturnDocument
+
+from .model_base import Model
+from girder import logger
+from girder.utility import assetstore_utilities
+from girder.utility.progress import noProgress, setResponseTimeLimit
+
+# The number of items or folders that are removed together
+DELETION_BATCH_SIZE = 1000
+
+# A deletion whose owner has not recorded a heartbeat for this long is taken
+# over by another server process.
+DELETION_HEARTBEAT_TIMEOUT = datetime.timedelta(minutes=10)
+
+# Seconds between checks for deletions that other processes stopped collecting
+DELETION_POLL_INTERVAL = 60
+
+# Identifies the deletions that this process is collecting
+OWNER = '%s:%d:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+
+
+class DeletionResumeThread(threading.Thread):
+    """
+    This thread collects the deletions that were interrupted when a server
+    process stopped, so that a large one does not hold up startup or the
+    asynchronous events thread. While other processes are collecting
+    deletions, it keeps checking for ones whose owner stopped. This should
+    not be invoked directly; it is started and stopped along with the
+    CherryPy engine.
+    """
+    def __init__(self, model):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.model = model
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                pending = self.model.resumeStale()
+            except Exception:
+                logger.exception('Could not resume deletions.')
+                pending = True
+            if not pending:
+                break
+            self.stopped.wait(DELETION_POLL_INTERVAL)
+
+
+class Deletion(Model):
+    """
+    Deletions record the subtrees that are being removed, so that removing
+    them can be resumed if the server stops part way through. Every folder and
+    item in a subtree is first marked with the _id of its deletion record,
+    which hides it from listings, and the marked documents are then removed
+    in batches, along with their files and pending uploads. The folder,
+    collection, or user at the root of the subtree is removed last.
+
+    Each record is owned by the server process collecting it, which records a
+    heartbeat with every batch. A record whose heartbeat has gone stale is
+    taken over by another process.
+    """
+    def initialize(self):
+        self.name = 'deletion'
+        self._thread = None
+
+    def validate(self, doc):
+        return doc
+
+    def createDeletion(self, doc, resourceType, removeRoot=True):
+        """
+        Start deleting everything underneath a folder, collection, or user,
+        and mark it as deleted. The caller is responsible for any changes to
+        the sizes of the parents of the subtree; the documents in it are
+        removed without updating any sizes.
+
+        :param doc: The folder, collection, or user at the root of the subtree.
+        :type doc: dict
+        :param resourceType: The type of doc: 'folder', 'collection' or 'user'.
+        :type resourceType: str
+        :param removeRoot: Whether to remove doc itself once its contents have
+            been removed.
+        :type removeRoot: bool
+        :returns: The deletion record, to pass to collect.
+        """
+        deletion = self.save({
+            'resourceType': resourceType,
+            'resourceId': doc['_id'],
+            'removeRoot': removeRoot,
+            'created': datetime.datetime.utcnow(),
+            'owner': OWNER,
+            'heartbeat': datetime.datetime.utcnow()
+        })
+        self._mark(deletion)
+        return deletion
+
+    def _mark(self, deletion):
+        """
+        Mark every folder and item in the subtree of a deletion. This is safe
+        to repeat.
+        """
+        folderModel = self.model('folder')
+        update = {'$set': {'deleted': deletion['_id']}}
+
+        if deletion['resourceType'] == 'folder':
+            roots = [deletion['resourceId']]
+            if deletion['removeRoot']:
+                folderModel.update({'_id': deletion['resourceId']}, update)
+        else:
+            roots = [folder['_id'] for folder in folderModel.find({
+                'parentId': deletion['resourceId'],
+                'parentCollection': deletion['resourceType']
+            }, fields=())]
+            folderModel.update({'_id': {'$in': roots}}, update)
+
+        for folderId in roots:
+            folderModel._updateDescendants(folderId, update)
+
+    def collect(self, deletion, progress=noProgress, **kwargs):
+        """
+        Remove the documents marked by a deletion, in batches, and then its
+        root document and the deletion record itself. This stops early if
+        another process has taken the deletion over.
+
+        :param deletion: The deletion record.
+        :type deletion: dict
+        :param progress: A progress context to record progress on. Progress is
+            incremented once per folder and item removed.
+        :type progress: girder.utility.progress.ProgressContext
+        """
+        progress = progress or noProgress
+        query = {
+            'deleted': deletion['_id'],
+            '_id': {'$ne': deletion['resourceId']}
+        }
+
+        for items in self._batches(self.model('item'), query, deletion):
+            self._removeItems(items, progress=progress, **kwargs)
+            progress.update(increment=len(items),
+                            message='Deleted %d items' % len(items))
+
+        for folders in self._batches(self.model('folder'), query, deletion):
+            self._removeUploads('folder', folders, progress=progress, **kwargs)
+            self.model('folder').removeMany(
+                folders, progress=progress, **kwargs)
+            progress.update(increment=len(folders),
+                            message='Deleted %d folders' % len(folders))
+
+        if not self._heartbeat(deletion):
+            return
+        if deletion['removeRoot']:
+            model = self.model(deletion['resourceType'])
+            root = model.load(deletion['resourceId'], force=True)
+            if root is not None:
+                if deletion['resourceType'] == 'folder':
+                    self._removeUploads(
+                        'folder', [root], progress=progress, **kwargs)
+                Model.remove(model, root, progress=progress, **kwargs)
+
+        self.remove(deletion)
+
+    def _batches(self, model, query, deletion):
+        """
+        Yield the documents matching a query in batches, in _id order. Each
+        batch is fetched after the previous one has been processed, so the
+        documents can be removed as they are yielded. This stops if another
+        process has taken the deletion over.
+        """
+        query = dict(query)
+        while self._heartbeat(deletion):
+            setResponseTimeLimit()
+            batch = list(model.find(
+                query, sort=[('_id', 1)], limit=DELETION_BATCH_SIZE))
+            if not batch:
+                return
+            yield batch
+            query['_id'] = dict(query['_id'], **{'$gt': batch[-1]['_id']})
+
+    def _removeUploads(self, parentType, parents, **kwargs):
+        for upload in self.model('upload').find({
+            'parentType': parentType,
+            'parentId': {'$in': [parent['_id'] for parent in parents]}
+        }):
+            self.model('upload').remove(upload, **kwargs)
+
+    def _removeItems(self, items, **kwargs):
+        """
+        Remove a batch of items along with their files, deleting the data of
+        the files with one call per assetstore.
+        """
+        files = list(self.model('file').find({
+            'itemId': {'$in': [item['_id'] for item in items]}
+        }))
+
+        filesByAssetstore = collections.defaultdict(list)
+        for file in files:
+            if file.get('assetstoreId'):
+                filesByAssetstore[file['assetstoreId']].append(file)
+        for assetstoreId, assetstoreFiles in filesByAssetstore.items():
+            assetstore = self.model('assetstore').load(assetstoreId)
+            adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+            adapter.deleteFiles(assetstoreFiles)
+
+        self.model('file').removeMany(files, **kwargs)
+        self._removeUploads('item', items, **kwargs)
+        self.model('item').removeMany(items, **kwargs)
+
+    def _heartbeat(self, deletion):
+        """
+        Record that this process is still collecting a deletion.
+
+        :returns: Whether this process still owns the deletion.
+        """
+        result = self.update({'_id': deletion['_id'], 'owner': OWNER}, {
+            '$set': {'heartbeat': datetime.datetime.utcnow()}
+        }, multi=False)
+        if not result.matched_count:
+            logger.info('Deletion of %s %s was taken over by another '
+                        'process.' % (deletion['resourceType'],
+                                      deletion['resourceId']))
+        return bool(result.matched_count)
+
+    def _claimStale(self):
+        """
+        Take over the oldest deletion whose owner stopped recording heartbeats.
+
+        :returns: The claimed deletion record, or None if there is none.
+        """
+        stale = datetime.datetime.utcnow() - DELETION_HEARTBEAT_TIMEOUT
+        return self.collection.find_one_and_update({
+            '$or': [
+                {'heartbeat': {'$lt': stale}},
+                {'heartbeat': {'$exists': False}}
+            ]
+        }, {
+            '$set': {'owner': OWNER, 'heartbeat': datetime.datetime.utcnow()}
+        }, sort=[('created', 1)], return_document=ReturnDocument.AFTER)
+
+    def resumeStale(self):
+        """
+        Collect every deletion whose owner stopped, one at a time, claiming
+        each one atomically so that no two processes collect the same one.
+
+        :returns: Whether other processes are still collecting deletions,
+            which may need to be taken over later.
+        """
+        while True:
+            deletion = self._claimStale()
+            if deletion is None:
+                break
+            logger.info('Resuming deletion of %s %s.' % (
+                deletion['resourceType'], deletion['resourceId']))
+            self._mark(deletion)
+            self.collect(deletion)
+
+        return self.find({'owner': {'$ne': OWNER}}, limit=1).count() > 0
+
+    def resume(self):
+        """
+        Start collecting the deletions that were interrupted, on a thread of
+        their own. This is called when the server starts.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = DeletionResumeThread(self)
+            self._thread.start()
+
+    def stopResume(self):
+        """
+        Stop checking for interrupted deletions. This is called when the
+        server stops. A deletion that is being collected is not waited for; if
+        the process exits first, another one takes it over once its heartbeat
+        is stale.
+        """
+        if self._thread is not None:
+            self._thread.stopped.set()
+            self._thread = None
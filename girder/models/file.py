@@ -18,12 +18,17 @@
 ###############################################################################
 
 import cherrypy
+import collections
 import datetime
+import six
+import threading
 
 from .model_base import Model, ValidationException
 from girder import events
 from girder.constants import AccessType, CoreEventHandler
 from girder.utility import assetstore_utilities, acl_mixin
+from girder.utility.progress import setResponseTimeLimit
+from girder.utility.size_aggregator import aggregator as sizeAggregator
 
 
 class File(acl_mixin.AccessControlMixin, Model):
@@ -47,6 +52,8 @@ class File(acl_mixin.AccessControlMixin, Model):
         events.bind('model.file.save.created',
                     CoreEventHandler.FILE_PROPAGATE_SIZE,
                     self._propagateSizeToItem)
+        # Set while files whose sizes are already counted are being saved
+        self._sizesCounted = threading.local()
 
     def remove(self, file, updateItemSize=True, **kwargs):
         """
@@ -67,8 +74,8 @@ class File(acl_mixin.AccessControlMixin, Model):
         if file['itemId']:
             item = self.model('item').load(file['itemId'], force=True)
             # files that are linkUrls might not have a size field
-            if 'size' in file:
-                self.propagateSizeChange(item, -file['size'], updateItemSize)
+            self.propagateSizeChange(
+                item, -file.get('size', 0), updateItemSize, fileCount=-1)
 
         Model.remove(self, file)
 
@@ -166,12 +173,14 @@ class File(acl_mixin.AccessControlMixin, Model):
                 self.model('item').remove(item)
             raise
 
-    def propagateSizeChange(self, item, sizeIncrement, updateItemSize=True):
+    def propagateSizeChange(self, item, sizeIncrement, updateItemSize=True,
+                            fileCount=0, sync=False):
         """
         Propagates a file size change (or file creation) to the necessary
         parents in the hierarchy. Internally, this records subtree size in
         the item, the parent folder, and the root node under which the item
-        lives. Should be called anytime a new file is added, a file is
+        lives, as well as the recursive size and file count of every ancestor
+        folder. Should be called anytime a new file is added, a file is
         deleted, or a file size changes.
 
         :param item: The parent item of the file.
@@ -181,22 +190,23 @@ class File(acl_mixin.AccessControlMixin, Model):
         :param updateItemSize: Whether the item size should be updated. Set to
             False if you plan to delete the item immediately and don't care to
             update its size.
+        :param fileCount: The change in the number of files, when a file is
+            being created or deleted.
+        :type fileCount: int
+        :param sync: Whether to write the changes immediately, even if size
+            changes are being merged by the size aggregator.
+        :type sync: bool
         """
-        if updateItemSize:
+        if updateItemSize and sizeIncrement:
             # Propagate size up to item
-            self.model('item').increment(query={
-                '_id': item['_id']
-            }, field='size', amount=sizeIncrement, multi=False)
+            sizeAggregator.increment(
+                self.model('item'), [item['_id']], {'size': sizeIncrement},
+                sync=sync)
 
-        # Propagate size to direct parent folder
-        self.model('folder').increment(query={
-            '_id': item['folderId']
-        }, field='size', amount=sizeIncrement, multi=False)
-
-        # Propagate size up to root data node
-        self.model(item['baseParentType']).increment(query={
-            '_id': item['baseParentId']
-        }, field='size', amount=sizeIncrement, multi=False)
+        # Propagate size to the direct parent folder, the root data node, and
+        # the recursive totals of the ancestor folders
+        self.model('item').propagateSizeChange(
+            item, sizeIncrement, fileCount=fileCount, sync=sync)
 
     def createFile(self, creator, item, name, size, assetstore, mimeType=None,
                    saveFile=True, reuseExisting=False):
@@ -255,11 +265,16 @@ class File(acl_mixin.AccessControlMixin, Model):
         # "model.file.save" to set "defaultPrevented", which would prevent the
         # item from being saved initially.
 
+        # Files copied along with their items are already counted in them.
+        if getattr(self._sizesCounted, 'active', False):
+            return
+
         fileDoc = event.info
         itemId = fileDoc.get('itemId')
-        if itemId and fileDoc.get('size'):
+        if itemId:
             item = self.model('item').load(itemId, force=True)
-            self.propagateSizeChange(item, fileDoc['size'])
+            self.propagateSizeChange(
+                item, fileDoc.get('size', 0), fileCount=1)
 
     def updateFile(self, file):
         """
@@ -303,8 +318,148 @@ class File(acl_mixin.AccessControlMixin, Model):
             adapter.copyFile(srcFile, file)
         elif file.get('linkUrl'):
             file['linkUrl'] = srcFile['linkUrl']
-        item = self.model('item').load(id=file['itemId'], user=creator,
-                                       level=AccessType.WRITE, exc=True)
-        if 'size' in file:
-            self.propagateSizeChange(item, file['size'])
+        # Make sure the creator can write to the item; its size is updated
+        # when the new file is saved
+        self.model('item').load(id=file['itemId'], user=creator,
+                                level=AccessType.WRITE, exc=True)
         return self.save(file)
+
+    def copyFiles(self, items, creator):
+        """
+        Copy all of the files of many items at once, for copying whole
+        folders. Unlike copyFile, the new files are written with a single bulk
+        insert, and the sizes of their items and the items' parents are not
+        changed; the caller is responsible for those. The save events of each
+        file are still triggered. As with copyFile, the stored data is not
+        duplicated.
+
+        :param items: A dict of the _id of each source item to the new item
+            its files should be copied into.
+        :type items: dict
+        :param creator: The user copying the files.
+        :returns: The list of new files.
+        """
+        now = datetime.datetime.utcnow()
+        adapters = {}
+        files = []
+        for srcFile in self.find({'itemId': {'$in': list(items)}}):
+            file = srcFile.copy()
+            del file['_id']
+            file['copied'] = now
+            file['copierId'] = creator['_id']
+            file['itemId'] = items[srcFile['itemId']]['_id']
+            if file.get('assetstoreId'):
+                if file['assetstoreId'] not in adapters:
+                    assetstore = self.model('assetstore').load(
+                        file['assetstoreId'])
+                    adapters[file['assetstoreId']] = \
+                        assetstore_utilities.getAssetstoreAdapter(assetstore)
+                adapters[file['assetstoreId']].copyFile(srcFile, file)
+            files.append(file)
+
+        self._sizesCounted.active = True
+        try:
+            return self.saveMany(files, validate=False, documentEvents=True)
+        finally:
+            self._sizesCounted.active = False
+
+    def checkConsistency(self, stage, progress=None, report=False):
+        """
+        Check all of the files and make sure they are valid. This operates in
+        the same stages as the item consistency check. The remove stage
+        removes files whose items, the resources they are attached to, or
+        whose assetstores do not exist. The verify stage finds files whose data
+        is missing from their assetstores or has the wrong size; these cannot
+        be corrected, so they are only reported.
+
+        :param stage: which stage of the check to run: count, remove, or
+            verify.
+        :param progress: an optional progress context to update.
+        :param report: if True, only find the problems; do not correct them.
+        :type report: bool
+        :returns: numFiles: number of files to check or processed,
+                  changed: a set of the _ids of the files removed or found to
+                  be invalid.
+        """
+        if stage == 'count':
+            return self.find(limit=1).count(), set()
+        elif stage == 'remove':
+            return self._removeLostFiles(progress, report)
+        elif stage == 'verify':
+            return self._findInvalidData(progress)
+
+    def _removeLostFiles(self, progress=None, report=False):
+        """
+        Remove the files that refer to items, resources, or assetstores that
+        do not exist, and the data of those that can still be reached.
+        """
+        references = [
+            ('itemId', self.model('item'), {'itemId': {'$ne': None}}),
+            ('assetstoreId', self.model('assetstore'),
+             {'assetstoreId': {'$ne': None}})]
+        for attachedToType in self.collection.distinct('attachedToType'):
+            if attachedToType:
+                references.append((
+                    'attachedToId', self.model(attachedToType),
+                    {'attachedToType': attachedToType}))
+
+        lostFiles = set()
+        for field, model, query in references:
+            missing = list(self.findDanglingReferences(field, model, query))
+            for start in six.moves.range(0, len(missing), 1000):
+                setResponseTimeLimit()
+                files = [file for file in self.find(dict(query, **{
+                    field: {'$in': missing[start:start + 1000]}}))
+                    if file['_id'] not in lostFiles]
+                lostFiles.update(file['_id'] for file in files)
+                if files and not report:
+                    self._removeData(files)
+                    self.removeWithQuery(
+                        {'_id': {'$in': [file['_id'] for file in files]}})
+
+        if lostFiles and progress is not None:
+            progress.update(message='Removed %d orphaned files' %
+                            len(lostFiles))
+        return len(lostFiles), lostFiles
+
+    def _removeData(self, files):
+        """
+        Delete the data of files from their assetstores, with one call per
+        assetstore, skipping any whose assetstores do not exist.
+        """
+        filesByAssetstore = collections.defaultdict(list)
+        for file in files:
+            if file.get('assetstoreId'):
+                filesByAssetstore[file['assetstoreId']].append(file)
+        for assetstoreId, assetstoreFiles in six.viewitems(filesByAssetstore):
+            assetstore = self.model('assetstore').load(assetstoreId)
+            if assetstore is not None:
+                adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+                adapter.deleteFiles(assetstoreFiles)
+
+    def _findInvalidData(self, progress=None):
+        """
+        Ask each assetstore adapter that can check its files for those whose
+        data is missing or has the wrong size.
+        """
+        numFiles = 0
+        invalidFiles = set()
+        for assetstore in self.model('assetstore').list():
+            setResponseTimeLimit()
+            if progress is not None:
+                progress.update(message='Checking the data of files in %s' %
+                                assetstore['name'])
+            adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+            if not getattr(adapter, 'unavailable', False):
+                try:
+                    invalidFiles.update(
+                        info['file']['_id']
+                        for info in adapter.findInvalidFiles())
+                except NotImplementedError:
+                    pass
+            count = self.find(
+                {'assetstoreId': assetstore['_id']}, limit=1).count()
+            numFiles += count
+            if progress is not None:
+                progress.update(increment=count)
+        return numFiles, invalidFiles
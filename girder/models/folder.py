@@ -19,16 +19,29 @@
 
 import copy
 import datetime
+import functools
+import itertools
 import json
 import os
 import six
 
 from bson.objectid import ObjectId
+from pymongo import UpdateMany, UpdateOne
 from .model_base import AccessControlledModel, ValidationException, \
     GirderException
-from girder import events
+from girder import events, logger
 from girder.constants import AccessType
 from girder.utility.progress import noProgress, setResponseTimeLimit
+from girder.utility.size_aggregator import aggregator as sizeAggregator
+
+# The number of folders, or of items, that are handled together when walking a
+# subtree one level at a time
+DESCENDANT_BATCH_SIZE = 1000
+
+# The maintained totals of the subtree under each folder. The size includes
+# that of the folder itself, while the counts only include its descendants.
+RECURSIVE_FIELDS = ('recursiveSize', 'recursiveItemCount',
+                    'recursiveFolderCount', 'recursiveFileCount')
 
 
 class Folder(AccessControlledModel):
@@ -42,8 +55,15 @@ class Folder(AccessControlledModel):
 
     def initialize(self):
         self.name = 'folder'
-        self.ensureIndices(('parentId', 'name', 'lowerName',
-                            ([('parentId', 1), ('name', 1)], {})))
+        self._ancestorsComplete = False
+        self.ensureIndices(('parentId', 'name', 'lowerName', 'public',
+                            'access.users.id', 'access.groups.id',
+                            'ancestors._id',
+                            ('deleted', {'sparse': True}),
+                            ('ancestorsMove', {'sparse': True}),
+                            ([('parentId', 1), ('name', 1)], {}),
+                            ([('parentId', 1), ('lowerName', 1), ('_id', 1)],
+                             {})))
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -52,7 +72,7 @@ class Folder(AccessControlledModel):
         self.exposeFields(level=AccessType.READ, fields=(
             '_id', 'name', 'public', 'description', 'created', 'updated',
             'size', 'meta', 'parentId', 'parentCollection', 'creatorId',
-            'baseParentType', 'baseParentId'))
+            'baseParentType', 'baseParentId') + RECURSIVE_FIELDS)
 
     def filter(self, *args, **kwargs):
         """
@@ -66,6 +86,22 @@ class Folder(AccessControlledModel):
             args = [kwargs.pop('folder')] + list(args)
         return super(Folder, self).filter(*args, **kwargs)
 
+    def textSearch(self, query, user=None, filters=None, **kwargs):
+        """
+        Override of textSearch that hides folders that are being deleted.
+        """
+        filters = dict(filters or {}, deleted={'$exists': False})
+        return super(Folder, self).textSearch(
+            query, user=user, filters=filters, **kwargs)
+
+    def prefixSearch(self, query, user=None, filters=None, **kwargs):
+        """
+        Override of prefixSearch that hides folders that are being deleted.
+        """
+        filters = dict(filters or {}, deleted={'$exists': False})
+        return super(Folder, self).prefixSearch(
+            query, user=user, filters=filters, **kwargs)
+
     def validate(self, doc, allowRename=False):
         """
         Validate the name and description of the folder, ensure that it is
@@ -120,6 +156,26 @@ class Folder(AccessControlledModel):
             name = '%s (%d)' % (doc['name'], n)
         return doc
 
+    def save(self, document, validate=True, triggerEvents=True):
+        """
+        We override save so that every folder has an ancestors list, however
+        it was created.
+        """
+        if 'ancestors' not in document and 'parentId' in document:
+            self.getAncestors(document)
+        return AccessControlledModel.save(
+            self, document, validate=validate, triggerEvents=triggerEvents)
+
+    def saveMany(self, documents, *args, **kwargs):
+        """
+        We override saveMany for the same reason as save.
+        """
+        documents = list(documents)
+        for doc in documents:
+            if 'ancestors' not in doc and 'parentId' in doc:
+                self.getAncestors(doc)
+        return AccessControlledModel.saveMany(self, documents, *args, **kwargs)
+
     def load(self, id, level=AccessType.ADMIN, user=None, objectId=True,
              force=False, fields=None, exc=False):
         """
@@ -140,31 +196,238 @@ class Folder(AccessControlledModel):
             self, id=id, objectId=objectId, level=level, fields=fields,
             exc=exc, force=force, user=user)
 
-        if doc is not None and 'baseParentType' not in doc:
+        # Only fix up complete documents, since this may save them
+        if doc is not None and fields is None:
+            self._fixupLoaded(doc, user)
+
+        return doc
+
+    def loadMany(self, ids, level=AccessType.ADMIN, user=None, objectId=True,
+                 force=False, fields=None, exc=False):
+        """
+        We override loadMany for the same reason as load.
+        """
+        docs = AccessControlledModel.loadMany(
+            self, ids, objectId=objectId, level=level, fields=fields,
+            exc=exc, force=force, user=user)
+
+        if fields is None:
+            for doc in docs:
+                self._fixupLoaded(doc, user)
+
+        return docs
+
+    def _fixupLoaded(self, doc, user):
+        """
+        Add fields that older folder documents may be missing.
+        """
+        if 'baseParentType' not in doc:
             pathFromRoot = self.parentsToRoot(doc, user=user, force=True)
             baseParent = pathFromRoot[0]
             doc['baseParentId'] = baseParent['object']['_id']
             doc['baseParentType'] = baseParent['type']
             self.save(doc, triggerEvents=False)
-        if doc is not None and 'lowerName' not in doc:
+        if 'ancestors' not in doc:
+            self.getAncestors(doc)
+            self.save(doc, triggerEvents=False)
+        if 'lowerName' not in doc:
             self.save(doc, triggerEvents=False)
 
-        return doc
+    def getAncestors(self, folder):
+        """
+        Return the ancestors of a folder: an ordered list, from the root of
+        the hierarchy to the folder's parent, of dicts with the "_id" and
+        "type" of each ancestor. This is stored in the folder's "ancestors"
+        field; for older documents that lack it, it is computed by walking up
+        the hierarchy and set on the document (but not saved).
+
+        :param folder: The folder. If this only has an _id, the folder is
+            loaded.
+        :type folder: dict
+        """
+        if 'ancestors' not in folder and 'parentId' not in folder:
+            folder['ancestors'] = self.getAncestors(
+                self.load(folder['_id'], force=True))
+        elif 'ancestors' not in folder:
+            folder['ancestors'] = [{
+                '_id': parent['object']['_id'],
+                'type': parent['type']
+            } for parent in self.parentsToRoot(folder, force=True)]
+
+        return folder['ancestors']
+
+    def getChildAncestors(self, folder):
+        """
+        Return the ancestors list for folders and items directly inside the
+        given folder.
+
+        :param folder: The parent folder.
+        :type folder: dict
+        """
+        return self.getAncestors(folder) + [{
+            '_id': folder['_id'],
+            'type': 'folder'
+        }]
+
+    def hasCompleteAncestors(self):
+        """
+        Return whether every folder and item has an ancestors list, so that
+        queries on the ancestors can be used to find whole subtrees. Once this
+        is true it stays true, since folders and items are always given
+        ancestors when they are saved, so the answer is then cached.
+        """
+        if not self._ancestorsComplete:
+            self._ancestorsComplete = all(
+                self.model(model).findOne(
+                    {'ancestors._id': None}, fields=['_id']) is None
+                for model in ('folder', 'item'))
+
+        return self._ancestorsComplete
+
+    def incrementRecursive(self, ancestors, size=0, items=0, folders=0,
+                           files=0, sync=False):
+        """
+        Atomically adjust the recursive size and counts of the folders in an
+        ancestors list, when something underneath them is created, removed,
+        resized or moved. Folders that do not have these fields yet are left
+        alone; the consistency check computes them.
+
+        :param ancestors: An ancestors list, as stored on folders and items.
+            Entries that are not folders are ignored.
+        :type ancestors: list
+        :param size: The change in total size.
+        :param items: The change in the number of items.
+        :param folders: The change in the number of folders.
+        :param files: The change in the number of files.
+        :param sync: Whether to write the change immediately, even if size
+            changes are being merged by the size aggregator.
+        :type sync: bool
+        """
+        ids = [doc['_id'] for doc in ancestors if doc['type'] == 'folder']
+        inc = {field: amount for field, amount in zip(
+            RECURSIVE_FIELDS, (size, items, folders, files)) if amount}
+        sizeAggregator.increment(
+            self, ids, inc, requireField='recursiveSize', sync=sync)
+
+    def _computeRecursiveCounts(self, root=None):
+        """
+        Compute the recursive size and counts of every folder, or of every
+        folder in the subtree of a root folder, from the folders, items, and
+        files themselves. This requires every document to have its ancestors.
+
+        :param root: The folder at the root of the subtree, or None for all
+            folders.
+        :type root: dict or None
+        :returns: A dict of folder _id to the current and computed values of
+            the recursive fields.
+        """
+        query = {} if root is None else {'ancestors._id': root['_id']}
+        folders = list(self.find(query, fields=('size',) + RECURSIVE_FIELDS))
+        if root is not None:
+            folders.append(root)
+
+        totals = {}
+        for folder in folders:
+            current = {field: folder.get(field) for field in RECURSIVE_FIELDS}
+            computed = dict.fromkeys(RECURSIVE_FIELDS, 0)
+            computed['recursiveSize'] = folder.get('size', 0)
+            totals[folder['_id']] = (current, computed)
+
+        for result in self.collection.aggregate([
+            {'$match': query},
+            {'$unwind': '$ancestors'},
+            {'$match': {'ancestors.type': 'folder'}},
+            {'$group': {
+                '_id': '$ancestors._id',
+                'size': {'$sum': '$size'},
+                'count': {'$sum': 1}
+            }}
+        ]):
+            if result['_id'] in totals:
+                computed = totals[result['_id']][1]
+                computed['recursiveSize'] += result['size']
+                computed['recursiveFolderCount'] += result['count']
+
+        def countItems(items):
+            fileCounts = {
+                result['_id']: result['count']
+                for result in self.model('file').collection.aggregate([
+                    {'$match': {'itemId': {'$in': [
+                        item['_id'] for item in items]}}},
+                    {'$group': {'_id': '$itemId', 'count': {'$sum': 1}}}
+                ])}
+            for item in items:
+                for ancestor in item['ancestors']:
+                    if ancestor['_id'] in totals:
+                        computed = totals[ancestor['_id']][1]
+                        computed['recursiveItemCount'] += 1
+                        computed['recursiveFileCount'] += fileCounts.get(
+                            item['_id'], 0)
+
+        items = []
+        for item in self.model('item').find(query, fields=['ancestors']):
+            items.append(item)
+            if len(items) == DESCENDANT_BATCH_SIZE:
+                setResponseTimeLimit()
+                countItems(items)
+                items = []
+        if items:
+            countItems(items)
+
+        return totals
+
+    def updateRecursiveCounts(self, root=None):
+        """
+        Recompute and save the recursive size and counts of every folder, or of
+        every folder in the subtree of a root folder. This requires every
+        document to have its ancestors.
+
+        :param root: The folder at the root of the subtree, or None for all
+            folders.
+        :type root: dict or None
+        :returns: The _ids of the folders whose values changed.
+        """
+        sizeAggregator.flush()
+        changed = []
+        requests = []
+        for folderId, (current, computed) in six.viewitems(
+                self._computeRecursiveCounts(root)):
+            if current != computed:
+                changed.append(folderId)
+                requests.append(UpdateOne(
+                    {'_id': folderId}, {'$set': computed}))
+            if len(requests) == DESCENDANT_BATCH_SIZE:
+                self.collection.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+
+        if changed:
+            self._invalidateIdentityMap()
+        return changed
 
     def getSizeRecursive(self, folder):
         """
-        Calculate the total size of the folder by recursing into all of its
-        descendant folders.
+        Calculate the total size of the folder and all of its descendant
+        folders. This is maintained in the folder's recursiveSize field, and
+        only computed for folders that do not have it yet.
         """
+        if 'recursiveSize' in folder:
+            return folder['recursiveSize']
+
         size = folder['size']
 
-        q = {
-            'parentId': folder['_id'],
-            'parentCollection': 'folder'
-        }
+        if self.hasCompleteAncestors():
+            for result in self.collection.aggregate([
+                {'$match': {'ancestors._id': folder['_id']}},
+                {'$group': {'_id': None, 'size': {'$sum': '$size'}}}
+            ]):
+                size += result['size']
+            return size
 
-        for child in self.find(q):
-            size += self.getSizeRecursive(child)
+        for folders, subfolders, items, files in self.walkSubtree(
+                folder, level=None, includeItems=False):
+            size += sum(child['size'] for child in subfolders)
 
         return size
 
@@ -197,31 +460,157 @@ class Folder(AccessControlledModel):
         # Validate and save the item
         return self.save(folder)
 
-    def _updateDescendants(self, folderId, updateQuery):
+    def _updateDescendants(self, folderId, updateQuery, progress=noProgress):
         """
         This helper is used to update all items and folders underneath a
-        folder. This is expensive, so think carefully before using it.
+        folder. Once every document records its ancestors, this is a single
+        update per collection; otherwise the subtree is walked one level at a
+        time, updating the children of up to DESCENDANT_BATCH_SIZE folders with
+        each pair of updates.
 
         :param folderId: The _id of the folder at the root of the subtree.
         :param updateQuery: The mongo query to apply to all of the children of
         the folder.
         :type updateQuery: dict
+        :param progress: A progress context to record progress on. Progress is
+            incremented once per folder whose children have been updated.
+        :type progress: girder.utility.progress.ProgressContext or None.
         """
-        self.update(query={
-            'parentId': folderId,
-            'parentCollection': 'folder'
-        }, update=updateQuery, multi=True)
-        self.model('item').update(query={
-            'folderId': folderId,
-        }, update=updateQuery, multi=True)
+        if self.hasCompleteAncestors():
+            query = {'ancestors._id': folderId}
+            result = self.update(query=query, update=updateQuery, multi=True)
+            self.model('item').update(
+                query=query, update=updateQuery, multi=True)
+            # Count the root and each folder underneath it, as the walk does
+            progress.update(increment=result.matched_count + 1)
+            return
+
+        level = [folderId]
+        while level:
+            children = []
+            for i in range(0, len(level), DESCENDANT_BATCH_SIZE):
+                batch = level[i:i + DESCENDANT_BATCH_SIZE]
+                query = {
+                    'parentId': {'$in': batch},
+                    'parentCollection': 'folder'
+                }
+                self.update(query=query, update=updateQuery, multi=True)
+                self.model('item').update(query={
+                    'folderId': {'$in': batch}
+                }, update=updateQuery, multi=True)
+                children.extend(
+                    child['_id'] for child in self.find(query, fields=()))
+                progress.update(increment=len(batch))
+            level = children
+
+    def walkSubtree(self, folder, user=None, level=AccessType.READ,
+                    includeItems=True, includeFiles=False, exclude=()):
+        """
+        Walk the subtree under a folder breadth-first. Rather than querying the
+        children of each folder separately, the folders at each depth are
+        handled in batches of up to DESCENDANT_BATCH_SIZE, with one query for
+        the subfolders of a batch, one for its items, and optionally one for
+        the files of each batch of up to DESCENDANT_BATCH_SIZE of those items.
+
+        This yields a (folders, subfolders, items, files) tuple for each batch,
+        starting with the folder itself. Subfolders is a batch of the folders
+        directly inside the folders of the batch that the user has the
+        required access on; these are walked in later batches. Items is a
+        batch of the items directly inside the folders, and files is a dict of
+        the _id of each of those items to the list of its files. If the
+        folders hold more subfolders or items than fit in one batch, the same
+        folders are yielded again for each further batch of either. Only the
+        _ids of the folders at the next depth are kept while a depth is
+        walked, and their documents are loaded a batch at a time.
+
+        :param folder: The folder at the root of the subtree.
+        :type folder: dict
+        :param user: The user to check access to the folders against.
+        :param level: The access level required on each folder, or None to
+            walk every folder. Folders the user lacks it on are skipped along
+            with everything underneath them.
+        :type level: AccessType or None
+        :param includeItems: Whether to find the items in the folders.
+        :type includeItems: bool
+        :param includeFiles: Whether to find the files in the items.
+        :type includeFiles: bool
+        :param exclude: The _ids of folders to skip, along with everything
+            underneath them.
+        :type exclude: list
+        """
+        depth = [folder['_id']]
+        while depth:
+            nextDepth = []
+            for start in six.moves.range(0, len(depth), DESCENDANT_BATCH_SIZE):
+                setResponseTimeLimit()
+                folderIds = depth[start:start + DESCENDANT_BATCH_SIZE]
+                if folderIds[0] == folder['_id']:
+                    folders = [folder]
+                else:
+                    folders = list(self.find({'_id': {'$in': folderIds}}))
+                query = {
+                    'parentId': {'$in': folderIds},
+                    'parentCollection': 'folder',
+                    'deleted': {'$exists': False}
+                }
+                if exclude:
+                    query['_id'] = {'$nin': list(exclude)}
+                if level is None:
+                    cursor = self.find(query)
+                else:
+                    cursor = self.findWithPermissions(
+                        query, user=user, level=level)
+
+                batches = iter(())
+                if includeItems:
+                    batches = self._walkItems(folderIds, includeFiles)
+                # Each batch of folders is yielded at least once
+                batches = six.moves.zip_longest(
+                    self._walkFolders(cursor), batches)
+                subfolders, itemBatch = next(batches, (None, None))
+                while True:
+                    subfolders = subfolders or []
+                    items, files = itemBatch or ([], {})
+                    nextDepth.extend(doc['_id'] for doc in subfolders)
+                    yield folders, subfolders, items, files
+                    subfolders, itemBatch = next(batches, (None, None))
+                    if subfolders is None and itemBatch is None:
+                        break
+            depth = nextDepth
+
+    def _walkFolders(self, cursor):
+        """
+        Yield the subfolders of a batch of folders for walkSubtree, in batches
+        of up to DESCENDANT_BATCH_SIZE.
+        """
+        cursor = iter(cursor)
+        while True:
+            folders = list(itertools.islice(cursor, DESCENDANT_BATCH_SIZE))
+            if not folders:
+                return
+            setResponseTimeLimit()
+            yield folders
 
-        q = {
-            'parentId': folderId,
-            'parentCollection': 'folder'
-        }
-        for child in self.find(q):
-            self._updateDescendants(
-                child['_id'], updateQuery)
+    def _walkItems(self, folderIds, includeFiles):
+        """
+        Yield the items in a batch of folders for walkSubtree, in batches of up
+        to DESCENDANT_BATCH_SIZE, each with a dict of its files by item _id.
+        """
+        cursor = self.model('item').find({
+            'folderId': {'$in': folderIds},
+            'deleted': {'$exists': False}
+        })
+        while True:
+            items = list(itertools.islice(cursor, DESCENDANT_BATCH_SIZE))
+            if not items:
+                return
+            setResponseTimeLimit()
+            files = {}
+            if includeFiles:
+                for file in self.model('file').find({
+                        'itemId': {'$in': [item['_id'] for item in items]}}):
+                    files.setdefault(file['itemId'], []).append(file)
+            yield items, files
 
     def _isAncestor(self, ancestor, descendant):
         """
@@ -236,6 +625,10 @@ class Folder(AccessControlledModel):
         if ancestor['_id'] == descendant['_id']:
             return True
 
+        if 'ancestors' in descendant:
+            return any(doc['_id'] == ancestor['_id']
+                       for doc in descendant['ancestors'])
+
         if descendant['parentCollection'] != 'folder':
             return False
 
@@ -246,10 +639,122 @@ class Folder(AccessControlledModel):
 
         return self._isAncestor(ancestor, descendant)
 
-    def move(self, folder, parent, parentType):
+    def _moveDescendantAncestors(self, folder):
+        """
+        Replace the leading ancestors of every folder and item underneath a
+        folder that has been moved. The folder records the move in its
+        "ancestorsMove" field, with the ancestors it had before, until this
+        is finished, so that resumeMoves can finish it if the server stops
+        part way through. Each step is safe to repeat.
+
+        The new ancestors are inserted, marked with the _id of the move,
+        before the old ones are removed, so no document is ever left without
+        the ancestors of the folder. The marks are then removed.
+
+        :param folder: The moved folder, with its new ancestors.
+        :type folder: dict
+        """
+        move = folder['ancestorsMove']
+        oldPrefix = move['from'] + [{'_id': folder['_id'], 'type': 'folder'}]
+        query = {'ancestors._id': folder['_id']}
+        query.update({'ancestors.%d._id' % i: doc['_id']
+                      for i, doc in enumerate(oldPrefix)})
+        marked = {'ancestors.move': move['_id']}
+
+        for model in (self, self.model('item')):
+            model.update(query, {'$push': {'ancestors': {
+                '$each': [dict(doc, move=move['_id'])
+                          for doc in folder['ancestors']],
+                '$position': 0
+            }}})
+            model.update(marked, {'$pull': {'ancestors': {
+                '_id': {'$in': [doc['_id'] for doc in move['from']]},
+                'move': {'$exists': False}
+            }}})
+            while model.update(marked, {
+                    '$unset': {'ancestors.$.move': True}}).matched_count:
+                pass
+
+        self.update({'_id': folder['_id']},
+                    {'$unset': {'ancestorsMove': True}}, multi=False)
+        del folder['ancestorsMove']
+
+    def resumeMoves(self):
+        """
+        Finish replacing the ancestors underneath folders whose move was
+        interrupted by a previous shutdown. This is called when the server
+        starts.
+        """
+        for folder in self.find({'ancestorsMove': {'$exists': True}}):
+            logger.info('Resuming move of folder %s.' % folder['_id'])
+            self._moveDescendantAncestors(folder)
+
+    def _moveRecursiveCounts(self, folder, oldAncestors, newAncestors):
+        """
+        Move the recursive size and counts of a folder's subtree, including the
+        folder itself, from its old ancestors to its new ones. If the folder
+        does not have these fields and they cannot be computed because some
+        documents lack their ancestors, the fields are instead removed from
+        both sets of ancestors so that they are no longer trusted.
+        """
+        if 'recursiveSize' not in folder and self.hasCompleteAncestors():
+            self.updateRecursiveCounts(folder)
+            folder.update(self.load(
+                folder['_id'], force=True, fields=RECURSIVE_FIELDS))
+
+        if 'recursiveSize' not in folder:
+            self._clearRecursiveCounts(oldAncestors + newAncestors)
+            return
+
+        amounts = (folder['recursiveSize'], folder['recursiveItemCount'],
+                   folder['recursiveFolderCount'] + 1,
+                   folder['recursiveFileCount'])
+        self.incrementRecursive(oldAncestors, *[-n for n in amounts])
+        self.incrementRecursive(newAncestors, *amounts)
+
+    def _clearRecursiveCounts(self, ancestors):
+        """
+        Remove the recursive size and counts from the folders in an ancestors
+        list, when a change to them cannot be computed, so that they are no
+        longer trusted.
+        """
+        ids = [doc['_id'] for doc in ancestors if doc['type'] == 'folder']
+        if ids:
+            self.update({'_id': {'$in': ids}}, {
+                '$unset': dict.fromkeys(RECURSIVE_FIELDS, '')})
+
+    def _subtractSubtree(self, folder, includeFolder):
+        """
+        Remove the size and counts of everything underneath a folder, and of
+        the folder itself if includeFolder is set, from its ancestors and its
+        base parent, before the subtree is deleted.
+        """
+        if sizeAggregator.deferred:
+            sizeAggregator.flush()
+            folder.update(self.findOne({'_id': folder['_id']}, fields=(
+                'size',) + RECURSIVE_FIELDS))
+
+        size = self.getSizeRecursive(folder)
+        if size:
+            sizeAggregator.increment(
+                self.model(folder['baseParentType']),
+                [folder['baseParentId']], {'size': -size})
+
+        ancestors = self.getAncestors(folder)
+        if 'recursiveSize' in folder:
+            self.incrementRecursive(
+                ancestors, -size, -folder['recursiveItemCount'],
+                -folder['recursiveFolderCount'] - int(includeFolder),
+                -folder['recursiveFileCount'])
+        else:
+            self._clearRecursiveCounts(ancestors)
+
+    def move(self, folder, parent, parentType, progress=noProgress):
         """
         Move the given folder from its current parent to another parent object.
-        Raises an exception if folder is an ancestor of parent.
+        Raises an exception if folder is an ancestor of parent. The ancestors
+        and base parent of every descendant are rewritten with bulk updates,
+        and the sizes of the old and new base parents are each adjusted once.
 
         :param folder: The folder to move.
         :type folder: dict
@@ -257,12 +762,30 @@ class Folder(AccessControlledModel):
         :param parentType: The type of the new parent object (user, collection,
                            or folder).
         :type parentType: str
+        :param progress: A progress context to record progress on.
+        :type progress: girder.utility.progress.ProgressContext or None.
         """
         if (parentType == 'folder' and (self._isAncestor(folder, parent) or
                                         folder['_id'] == parent['_id'])):
             raise ValidationException(
                 'You may not move a folder underneath itself.')
 
+        # The sizes and counts that are moved must be up to date
+        if sizeAggregator.deferred:
+            sizeAggregator.flush()
+            folder.update(self.findOne({'_id': folder['_id']}, fields=(
+                'size',) + RECURSIVE_FIELDS))
+        oldAncestors = self.getAncestors(folder)
+        if parentType == 'folder':
+            folder['ancestors'] = self.getChildAncestors(parent)
+        else:
+            folder['ancestors'] = [{'_id': parent['_id'], 'type': parentType}]
+        moved = folder['ancestors'] != oldAncestors
+        if moved:
+            self._moveRecursiveCounts(
+                folder, oldAncestors, folder['ancestors'])
+            folder['ancestorsMove'] = {'_id': ObjectId(), 'from': oldAncestors}
+
         folder['parentId'] = parent['_id']
         folder['parentCollection'] = parentType
 
@@ -288,14 +811,19 @@ class Folder(AccessControlledModel):
                     'baseParentType': rootType,
                     'baseParentId': rootId
                 }
-            })
+            }, progress=progress)
 
-        return self.save(folder)
+        folder = self.save(folder)
+        if moved:
+            self._moveDescendantAncestors(folder)
+        return folder
 
     def clean(self, folder, progress=None, **kwargs):
         """
         Delete all contents underneath a folder recursively, but leave the
-        folder itself.
+        folder itself. The contents are marked as deleted, which hides them
+        from listings, and then removed in batches; see
+        :py:class:`girder.models.deletion.Deletion`.
 
         :param folder: The folder document to delete.
         :type folder: dict
@@ -303,51 +831,32 @@ class Folder(AccessControlledModel):
         :type progress: girder.utility.progress.ProgressContext or None.
         """
         setResponseTimeLimit()
-        # Delete all child items
-        items = self.model('item').find({
-            'folderId': folder['_id']
-        })
-        for item in items:
-            setResponseTimeLimit()
-            self.model('item').remove(item, progress=progress, **kwargs)
-            if progress:
-                progress.update(increment=1, message='Deleted item %s' %
-                                item['name'])
-        # subsequent operations take a long time, so free the cursor's resources
-        items.close()
-
-        # Delete all child folders
-        folders = self.find({
-            'parentId': folder['_id'],
-            'parentCollection': 'folder'
-        })
-        for subfolder in folders:
-            self.remove(subfolder, progress=progress, **kwargs)
-        folders.close()
+        self._subtractSubtree(folder, includeFolder=False)
+        empty = dict.fromkeys(RECURSIVE_FIELDS, 0)
+        empty['size'] = 0
+        self.update({'_id': folder['_id']}, {'$set': empty})
+        folder.update(empty)
+
+        deletion = self.model('deletion').createDeletion(
+            folder, 'folder', removeRoot=False)
+        self.model('deletion').collect(deletion, progress=progress, **kwargs)
 
     def remove(self, folder, progress=None, **kwargs):
         """
-        Delete a folder recursively.
+        Delete a folder recursively. The folder and its contents are marked as
+        deleted, which hides them from listings, and then removed in batches;
+        see :py:class:`girder.models.deletion.Deletion`.
 
         :param folder: The folder document to delete.
         :type folder: dict
         :param progress: A progress context to record progress on.
         :type progress: girder.utility.progress.ProgressContext or None.
         """
-        # Remove the contents underneath this folder recursively.
-        self.clean(folder, progress, **kwargs)
-
-        # Delete pending uploads into this folder
-        uploads = self.model('upload').find({
-            'parentId': folder['_id'],
-            'parentType': 'folder'
-        })
-        for upload in uploads:
-            self.model('upload').remove(upload, progress=progress, **kwargs)
-        uploads.close()
+        setResponseTimeLimit()
+        self._subtractSubtree(folder, includeFolder=True)
 
-        # Delete this folder
-        AccessControlledModel.remove(self, folder, progress=progress, **kwargs)
+        deletion = self.model('deletion').createDeletion(folder, 'folder')
+        self.model('deletion').collect(deletion, progress=progress, **kwargs)
         if progress:
             progress.update(increment=1, message='Deleted folder %s' %
                             folder['name'])
@@ -368,7 +877,8 @@ class Folder(AccessControlledModel):
             filters = {}
 
         q = {
-            'folderId': folder['_id']
+            'folderId': folder['_id'],
+            'deleted': {'$exists': False}
         }
         q.update(filters)
 
@@ -403,17 +913,14 @@ class Folder(AccessControlledModel):
 
         q = {
             'parentId': parent['_id'],
-            'parentCollection': parentType
+            'parentCollection': parentType,
+            'deleted': {'$exists': False}
         }
         q.update(filters)
 
-        # Perform the find; we'll do access-based filtering of the result set
-        # afterward.
-        cursor = self.find(q, sort=sort, **kwargs)
-
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
-            offset=offset)
+        return self.findWithPermissions(
+            q, sort=sort, user=user, level=AccessType.READ, limit=limit,
+            offset=offset, **kwargs)
 
     def createFolder(self, parent, name, description='', parentType='folder',
                      public=None, creator=None, allowRename=False,
@@ -488,6 +995,12 @@ class Folder(AccessControlledModel):
             'updated': now,
             'size': 0
         }
+        folder.update(dict.fromkeys(RECURSIVE_FIELDS, 0))
+
+        if parentType == 'folder':
+            folder['ancestors'] = self.getChildAncestors(parent)
+        else:
+            folder['ancestors'] = [{'_id': parent['_id'], 'type': parentType}]
 
         if parentType in ('folder', 'collection'):
             self.copyAccessPolicies(src=parent, dest=folder, save=False)
@@ -504,7 +1017,9 @@ class Folder(AccessControlledModel):
             self.validate(folder, allowRename=True)
 
         # Now validate and save the folder.
-        return self.save(folder)
+        folder = self.save(folder)
+        self.incrementRecursive(folder['ancestors'], folders=1)
+        return folder
 
     def updateFolder(self, folder):
         """
@@ -529,6 +1044,10 @@ class Folder(AccessControlledModel):
         :returns: an ordered list of dictionaries from root to the current
                   folder
         """
+        if not curPath and 'ancestors' in folder:
+            return self.ancestorsToPath(
+                folder['ancestors'], user=user, force=force, level=level)
+
         if not curPath:
             curPath = []
 
@@ -561,6 +1080,36 @@ class Folder(AccessControlledModel):
             return self.parentsToRoot(curParentObject, curPath, user=user,
                                       force=force)
 
+    def ancestorsToPath(self, ancestors, user=None, force=False,
+                        level=AccessType.READ):
+        """
+        Load the documents of an ancestors list, in the form returned by
+        parentsToRoot. All of the folders are loaded with a single query.
+
+        :param ancestors: The ancestors list of a folder or item.
+        :type ancestors: list
+        :param user: The user to check access against and filter for.
+        :param force: Set to True to skip access checks and filtering.
+        :param level: The access level required on every ancestor.
+        """
+        folders = {doc['_id']: doc for doc in self.loadMany(
+            [doc['_id'] for doc in ancestors if doc['type'] == 'folder'],
+            user=user, level=level, force=force)}
+
+        path = []
+        for ancestor in ancestors:
+            model = self.model(ancestor['type'])
+            if ancestor['type'] == 'folder':
+                doc = folders.get(ancestor['_id'])
+            else:
+                doc = model.load(
+                    ancestor['_id'], user=user, level=level, force=force)
+            if not force:
+                doc = model.filter(doc, user)
+            path.append({'type': ancestor['type'], 'object': doc})
+
+        return path
+
     def countItems(self, folder):
         """
         Returns the number of items within the given folder.
@@ -608,21 +1157,27 @@ class Folder(AccessControlledModel):
         """
         count = 1
 
-        if includeItems:
-            count += self.countItems(folder)
-
-        folders = self.find({
-            'parentId': folder['_id'],
-            'parentCollection': 'folder'
-        }, fields=('access',))
-
-        if level is not None:
-            folders = self.filterResultsByPermission(
-                cursor=folders, user=user, level=level)
-
-        count += sum(self.subtreeCount(subfolder, includeItems=includeItems,
-                                       user=user, level=level)
-                     for subfolder in folders)
+        if level is None and 'recursiveFolderCount' in folder:
+            count += folder['recursiveFolderCount']
+            if includeItems:
+                count += folder['recursiveItemCount']
+            return count
+
+        if level is None and self.hasCompleteAncestors():
+            query = {'ancestors._id': folder['_id']}
+            count += self.find(query, fields=()).count()
+            if includeItems:
+                count += self.model('item').find(query, fields=()).count()
+            return count
+
+        for folders, subfolders, items, files in self.walkSubtree(
+                folder, user=user, level=level, includeItems=False):
+            count += len(subfolders)
+            if includeItems:
+                count += self.model('item').find({
+                    'folderId': {'$in': [doc['_id'] for doc in folders]},
+                    'deleted': {'$exists': False}
+                }, fields=()).count()
 
         return count
 
@@ -651,23 +1206,51 @@ class Folder(AccessControlledModel):
         if subpath:
             path = os.path.join(path, doc['name'])
         metadataFile = "girder-folder-metadata.json"
-        for sub in self.childFolders(parentType='folder', parent=doc,
-                                     user=user):
-            if sub['name'] == metadataFile:
-                metadataFile = None
-            for (filepath, file) in self.fileList(
-                    sub, user, path, includeMetadata, subpath=True):
-                yield (filepath, file)
-        for item in self.childItems(folder=doc):
-            if item['name'] == metadataFile:
-                metadataFile = None
-            for (filepath, file) in self.model('item').fileList(
-                    item, user, path, includeMetadata):
-                yield (filepath, file)
-        if includeMetadata and metadataFile and doc.get('meta', {}):
-            def stream():
-                yield json.dumps(doc['meta'], default=str)
-            yield (os.path.join(path, metadataFile), stream)
+        paths = {doc['_id']: path}
+        lastFolders = None
+        for folders, subfolders, items, files in self.walkSubtree(
+                doc, user=user, includeFiles=True):
+            for sub in subfolders:
+                paths[sub['_id']] = os.path.join(
+                    paths[sub['parentId']], sub['name'])
+            if includeMetadata and folders is not lastFolders:
+                for (filepath, stream) in self._metadataFiles(
+                        folders, user, paths, metadataFile):
+                    yield (filepath, stream)
+            lastFolders = folders
+            for item in items:
+                for (filepath, file) in self.model('item').fileList(
+                        item, user, paths[item['folderId']], includeMetadata,
+                        files=files.get(item['_id'], [])):
+                    yield (filepath, file)
+
+    def _metadataFiles(self, folders, user, paths, metadataFile):
+        """
+        Generate the metadata files of a batch of folders for fileList, for
+        the folders that have metadata and no child with the metadata file's
+        name.
+        """
+        folders = [folder for folder in folders if folder.get('meta', {})]
+        if not folders:
+            return
+        folderIds = [folder['_id'] for folder in folders]
+        taken = {sub['parentId'] for sub in self.findWithPermissions({
+            'parentId': {'$in': folderIds},
+            'parentCollection': 'folder',
+            'name': metadataFile,
+            'deleted': {'$exists': False}
+        }, user=user, level=AccessType.READ)}
+        taken.update(item['folderId'] for item in self.model('item').find({
+            'folderId': {'$in': folderIds},
+            'name': metadataFile
+        }, fields=['folderId']))
+        for folder in folders:
+            if folder['_id'] not in taken:
+                yield (os.path.join(paths[folder['_id']], metadataFile),
+                       functools.partial(self._streamMetadata, folder))
+
+    def _streamMetadata(self, folder):
+        yield json.dumps(folder['meta'], default=str)
 
     def copyFolder(self, srcFolder, parent=None, name=None, description=None,
                    parentType=None, public=None, creator=None, progress=None,
@@ -730,7 +1313,11 @@ class Folder(AccessControlledModel):
                              firstFolder=None):
         """
         Copy the items, subfolders, and extended data of a folder that was just
-        copied.
+        copied. The subtree is copied one level at a time, and the new folders,
+        items, and files of each batch of folders in a level are written with
+        bulk inserts. The copies keep the sizes of the originals, and the
+        recursive size and counts of the new folders and the sizes above them
+        are updated once, after everything has been copied.
 
         :param srcFolder: the original folder.
         :type srcFolder: dict
@@ -741,40 +1328,120 @@ class Folder(AccessControlledModel):
         :param progress: a progress context to record process on.
         :type progress: girder.utility.progress.ProgressContext or None.
         :param firstFolder: if not None, the first folder copied in a tree of
-                            folders.
+                            folders. It is skipped if it is in the subtree.
         :returns: the new folder document.
         """
+        progress = progress or noProgress
         # copy metadata and other extension values
         filteredFolder = self.filter(newFolder, creator)
-        updated = False
         for key in srcFolder:
             if key not in filteredFolder and key not in newFolder:
                 newFolder[key] = copy.deepcopy(srcFolder[key])
-                updated = True
-        if updated:
-            self.save(newFolder, triggerEvents=False)
+        newFolder['size'] = srcFolder.get('size', 0)
+        self.save(newFolder, triggerEvents=False)
         # Give listeners a chance to change things
         events.trigger('model.folder.copy.prepare', (srcFolder, newFolder))
-        # copy items
-        for item in self.childItems(folder=srcFolder):
-            setResponseTimeLimit()
-            self.model('item').copyItem(item, creator, folder=newFolder)
-            if progress:
-                progress.update(increment=1, message='Copied item ' +
-                                item['name'])
-        # copy subfolders
-        for sub in self.childFolders(parentType='folder', parent=srcFolder,
-                                     user=creator):
-            if firstFolder and firstFolder['_id'] == sub['_id']:
-                continue
-            self.copyFolder(sub, parent=newFolder, parentType='folder',
-                            creator=creator, progress=progress)
-        events.trigger('model.folder.copy.after', newFolder)
-        if progress:
-            progress.update(increment=1, message='Copied folder ' +
-                            newFolder['name'])
+
+        copied = [newFolder]
+        copies = {srcFolder['_id']: newFolder}
+        exclude = [firstFolder['_id']] if firstFolder else ()
+        for folders, subfolders, items, files in self.walkSubtree(
+                srcFolder, user=creator, exclude=exclude):
+            for start in six.moves.range(
+                    0, len(subfolders), DESCENDANT_BATCH_SIZE):
+                batch = subfolders[start:start + DESCENDANT_BATCH_SIZE]
+                copied.extend(self._copySubfolders(batch, copies, creator))
+                progress.update(increment=len(batch),
+                                message='Copied folder ' + batch[-1]['name'])
+            if items:
+                self.model('item').copyItems(items, copies, creator)
+                progress.update(increment=len(items), message='Copied item ' +
+                                items[-1]['name'])
+
+        self._addCopiedSizes(newFolder)
+
+        # Folders are finished from the bottom of the tree up
+        for folder in reversed(copied):
+            events.trigger('model.folder.copy.after', folder)
+        progress.update(increment=1, message='Copied folder ' +
+                        newFolder['name'])
         return newFolder
 
+    def _copySubfolders(self, srcFolders, copies, creator):
+        """
+        Copy a batch of folders, without their contents, into the copies of
+        their parents. The copies inherit the access policies of their new
+        parents. They are written with one bulk insert, and the save events
+        of each one are still triggered. Folders whose parents were not copied
+        are skipped.
+
+        :param srcFolders: the folders to copy.
+        :type srcFolders: list
+        :param copies: a dict of the _id of each original folder to its copy.
+            The new folders are added to it.
+        :type copies: dict
+        :returns: the list of new folders.
+        """
+        now = datetime.datetime.utcnow()
+        newFolders = []
+        srcFolders = [srcFolder for srcFolder in srcFolders
+                      if srcFolder['parentId'] in copies]
+        for srcFolder in srcFolders:
+            parent = copies[srcFolder['parentId']]
+            folder = {
+                key: copy.deepcopy(value)
+                for key, value in six.viewitems(srcFolder)
+                if key not in ('_id', 'deleted', 'access', 'public')}
+            folder.update({
+                'lowerName': srcFolder['name'].lower(),
+                'parentCollection': 'folder',
+                'parentId': parent['_id'],
+                'baseParentId': parent['baseParentId'],
+                'baseParentType': parent['baseParentType'],
+                'ancestors': self.getChildAncestors(parent),
+                'creatorId': creator['_id'],
+                'created': now,
+                'updated': now,
+                'size': srcFolder.get('size', 0)
+            })
+            folder.update(dict.fromkeys(RECURSIVE_FIELDS, 0))
+            self.copyAccessPolicies(src=parent, dest=folder, save=False)
+            self.setUserAccess(folder, user=creator, level=AccessType.ADMIN,
+                               save=False)
+            newFolders.append(folder)
+        self.saveMany(newFolders, validate=False, documentEvents=True)
+        srcFolders, newFolders = zip(*[
+            (srcFolder, folder) for srcFolder, folder in zip(
+                srcFolders, newFolders) if '_id' in folder]) or ((), ())
+
+        for srcFolder, folder in zip(srcFolders, newFolders):
+            copies[srcFolder['_id']] = folder
+            # Give listeners a chance to change things
+            events.trigger('model.folder.copy.prepare', (srcFolder, folder))
+        return list(newFolders)
+
+    def _addCopiedSizes(self, folder):
+        """
+        Compute the recursive size and counts of a newly copied subtree, and
+        add them to the folders above it and its base parent. The folder
+        itself must already have been counted in its ancestors.
+        """
+        self.updateRecursiveCounts(folder)
+        totals = self.findOne(
+            {'_id': folder['_id']}, fields=RECURSIVE_FIELDS)
+        for field in RECURSIVE_FIELDS:
+            folder[field] = totals.get(field, 0)
+
+        self.incrementRecursive(
+            folder['ancestors'], size=folder['recursiveSize'],
+            items=folder['recursiveItemCount'],
+            folders=folder['recursiveFolderCount'],
+            files=folder['recursiveFileCount'])
+        if folder['recursiveSize']:
+            sizeAggregator.increment(
+                self.model(folder['baseParentType']),
+                [folder['baseParentId']], {'size': folder['recursiveSize']})
+
     def setAccessList(self, doc, access, save=False, recurse=False, user=None,
                       progress=noProgress, setPublic=None):
         """
@@ -806,17 +1473,222 @@ class Folder(AccessControlledModel):
         doc = AccessControlledModel.setAccessList(self, doc, access, save=save)
 
         if recurse:
-            cursor = self.find({
-                'parentId': doc['_id'],
-                'parentCollection': 'folder'
-            })
+            self.propagateAccessList(
+                doc, 'folder', user=user, progress=progress,
+                setPublic=setPublic)
 
-            subfolders = self.filterResultsByPermission(
-                cursor=cursor, user=user, level=AccessType.ADMIN)
+        return doc
 
-            for folder in subfolders:
-                self.setAccessList(
-                    folder, access, save=True, recurse=True, user=user,
-                    progress=progress, setPublic=setPublic)
+    def propagateAccessList(self, parent, parentType, user=None,
+                            progress=noProgress, setPublic=None):
+        """
+        Copy the access control list of a folder or collection to all of the
+        folders underneath it that the given user has ADMIN access on. Any
+        folder the user does not have ADMIN access on is skipped, along with
+        everything underneath it. The folders are updated with one database
+        update for the whole subtree if the user is unrestricted and every
+        folder records its ancestors, and otherwise with one per batch of
+        folders at each level of the subtree.
+
+        Each batch is written with saveMany, which triggers the per-document
+        "model.folder.save" and "model.folder.save.after" events as well as
+        the bulk ones, so handlers see each folder that is changed. The single
+        update, which cannot trigger them, is only used when no handler is
+        bound to any of those events.
+
+        :param parent: The folder or collection whose access list is copied.
+        :type parent: dict
+        :param parentType: The type of the parent: 'folder' or 'collection'.
+        :type parentType: str
+        :param user: The current user.
+        :param progress: Progress context to update.
+        :type progress: :py:class:`girder.utility.progress.ProgressContext`
+        :param setPublic: Pass this if you wish to set the public flag on the
+            folders being updated.
+        :type setPublic: bool or None
+        """
+        fields = {'access': parent['access']}
+        if setPublic is not None:
+            fields['public'] = setPublic
+
+        if (self._usesDefaultAccessCheck() and
+                self.permissionClauses(user, AccessType.ADMIN) is None and
+                self.hasCompleteAncestors() and not any(
+                    events.hasHandlers('model.folder.%s' % name) for name in (
+                        'save', 'save.after', 'save.bulk', 'save.bulk.after'))):
+            result = self.update(
+                {'ancestors._id': parent['_id']}, {'$set': fields})
+            progress.update(increment=result.matched_count,
+                            message='Updated %d folders' % result.matched_count)
+            return
+
+        parentIds = [parent['_id']]
+        while parentIds:
+            childIds = []
+            for start in six.moves.range(
+                    0, len(parentIds), DESCENDANT_BATCH_SIZE):
+                setResponseTimeLimit()
+                # Permissions are checked before the update, so the children
+                # of the updated folders are checked against their old lists
+                folders = list(self.findWithPermissions({
+                    'parentId': {
+                        '$in': parentIds[start:start + DESCENDANT_BATCH_SIZE]},
+                    'parentCollection': parentType
+                }, user=user, level=AccessType.ADMIN))
+                if folders:
+                    for folder in folders:
+                        folder.update(copy.deepcopy(fields))
+                    self.saveMany(folders, validate=False,
+                                  documentEvents=True)
+                    progress.update(
+                        increment=len(folders),
+                        message='Updated %d folders' % len(folders))
+                childIds.extend(folder['_id'] for folder in folders)
+            parentIds = childIds
+            parentType = 'folder'
+
+    def checkConsistency(self, stage, progress=None, report=False):
+        """
+        Check all of the folders and make sure they are valid. This operates in
+        the same stages as the item consistency check. The remove stage removes
+        the subtrees of folders whose parents do not exist. The verify stage
+        rebuilds the ancestors lists of all folders and items from the top of
+        the hierarchy down, which also backfills them for documents created
+        before they were maintained, and corrects the base parent of each
+        folder. The propagate stage recomputes the size of every folder from
+        its items, and then the recursive size and counts of every folder.
+
+        :param stage: which stage of the check to run: count, remove, verify,
+            or propagate.
+        :param progress: an optional progress context to update.
+        :param report: if True, only find the problems; do not correct them.
+        :type report: bool
+        :returns: numFolders: number of folders to check or processed,
+                  changed: a set of the _ids of the folders removed or changed.
+        """
+        if stage == 'count':
+            return self.find(limit=1).count(), set()
+        elif stage == 'remove':
+            return self._removeLostFolders(progress, report)
+        elif stage == 'verify':
+            if progress is not None:
+                progress.update(message='Checking folders')
+            return self._checkAncestors(progress, report)
+        elif stage == 'propagate':
+            if progress is not None:
+                progress.update(message='Checking folder sizes')
+            numFolders, changed = self.checkSizes(
+                self.model('item'), 'folderId', report=report)
+            if progress is not None:
+                progress.update(message='Computing folder sizes')
+            if report:
+                changed.update(
+                    folderId for folderId, (current, computed) in
+                    six.viewitems(self._computeRecursiveCounts())
+                    if current != computed)
+            else:
+                changed.update(self.updateRecursiveCounts())
+            return numFolders, changed
 
-        return doc
+    def _removeLostFolders(self, progress=None, report=False):
+        """
+        Remove the subtrees of folders whose parents do not exist.
+        """
+        lostFolders = set()
+        for parentType in ('folder', 'user', 'collection'):
+            lostParentIds = list(self.findDanglingReferences(
+                'parentId', self.model(parentType),
+                {'parentCollection': parentType}))
+            for start in six.moves.range(
+                    0, len(lostParentIds), DESCENDANT_BATCH_SIZE):
+                lostFolders.update(folder['_id'] for folder in self.find({
+                    'parentId': {'$in': lostParentIds[
+                        start:start + DESCENDANT_BATCH_SIZE]},
+                    'parentCollection': parentType,
+                    'deleted': {'$exists': False}
+                }, fields=()))
+        if lostFolders and progress is not None:
+            progress.update(message='Removing %d orphaned folders' %
+                            len(lostFolders))
+        if not report:
+            deletionModel = self.model('deletion')
+            for folderId in lostFolders:
+                folder = self.findOne({'_id': folderId})
+                if folder is not None:
+                    deletionModel.collect(
+                        deletionModel.createDeletion(folder, 'folder'))
+        return len(lostFolders), lostFolders
+
+    def _checkAncestors(self, progress=None, report=False):
+        """
+        Rebuild the ancestors lists and base parents of all folders, and the
+        ancestors lists of all items, walking down from the top-level folders
+        one level at a time. Only the _id and correct ancestors of each folder
+        at the next level are kept, and the ancestors are shared by siblings;
+        the folders are loaded a batch at a time.
+        """
+        depth = [
+            (folder['_id'], [{'_id': folder['parentId'],
+                              'type': folder['parentCollection']}])
+            for folder in self.find({
+                'parentCollection': {'$in': ['user', 'collection']}
+            }, fields=['parentId', 'parentCollection'])]
+        numFolders = 0
+        corrected = set()
+
+        while depth:
+            nextDepth = []
+            for start in six.moves.range(0, len(depth), DESCENDANT_BATCH_SIZE):
+                setResponseTimeLimit()
+                batch = depth[start:start + DESCENDANT_BATCH_SIZE]
+                folderRequests = []
+                itemRequests = []
+                childAncestors = {}
+                batchAncestors = dict(batch)
+                for folder in self.find({
+                    '_id': {'$in': list(batchAncestors)}
+                }, fields=['ancestors', 'baseParentId', 'baseParentType']):
+                    ancestors = batchAncestors[folder['_id']]
+                    fix = {}
+                    if folder.get('ancestors') != ancestors:
+                        fix['ancestors'] = ancestors
+                    if (folder.get('baseParentId') != ancestors[0]['_id'] or
+                            folder.get('baseParentType') !=
+                            ancestors[0]['type']):
+                        fix['baseParentId'] = ancestors[0]['_id']
+                        fix['baseParentType'] = ancestors[0]['type']
+                    if fix:
+                        corrected.add(folder['_id'])
+                        folderRequests.append(UpdateOne(
+                            {'_id': folder['_id']}, {'$set': fix}))
+
+                    childAncestors[folder['_id']] = ancestors + [
+                        {'_id': folder['_id'], 'type': 'folder'}]
+                    itemRequests.append(UpdateMany({
+                        'folderId': folder['_id'],
+                        'ancestors': {'$ne': childAncestors[folder['_id']]}
+                    }, {'$set': {'ancestors': childAncestors[folder['_id']]}}))
+
+                if not report:
+                    if folderRequests:
+                        self.collection.bulk_write(
+                            folderRequests, ordered=False)
+                        self._invalidateIdentityMap()
+                    self.model('item').collection.bulk_write(
+                        itemRequests, ordered=False)
+                    self.model('item')._invalidateIdentityMap()
+
+                nextDepth.extend(
+                    (child['_id'], childAncestors[child['parentId']])
+                    for child in self.find({
+                        'parentId': {'$in': list(childAncestors)},
+                        'parentCollection': 'folder'
+                    }, fields=['parentId']))
+
+                numFolders += len(batch)
+                if progress is not None:
+                    progress.update(increment=len(batch), message='Checking '
+                                    'folders (%d checked)' % numFolders)
+            depth = nextDepth
+
+        return numFolders, corrected
@@ -56,7 +56,7 @@ class Group(AccessControlledModel):
 
     def initialize(self):
         self.name = 'group'
-        self.ensureIndices(['lowerName'])
+        self.ensureIndices(['lowerName', ([('name', 1), ('_id', 1)], {})])
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -117,7 +117,7 @@ class Group(AccessControlledModel):
 
         return doc
 
-    def list(self, user=None, limit=0, offset=0, sort=None):
+    def list(self, user=None, limit=0, offset=0, sort=None, filters=None):
         """
         Search for groups or simply list all visible groups.
 
@@ -126,14 +126,14 @@ class Group(AccessControlledModel):
         :param limit: Result set size limit.
         :param offset: Offset into the results.
         :param sort: The sort direction.
-        """
-        # Perform the find; we'll do access-based filtering of the result
-        # set afterward.
-        cursor = self.find({}, sort=sort)
-
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
-            offset=offset)
+        :param filters: Additional query operators to apply.
+        :type filters: dict
+        """
+        # Group overrides hasAccess, so this falls back to filtering the
+        # results by permission after the find.
+        return self.findWithPermissions(
+            filters or {}, sort=sort, user=user, level=AccessType.READ,
+            limit=limit, offset=offset)
 
     def listMembers(self, group, offset=0, limit=0, sort=None):
         """
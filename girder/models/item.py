@@ -24,12 +24,14 @@ import os
 import six
 
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
 from .model_base import Model, ValidationException, GirderException
 from girder import events
 from girder import logger
 from girder.constants import AccessType
 from girder.utility import acl_mixin
 from girder.utility.progress import setResponseTimeLimit
+from girder.utility.size_aggregator import aggregator as sizeAggregator
 
 
 class Item(acl_mixin.AccessControlMixin, Model):
@@ -40,8 +42,11 @@ class Item(acl_mixin.AccessControlMixin, Model):
 
     def initialize(self):
         self.name = 'item'
-        self.ensureIndices(('folderId', 'name', 'lowerName',
-                            ([('folderId', 1), ('name', 1)], {})))
+        self.ensureIndices(('folderId', 'name', 'lowerName', 'ancestors._id',
+                            ('deleted', {'sparse': True}),
+                            ([('folderId', 1), ('name', 1)], {}),
+                            ([('folderId', 1), ('lowerName', 1), ('_id', 1)],
+                             {})))
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -78,6 +83,22 @@ class Item(acl_mixin.AccessControlMixin, Model):
             value = str(value)
         return value.strip()
 
+    def textSearch(self, query, user=None, filters=None, **kwargs):
+        """
+        Override of textSearch that hides items that are being deleted.
+        """
+        filters = dict(filters or {}, deleted={'$exists': False})
+        return super(Item, self).textSearch(
+            query, user=user, filters=filters, **kwargs)
+
+    def prefixSearch(self, query, user=None, filters=None, **kwargs):
+        """
+        Override of prefixSearch that hides items that are being deleted.
+        """
+        filters = dict(filters or {}, deleted={'$exists': False})
+        return super(Item, self).prefixSearch(
+            query, user=user, filters=filters, **kwargs)
+
     def validate(self, doc):
         doc['name'] = self._validateString(doc.get('name', ''))
         doc['description'] = self._validateString(doc.get('description', ''))
@@ -115,6 +136,31 @@ class Item(acl_mixin.AccessControlMixin, Model):
         doc['lowerName'] = doc['name'].lower()
         return doc
 
+    def save(self, document, validate=True, triggerEvents=True):
+        """
+        Calls Model.save after making sure that the item has an ancestors
+        list, however it was created.
+        """
+        self._setAncestors(document)
+        return super(Item, self).save(
+            document, validate=validate, triggerEvents=triggerEvents)
+
+    def saveMany(self, documents, *args, **kwargs):
+        """
+        Calls Model.saveMany after doing the same as save.
+        """
+        documents = list(documents)
+        for doc in documents:
+            self._setAncestors(doc)
+        return super(Item, self).saveMany(documents, *args, **kwargs)
+
+    def _setAncestors(self, doc):
+        if 'ancestors' not in doc and doc.get('folderId'):
+            folder = self.model('folder').load(doc['folderId'], force=True)
+            if folder is not None:
+                doc['ancestors'] = \
+                    self.model('folder').getChildAncestors(folder)
+
     def load(self, id, level=AccessType.ADMIN, user=None, objectId=True,
              force=False, fields=None, exc=False):
         """
@@ -126,17 +172,44 @@ class Item(acl_mixin.AccessControlMixin, Model):
         doc = super(Item, self).load(id, level, user, objectId, force, fields,
                                      exc)
 
-        if doc is not None and 'baseParentType' not in doc:
+        # Only fix up complete documents, since this may save them
+        if doc is not None and fields is None:
+            self._fixupLoaded(doc, user)
+
+        return doc
+
+    def loadMany(self, ids, level=AccessType.ADMIN, user=None, objectId=True,
+                 force=False, fields=None, exc=False):
+        """
+        Calls AccessControlMixin.loadMany while doing the same auto-correction
+        as load.
+        """
+        docs = super(Item, self).loadMany(
+            ids, level, user, objectId, force, fields, exc)
+
+        if fields is None:
+            for doc in docs:
+                self._fixupLoaded(doc, user)
+
+        return docs
+
+    def _fixupLoaded(self, doc, user):
+        """
+        Add fields that older item documents may be missing.
+        """
+        if 'baseParentType' not in doc:
             pathFromRoot = self.parentsToRoot(doc, user=user, force=True)
             baseParent = pathFromRoot[0]
             doc['baseParentId'] = baseParent['object']['_id']
             doc['baseParentType'] = baseParent['type']
             self.save(doc, triggerEvents=False)
-        if doc is not None and 'lowerName' not in doc:
+        if 'ancestors' not in doc:
+            self._setAncestors(doc)
+            if 'ancestors' in doc:
+                self.save(doc, triggerEvents=False)
+        if 'lowerName' not in doc:
             self.save(doc, triggerEvents=False)
 
-        return doc
-
     def move(self, item, folder):
         """
         Move the given item from its current folder into another folder.
@@ -146,24 +219,56 @@ class Item(acl_mixin.AccessControlMixin, Model):
         :param folder: The folder to move the item into.
         :type folder: dict.
         """
-        self.propagateSizeChange(item, -item['size'])
+        # The size that is moved must be up to date
+        if sizeAggregator.deferred:
+            sizeAggregator.flush()
+            item['size'] = self.findOne(
+                {'_id': item['_id']}, fields=['size'])['size']
+        fileCount = self.childFiles(item, fields=()).count()
+        self.propagateSizeChange(
+            item, -item['size'], itemCount=-1, fileCount=-fileCount)
 
         item['folderId'] = folder['_id']
         item['baseParentType'] = folder['baseParentType']
         item['baseParentId'] = folder['baseParentId']
+        item['ancestors'] = self.model('folder').getChildAncestors(folder)
 
-        self.propagateSizeChange(item, item['size'])
+        self.propagateSizeChange(
+            item, item['size'], itemCount=1, fileCount=fileCount)
 
         return self.save(item)
 
-    def propagateSizeChange(self, item, inc):
-        self.model('folder').increment(query={
-            '_id': item['folderId']
-        }, field='size', amount=inc, multi=False)
+    def propagateSizeChange(self, item, inc, itemCount=0, fileCount=0,
+                            sync=False):
+        """
+        Propagate a change in the size of an item to its folder and to the
+        root node under which it lives, and update the recursive size and
+        counts of all of its ancestor folders.
 
-        self.model(item['baseParentType']).increment(query={
-            '_id': item['baseParentId']
-        }, field='size', amount=inc, multi=False)
+        :param item: The item.
+        :type item: dict
+        :param inc: The change in size.
+        :type inc: int
+        :param itemCount: The change in the number of items, when the item is
+            being added to or removed from its folder.
+        :type itemCount: int
+        :param fileCount: The change in the number of files.
+        :type fileCount: int
+        :param sync: Whether to write the changes immediately, even if size
+            changes are being merged by the size aggregator.
+        :type sync: bool
+        """
+        if inc:
+            sizeAggregator.increment(
+                self.model('folder'), [item['folderId']], {'size': inc},
+                sync=sync)
+            sizeAggregator.increment(
+                self.model(item['baseParentType']), [item['baseParentId']],
+                {'size': inc}, sync=sync)
+
+        self.model('folder').incrementRecursive(
+            item.get('ancestors', ()), size=inc, items=itemCount,
+            files=fileCount, sync=sync)
 
     def recalculateSize(self, item):
         """
@@ -231,6 +336,8 @@ class Item(acl_mixin.AccessControlMixin, Model):
 
         # Delete the item itself
         Model.remove(self, item)
+        self.model('folder').incrementRecursive(
+            item.get('ancestors', ()), items=-1)
 
     def createItem(self, name, creator, folder, description='',
                    reuseExisting=False):
@@ -265,23 +372,25 @@ class Item(acl_mixin.AccessControlMixin, Model):
             raise GirderException('Creator must be a user.',
                                   'girder.models.item.creator-not-user')
 
+        ancestors = self.model('folder').getChildAncestors(folder)
         if 'baseParentType' not in folder:
-            pathFromRoot = self.parentsToRoot({'folderId': folder['_id']},
-                                              creator, force=True)
-            folder['baseParentType'] = pathFromRoot[0]['type']
-            folder['baseParentId'] = pathFromRoot[0]['object']['_id']
+            folder['baseParentType'] = ancestors[0]['type']
+            folder['baseParentId'] = ancestors[0]['_id']
 
-        return self.save({
+        item = self.save({
             'name': self._validateString(name),
             'description': self._validateString(description),
             'folderId': ObjectId(folder['_id']),
             'creatorId': creator['_id'],
             'baseParentType': folder['baseParentType'],
             'baseParentId': folder['baseParentId'],
+            'ancestors': ancestors,
             'created': now,
             'updated': now,
             'size': 0
         })
+        self.model('folder').incrementRecursive(ancestors, items=1)
+        return item
 
     def updateItem(self, item):
         """
@@ -338,6 +447,10 @@ class Item(acl_mixin.AccessControlMixin, Model):
         :type force: bool
         :returns: an ordered list of dictionaries from root to the current item
         """
+        if 'ancestors' in item:
+            return self.model('folder').ancestorsToPath(
+                item['ancestors'], user=user, force=force)
+
         curFolder = self.model('folder').load(
             item['folderId'], user=user, level=AccessType.READ, force=force)
         folderIdsToRoot = self.model('folder').parentsToRoot(
@@ -393,8 +506,67 @@ class Item(acl_mixin.AccessControlMixin, Model):
         events.trigger('model.item.copy.after', newItem)
         return newItem
 
+    def copyItems(self, srcItems, folders, creator):
+        """
+        Copy a batch of items, including their files and metadata, into new
+        folders, for copying whole folders. The new items and files are
+        written with one bulk insert each, and the save events of each one
+        are still triggered. The items keep the sizes of the originals, but
+        nothing above them is updated; the caller is responsible for the sizes
+        of the folders and their parents. Items whose folders were not copied
+        are skipped.
+
+        :param srcItems: the items to copy.
+        :type srcItems: list
+        :param folders: a dict of the _id of each original folder to the new
+            folder that its items should be copied into.
+        :type folders: dict
+        :param creator: the user who will own the copied items.
+        :returns: the list of new items.
+        """
+        now = datetime.datetime.utcnow()
+        ancestors = {}
+        newItems = []
+        srcItems = [srcItem for srcItem in srcItems
+                    if srcItem['folderId'] in folders]
+        for srcItem in srcItems:
+            folder = folders[srcItem['folderId']]
+            if folder['_id'] not in ancestors:
+                ancestors[folder['_id']] = \
+                    self.model('folder').getChildAncestors(folder)
+            newItem = {
+                key: copy.deepcopy(value)
+                for key, value in six.viewitems(srcItem)
+                if key not in ('_id', 'deleted')}
+            newItem.update({
+                'lowerName': srcItem['name'].lower(),
+                'folderId': folder['_id'],
+                'creatorId': creator['_id'],
+                'baseParentType': folder['baseParentType'],
+                'baseParentId': folder['baseParentId'],
+                'ancestors': ancestors[folder['_id']],
+                'created': now,
+                'updated': now,
+                'size': srcItem.get('size', 0)
+            })
+            newItems.append(newItem)
+        self.saveMany(newItems, validate=False, documentEvents=True)
+        srcItems, newItems = zip(*[
+            (srcItem, newItem) for srcItem, newItem in zip(srcItems, newItems)
+            if '_id' in newItem]) or ((), ())
+
+        # Give listeners a chance to change things
+        for srcItem, newItem in zip(srcItems, newItems):
+            events.trigger('model.item.copy.prepare', (srcItem, newItem))
+        self.model('file').copyFiles({
+            srcItem['_id']: newItem
+            for srcItem, newItem in zip(srcItems, newItems)}, creator)
+        for newItem in newItems:
+            events.trigger('model.item.copy.after', newItem)
+        return list(newItems)
+
     def fileList(self, doc, user=None, path='', includeMetadata=False,
-                 subpath=True):
+                 subpath=True, files=None):
         """
         Generate a list of files within this item.
 
@@ -414,18 +586,25 @@ class Item(acl_mixin.AccessControlMixin, Model):
                         metadata, or the sole file is not named the same as the
                         item, then the returned paths include the item name.
         :type subpath: bool
+        :param files: The files of the item, if they have already been found.
+        :type files: list or None
         :returns: Iterable over files in this item, where each element is a
                   tuple of (path name of the file, stream function with file
                   data).
         :rtype: generator(str, func)
         """
         if subpath:
-            files = list(self.childFiles(item=doc, limit=2))
-            if (len(files) != 1 or files[0]['name'] != doc['name'] or
+            if files is None:
+                firstFiles = list(self.childFiles(item=doc, limit=2))
+            else:
+                firstFiles = files[:2]
+            if (len(firstFiles) != 1 or firstFiles[0]['name'] != doc['name'] or
                     (includeMetadata and doc.get('meta', {}))):
                 path = os.path.join(path, doc['name'])
         metadataFile = "girder-item-metadata.json"
-        for file in self.childFiles(item=doc):
+        if files is None:
+            files = self.childFiles(item=doc)
+        for file in files:
             if file['name'] == metadataFile:
                 metadataFile = None
             yield (os.path.join(path, file['name']),
@@ -435,70 +614,88 @@ class Item(acl_mixin.AccessControlMixin, Model):
                 yield json.dumps(doc['meta'], default=str)
             yield (os.path.join(path, metadataFile), stream)
 
-    def checkConsistency(self, stage, progress=None):
+    def checkConsistency(self, stage, progress=None, report=False):
         """
         Check all of the items and make sure they are valid.  This operates in
         stages, since some actions should be done before other models that rely
         on items and some need to be done after.  The stages are:
         * count - count how many items need to be checked.
-        * remove - remove lost items
-        * verify - verify and fix existing items
+        * remove - remove lost items, whose folders do not exist.
+        * verify - correct the size of each item from its files.
+        * propagate - correct the base parent of each item from its ancestors,
+          once the folder check has corrected those.
 
         :param stage: which stage of the check to run.  See above.
         :param progress: an optional progress context to update.
+        :param report: if True, only find the problems; do not correct them.
+        :type report: bool
         :returns: numItems: number of items to check or processed,
-                  numChanged: number of items changed.
+                  changed: a set of the _ids of the items removed or changed.
         """
         if stage == 'count':
-            numItems = self.find(limit=1).count()
-            return numItems, 0
+            return self.find(limit=1).count(), set()
         elif stage == 'remove':
-            # Check that all items are in existing folders.  Any that are not
-            # can be deleted.  Perhaps we should put them in a lost+found
-            # instead
-            folderIds = self.model('folder').collection.distinct('_id')
-            lostItems = self.find({
-                '$or': [{'folderId': {'$nin': folderIds}},
-                        {'folderId': {'$exists': False}}]})
-            numItems = itemsLeft = lostItems.count()
-            if numItems:
-                if progress is not None:
-                    progress.update(message='Removing orphaned items')
-                for item in lostItems:
-                    setResponseTimeLimit()
-                    self.collection.delete_one({'_id': item['_id']})
-                    if progress is not None:
-                        itemsLeft -= 1
-                        progress.update(increment=1, message='Removing '
-                                        'orphaned items (%d left)' % itemsLeft)
-            return numItems, numItems
+            # Any items that are not in existing folders can be deleted.
+            # Perhaps we should put them in a lost+found instead
+            lostFolderIds = list(self.findDanglingReferences(
+                'folderId', self.model('folder')))
+            lostItems = set()
+            for start in six.moves.range(0, len(lostFolderIds), 1000):
+                setResponseTimeLimit()
+                query = {'folderId': {'$in': lostFolderIds[start:start + 1000]}}
+                lostItems.update(
+                    item['_id'] for item in self.find(query, fields=()))
+                if not report:
+                    self.removeWithQuery(query)
+            if lostItems and progress is not None:
+                progress.update(message='Removed %d orphaned items' %
+                                len(lostItems))
+            return len(lostItems), lostItems
         elif stage == 'verify':
-            # Check items sizes
-            items = self.find()
-            numItems = itemsLeft = items.count()
-            itemsCorrected = 0
             if progress is not None:
-                progress.update(message='Checking items')
-            for item in items:
-                itemCorrected = False
-                setResponseTimeLimit()
-                oldSize = item.get('size', 0)
-                newSize = self.recalculateSize(item)
-                if newSize != oldSize:
-                    itemCorrected = True
-                newBaseParent = self.parentsToRoot(item, force=True)[0]
-                if item['baseParentType'] != newBaseParent['type'] or \
-                   item['baseParentId'] != newBaseParent['object']['_id']:
-                    self.update(
-                        {'_id': item['_id']}, update={'$set': {
-                            'baseParentType': newBaseParent['type'],
-                            'baseParentId': newBaseParent['object']['_id']
-                        }})
-                    itemCorrected = True
-                if itemCorrected:
-                    itemsCorrected += 1
-                if progress is not None:
-                    itemsLeft -= 1
-                    progress.update(increment=1, message='Checking items (%d '
-                                    'left)' % itemsLeft)
-            return numItems, itemsCorrected
+                progress.update(message='Checking item sizes')
+            return self.checkSizes(
+                self.model('file'), 'itemId', report=report, progress=progress)
+        elif stage == 'propagate':
+            if progress is not None:
+                progress.update(message='Checking item base parents')
+            return self._checkBaseParents(report)
+
+    def _checkBaseParents(self, report=False):
+        """
+        Make sure the base parent of every item is the first of its ancestors,
+        with a single aggregation to find the items where it is not.
+        """
+        changed = set()
+        requests = []
+        for result in self.collection.aggregate([
+            {'$match': {'ancestors.0': {'$exists': True}}},
+            {'$project': {
+                'baseParentId': 1, 'baseParentType': 1, 'root': '$ancestors'}},
+            {'$unwind': '$root'},
+            {'$group': {
+                '_id': '$_id',
+                'root': {'$first': '$root'},
+                'baseParentId': {'$first': '$baseParentId'},
+                'baseParentType': {'$first': '$baseParentType'}
+            }},
+            {'$project': {'root': 1, 'wrong': {'$or': [
+                {'$ne': ['$root._id', '$baseParentId']},
+                {'$ne': ['$root.type', '$baseParentType']}
+            ]}}},
+            {'$match': {'wrong': True}}
+        ], allowDiskUse=True):
+            changed.add(result['_id'])
+            requests.append(UpdateOne({'_id': result['_id']}, {'$set': {
+                'baseParentId': result['root']['_id'],
+                'baseParentType': result['root']['type']
+            }}))
+            if len(requests) == 1000:
+                if not report:
+                    self.collection.bulk_write(requests, ordered=False)
+                requests = []
+        if requests and not report:
+            self.collection.bulk_write(requests, ordered=False)
+        if changed and not report:
+            self._invalidateIdentityMap()
+        return len(changed), changed
@@ -17,6 +17,7 @@
 #  limitations under the License.
 ###############################################################################
 
+import cherrypy
 import copy
 import functools
 import itertools
@@ -26,12 +27,13 @@ import six
 
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
-from pymongo.errors import WriteError
+from pymongo.errors import BulkWriteError, WriteError
 from girder import events
 from girder.constants import AccessType, CoreEventHandler, TerminalColor, \
     TEXT_SCORE_SORT_MAX
-from girder.external.mongodb_proxy import MongoProxy
 from girder.models import getDbConnection
+from girder.utility import config, db_stats
+from girder.utility.index import registry as indexRegistry
 from girder.utility.model_importer import ModelImporter
 
 # pymongo3 complains about extra kwargs to find(), so we must filter them.
@@ -39,6 +41,54 @@ _allowedFindArgs = ('cursor_type', 'allow_partial_results', 'oplog_replay',
                     'modifiers', 'manipulate')
 
 
+def _getIdentityMap():
+    """
+    Return the identity map of documents loaded by id during the current
+    request, or None if there is no such map. The map is stored on the CherryPy
+    request object, so it is discarded along with the request. It is only
+    created if the "identity_map" option of the "cache" config section is set,
+    but callers may also opt in explicitly by setting the girderIdentityMap
+    attribute of the request to an empty dict.
+    """
+    identityMap = getattr(cherrypy.request, 'girderIdentityMap', None)
+
+    if identityMap is None and cherrypy.request.app is not None:
+        if config.getConfig().get('cache', {}).get('identity_map', False):
+            identityMap = cherrypy.request.girderIdentityMap = {}
+
+    return identityMap
+
+
+def _projectionKey(fields):
+    """
+    Return a hashable representation of a load() projection, for use as part of
+    an identity map key.
+    """
+    if fields is None:
+        return None
+    if isinstance(fields, dict):
+        return repr(sorted(six.viewitems(fields)))
+    return tuple(sorted(fields))
+
+
+def _isTextIndex(keys):
+    return any(direction == 'text' for _, direction in keys)
+
+
+def _indexKey(keys, options):
+    """
+    Return a hashable value identifying an index by its keys, so that declared
+    indices can be matched against those reported by list_indexes. Text
+    indices are identified by their weighted fields, since mongo stores their
+    keys in an internal form.
+    """
+    if _isTextIndex(keys) or any(field == '_fts' for field, _ in keys):
+        return ('$text', tuple(sorted(options.get('weights', {}))))
+
+    return tuple((field, int(direction) if isinstance(
+        direction, (int, float)) else direction) for field, direction in keys)
+
+
 class Model(ModelImporter):
     """
     Model base class. Models are responsible for abstracting away the
@@ -71,21 +121,88 @@ class Model(ModelImporter):
         """
         db_connection = getDbConnection()
         self.database = db_connection.get_default_database()
-        self.collection = MongoProxy(self.database[self.name])
+        self.collection = db_stats.StatsCollectionProxy(
+            self.database[self.name])
 
+        indexRegistry.register(self)
+
+    def indexSpecs(self):
+        """
+        Return the indices declared by this model, including its text index,
+        in a normalized form.
+
+        :returns: A list of (keys, options) tuples, where keys is a list of
+            (field, direction) pairs and options is a dict of kwargs for the
+            pymongo create_index call.
+        """
+        specs = []
         for index in self._indices:
             if isinstance(index, (list, tuple)):
-                self.collection.create_index(index[0], **index[1])
+                keys, options = index[0], dict(index[1])
             else:
-                self.collection.create_index(index)
+                keys, options = index, {}
+
+            if isinstance(keys, six.string_types):
+                keys = [(keys, pymongo.ASCENDING)]
+            specs.append(([tuple(key) for key in keys], options))
 
         if type(self._textIndex) is dict:
             textIdx = [(k, 'text') for k in six.viewkeys(self._textIndex)]
+            specs.append((textIdx, {
+                'weights': self._textIndex,
+                'default_language': self._textLanguage
+            }))
+
+        return specs
+
+    def missingIndices(self):
+        """
+        Return the declared indices that do not exist in the database. This
+        uses a single list_indexes call, and only compares the indexed keys (or,
+        for the text index, the weighted fields), not the other index options.
+
+        :returns: A list of (keys, options) tuples, as in indexSpecs.
+        """
+        existing = {_indexKey(list(six.viewitems(index['key'])), index)
+                    for index in self.collection.list_indexes()}
+
+        return [(keys, options) for keys, options in self.indexSpecs()
+                if _indexKey(keys, options) not in existing]
+
+    def undeclaredIndices(self):
+        """
+        Return the names of the indices in the database, other than the _id
+        index, that this model does not declare.
+        """
+        declared = {_indexKey(keys, options)
+                    for keys, options in self.indexSpecs()}
+
+        return [index['name'] for index in self.collection.list_indexes()
+                if index['name'] != '_id_' and _indexKey(
+                    list(six.viewitems(index['key'])), index) not in declared]
+
+    def createIndices(self, indices=None, background=False):
+        """
+        Create indices in the database.
+
+        :param indices: The (keys, options) tuples of the indices to create. If
+            not passed, this creates any declared index that does not exist.
+        :type indices: list or None
+        :param background: Whether mongo should build the indices without
+            blocking other operations on the collection.
+        :type background: bool
+        """
+        if indices is None:
+            indices = self.missingIndices()
+
+        for keys, options in indices:
+            if background:
+                options = dict(options, background=True)
             try:
-                self.collection.create_index(
-                    textIdx, weights=self._textIndex,
-                    default_language=self._textLanguage)
+                self.collection.create_index(keys, **options)
             except pymongo.errors.OperationFailure:
+                if not _isTextIndex(keys):
+                    raise
                 print(
                     TerminalColor.warning('WARNING: Text search not enabled.'))
 
@@ -153,6 +270,31 @@ class Model(ModelImporter):
 
         return self.filterDocument(doc, allow=keys)
 
+    def filterProjection(self, user=None, additionalKeys=None):
+        """
+        Return the list of fields that filter() could possibly include in its
+        output for the given user. When documents are loaded only to be passed
+        through filter(), this can be used as the projection of the query, so
+        that fields that would be discarded anyway are never transferred from
+        the database.
+
+        :param user: The user for whom the documents will be filtered.
+        :type user: dict or None
+        :param additionalKeys: Any additional keys that will be passed to
+            filter().
+        :type additionalKeys: list, tuple, set, or None
+        :returns: A list of field names.
+        """
+        keys = set(self._filterKeys[AccessType.READ])
+
+        if user and user.get('admin') is True:
+            keys.update(self._filterKeys[AccessType.SITE_ADMIN])
+
+        if additionalKeys:
+            keys.update(additionalKeys)
+
+        return list(keys)
+
     def ensureTextIndex(self, index, language='english'):
         """
         Call this during initialize() of the subclass if you want your
@@ -267,6 +409,8 @@ class Model(ModelImporter):
             results from the cursor.
         """
         filters = filters or {}
+        if isinstance(fields, (list, tuple, set)):
+            fields = {field: True for field in fields}
         fields = fields or {}
 
         fields['_textScore'] = {'$meta': 'textScore'}
@@ -277,8 +421,13 @@ class Model(ModelImporter):
 
         # Sort by meta text score, but only if result count is below a certain
         # threshold. The text score is not a real index, so we cannot always
-        # sort by it if there is a high number of matching documents.
-        if cursor.count() < TEXT_SCORE_SORT_MAX and sort is None:
+        # sort by it if there is a high number of matching documents. The count
+        # is bounded by the threshold so that it stops scanning matches as soon
+        # as the threshold is reached.
+        if sort is None and self.collection.find(
+                filter=filters, projection={'_id': True},
+                limit=TEXT_SCORE_SORT_MAX).count(
+                with_limit_and_skip=True) < TEXT_SCORE_SORT_MAX:
             cursor.sort([('_textScore', {'$meta': 'textScore'})])
 
         return cursor
@@ -359,6 +508,8 @@ class Model(ModelImporter):
                     {'_id': document['_id']}, document, True)
         except WriteError as e:
             raise ValidationException('Database save failed: %s' % e.details)
+        finally:
+            self._invalidateIdentityMap(document.get('_id'))
 
         if triggerEvents:
             if isNew:
@@ -367,6 +518,105 @@ class Model(ModelImporter):
 
         return document
 
+    def saveMany(self, documents, validate=True, triggerEvents=True,
+                 ordered=False, documentEvents=False):
+        """
+        Create or update many documents in the collection at once. New
+        documents are written with a single insert_many call, and existing
+        ones with a single bulk_write call.
+
+        Rather than the per-document validate, save, and save.after events,
+        this triggers "model.<name>.validate.bulk" and "model.<name>.save.bulk"
+        prior to writing, and "model.<name>.save.bulk.after" afterward, each
+        with the list of documents as its info. Either of the first two may
+        have their default action prevented. Since core bookkeeping depends on
+        it, "model.<name>.save.created" is still triggered for each new
+        document.
+
+        :param documents: The documents to save.
+        :type documents: list of dict
+        :param validate: Whether to call the model's validate() on each
+            document before saving.
+        :type validate: bool
+        :param triggerEvents: Whether to trigger events for validate and
+            pre- and post-save hooks.
+        :type triggerEvents: bool
+        :param ordered: Whether the writes must be performed in order, stopping
+            at the first failure. Unordered writes may be faster.
+        :type ordered: bool
+        :param documentEvents: Whether to also trigger "model.<name>.save" and
+            "model.<name>.save.after" for each document, as save() does, for
+            handlers that only listen for documents being saved one at a time.
+            A document whose save event has its default action prevented is
+            not written. This only applies if triggerEvents is True.
+        :type documentEvents: bool
+        :returns: The list of saved documents.
+        """
+        documents = list(documents)
+        if not documents:
+            return documents
+
+        if validate and triggerEvents:
+            event = events.trigger('model.%s.validate.bulk' % self.name,
+                                   documents)
+            if event.defaultPrevented:
+                validate = False
+
+        if validate:
+            documents = [self.validate(doc) for doc in documents]
+
+        if triggerEvents:
+            event = events.trigger('model.%s.save.bulk' % self.name,
+                                   documents)
+            if event.defaultPrevented:
+                return documents
+            if documentEvents:
+                documents = self._triggerDocumentSaves(documents)
+                if not documents:
+                    return documents
+
+        newDocs = [doc for doc in documents if '_id' not in doc]
+        replacements = [
+            pymongo.ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+            for doc in documents if '_id' in doc]
+        try:
+            if newDocs:
+                # This sets the _id field of each of the new documents
+                self.collection.insert_many(newDocs, ordered=ordered)
+            if replacements:
+                self.collection.bulk_write(replacements, ordered=ordered)
+        except BulkWriteError as e:
+            raise ValidationException(
+                'Database save failed: %s' % e.details.get('writeErrors'))
+        finally:
+            self._invalidateIdentityMap()
+
+        if triggerEvents:
+            self._triggerSavedMany(documents, newDocs, documentEvents)
+
+        return documents
+
+    def _triggerDocumentSaves(self, documents):
+        """
+        Trigger the save event of each of a batch of documents, as save()
+        does.
+
+        :returns: The documents whose save was not prevented.
+        """
+        return [doc for doc in documents if not events.trigger(
+            'model.%s.save' % self.name, doc).defaultPrevented]
+
+    def _triggerSavedMany(self, documents, newDocs, documentEvents):
+        """
+        Trigger the events that follow writing a batch of documents.
+        """
+        for doc in newDocs:
+            events.trigger('model.%s.save.created' % self.name, doc)
+        if documentEvents:
+            for doc in documents:
+                events.trigger('model.%s.save.after' % self.name, doc)
+        events.trigger('model.%s.save.bulk.after' % self.name, documents)
+
     def update(self, query, update, multi=True):
         """
         This method should be used for updating multiple documents in the
@@ -386,6 +636,9 @@ class Model(ModelImporter):
         :type multi: bool
         :returns: A pymongo UpdateResult object.
         """
+        # We can't tell which documents will be modified, so forget all of them
+        self._invalidateIdentityMap()
+
         if multi:
             return self.collection.update_many(query, update)
         else:
@@ -425,8 +678,125 @@ class Model(ModelImporter):
             })
 
         if not event.defaultPrevented and not kwargsEvent.defaultPrevented:
+            self._invalidateIdentityMap(document['_id'])
             return self.collection.delete_one({'_id': document['_id']})
 
+    def removeMany(self, documents, triggerEvents=True, **kwargs):
+        """
+        Delete many documents at once with a single delete_many. This triggers
+        "model.<name>.remove.bulk" with the list of documents, which may have
+        its default action prevented, and then the same events as remove for
+        each document, so that existing handlers keep working. Documents whose
+        own events have their default action prevented are not deleted.
+
+        :param documents: The documents to delete; each must have its _id set.
+        :type documents: list of dict
+        :param triggerEvents: Whether to trigger the remove events.
+        :type triggerEvents: bool
+        """
+        if triggerEvents:
+            event = events.trigger('model.%s.remove.bulk' % self.name,
+                                   documents)
+            if event.defaultPrevented:
+                return
+
+            def allowed(document):
+                event = events.trigger(
+                    '.'.join(('model', self.name, 'remove')), document)
+                kwargsEvent = events.trigger(
+                    '.'.join(('model', self.name, 'remove_with_kwargs')), {
+                        'document': document,
+                        'kwargs': kwargs
+                    })
+                return (not event.defaultPrevented and
+                        not kwargsEvent.defaultPrevented)
+
+            documents = [doc for doc in documents if allowed(doc)]
+
+        if documents:
+            self._invalidateIdentityMap()
+            return self.collection.delete_many({
+                '_id': {'$in': [doc['_id'] for doc in documents]}})
+
+    def findDanglingReferences(self, field, model, query=None):
+        """
+        Find the values of a field of the documents in this collection that
+        should refer to documents of another model but do not, for the system
+        consistency check. The distinct values are gathered with an
+        aggregation, and then looked up in batches, so neither collection is
+        scanned document by document.
+
+        :param field: The name of the field holding the references.
+        :type field: str
+        :param model: The model that the references should refer to.
+        :type model: Model
+        :param query: If set, only check documents that match this query.
+        :type query: dict or None
+        :returns: A set of the values that do not refer to an existing
+            document. If the field is missing on any document, this includes
+            None.
+        """
+        pipeline = [{'$match': query}] if query else []
+        pipeline.append({'$group': {'_id': '$' + field}})
+        values = (result['_id'] for result in self.collection.aggregate(
+            pipeline, allowDiskUse=True))
+
+        missing = set()
+        while True:
+            batch = list(itertools.islice(values, 1000))
+            if not batch:
+                return missing
+            found = {doc['_id'] for doc in model.collection.find(
+                {'_id': {'$in': batch}}, projection=[])}
+            missing.update(value for value in batch if value not in found)
+
+    def checkSizes(self, children, field, report=False, progress=None):
+        """
+        Make sure the size of every document in this collection is the total
+        size of the documents of another model that refer to it, for the
+        system consistency check. The documents are checked in batches of
+        1000, with one aggregation over their children per batch.
+
+        :param children: The model whose documents' sizes are totaled.
+        :type children: Model
+        :param field: The field of the children that refers to this model.
+        :type field: str
+        :param report: If set, only find the wrong sizes; do not correct them.
+        :type report: bool
+        :param progress: If set, this is incremented once per document.
+        :type progress: girder.utility.progress.ProgressContext or None
+        :returns: A tuple of the number of documents checked and a set of the
+            _ids of those whose sizes were wrong.
+        """
+        cursor = self.collection.find(
+            {}, projection=['size'], sort=[('_id', pymongo.ASCENDING)])
+        count = 0
+        changed = set()
+        while True:
+            docs = list(itertools.islice(cursor, 1000))
+            if not docs:
+                break
+            count += len(docs)
+            sizes = {result['_id']: result['size']
+                     for result in children.collection.aggregate([
+                         {'$match': {field: {
+                             '$in': [doc['_id'] for doc in docs]}}},
+                         {'$group': {'_id': '$' + field,
+                                     'size': {'$sum': '$size'}}}])}
+            requests = []
+            for doc in docs:
+                size = sizes.get(doc['_id'], 0)
+                if doc.get('size') != size:
+                    changed.add(doc['_id'])
+                    requests.append(pymongo.UpdateOne(
+                        {'_id': doc['_id']}, {'$set': {'size': size}}))
+            if requests and not report:
+                self.collection.bulk_write(requests, ordered=False)
+                self._invalidateIdentityMap()
+            if progress is not None:
+                progress.update(increment=len(docs))
+        return count, changed
+
     def removeWithQuery(self, query):
         """
         Remove all documents matching a given query from the collection.
@@ -434,11 +804,15 @@ class Model(ModelImporter):
         """
         assert query
 
+        self._invalidateIdentityMap()
         return self.collection.delete_many(query)
 
     def load(self, id, objectId=True, fields=None, exc=False):
         """
-        Fetch a single object from the database using its _id field.
+        Fetch a single object from the database using its _id field. If the
+        request-scoped identity map is enabled, documents that were already
+        loaded during the current request are returned without querying the
+        database again.
 
         :param id: The value for searching the _id field.
         :type id: string or ObjectId
@@ -451,6 +825,35 @@ class Model(ModelImporter):
         :type exc: bool
         :returns: The matching document, or None.
         """
+        id = self._coerceId(id, objectId)
+
+        identityMap = _getIdentityMap()
+        if identityMap is not None:
+            cached = identityMap.setdefault(self.name, {}).setdefault(id, {})
+            key = _projectionKey(fields)
+
+            # Hand out copies so that callers modifying the document they
+            # receive cannot corrupt the cached version.
+            if key in cached:
+                doc = copy.deepcopy(cached[key])
+            else:
+                doc = self.findOne({'_id': id}, fields=fields)
+                if doc is not None:
+                    cached[key] = copy.deepcopy(doc)
+        else:
+            doc = self.findOne({'_id': id}, fields=fields)
+
+        if doc is None and exc is True:
+            raise ValidationException('No such %s: %s' % (self.name, id),
+                                      field='id')
+
+        return doc
+
+    def _coerceId(self, id, objectId=True):
+        """
+        Private helper that validates an id passed to load, coercing it to an
+        ObjectId if requested.
+        """
         if not id:
             raise ValidationException('Attempt to load null ObjectId: %s' % id)
 
@@ -460,13 +863,65 @@ class Model(ModelImporter):
             except InvalidId:
                 raise ValidationException('Invalid ObjectId: %s' % id,
                                           field='id')
-        doc = self.findOne({'_id': id}, fields=fields)
+        return id
 
-        if doc is None and exc is True:
-            raise ValidationException('No such %s: %s' % (self.name, id),
-                                      field='id')
+    def loadMany(self, ids, objectId=True, fields=None, exc=False):
+        """
+        Fetch many objects from the database using their _id fields. This
+        issues a single query rather than one per id, and respects the
+        request-scoped identity map like load() does.
 
-        return doc
+        :param ids: The values for searching the _id field.
+        :type ids: list of string or ObjectId
+        :param objectId: Whether the ids should be coerced to ObjectId type.
+        :type objectId: bool
+        :param fields: Fields list to include. Also can be a dict for
+                       exclusion. See pymongo docs for how to use this arg.
+        :param exc: Whether to raise a ValidationException if there is no
+                    document for one of the given ids.
+        :type exc: bool
+        :returns: The matching documents, in the same order as the ids. Ids
+            with no matching document are omitted.
+        """
+        coerced = [self._coerceId(id, objectId) for id in ids]
+
+        identityMap = _getIdentityMap()
+        key = _projectionKey(fields)
+        docs = {}
+        if identityMap is not None:
+            cached = identityMap.setdefault(self.name, {})
+            for id in coerced:
+                if key in cached.get(id, {}):
+                    docs[id] = copy.deepcopy(cached[id][key])
+
+        missing = list(set(coerced) - set(docs))
+        if missing:
+            for doc in self.find({'_id': {'$in': missing}}, fields=fields):
+                docs[doc['_id']] = doc
+                if identityMap is not None:
+                    identityMap[self.name].setdefault(doc['_id'], {})[key] = \
+                        copy.deepcopy(doc)
+
+        if exc is True:
+            for id in coerced:
+                if id not in docs:
+                    raise ValidationException(
+                        'No such %s: %s' % (self.name, id), field='id')
+
+        return [docs[id] for id in coerced if id in docs]
+
+    def _invalidateIdentityMap(self, id=None):
+        """
+        Private helper that drops documents of this model from the identity map
+        of the current request. Pass an id to drop a single document, or None
+        to drop all documents of this model.
+        """
+        identityMap = _getIdentityMap()
+        if identityMap is not None and self.name in identityMap:
+            if id is None:
+                del identityMap[self.name]
+            else:
+                identityMap[self.name].pop(id, None)
 
     def filterDocument(self, doc, allow=None):
         """
@@ -610,6 +1065,28 @@ class AccessControlledModel(Model):
 
         return filtered
 
+    def filterProjection(self, user=None, additionalKeys=None):
+        """
+        Override of Model.filterProjection. Since the access level of the user
+        may differ between documents, this includes the fields for every level
+        the user could have, along with the fields needed to determine it.
+        """
+        keys = set(self._filterKeys[AccessType.READ])
+
+        if user is not None:
+            keys.update(self._filterKeys[AccessType.WRITE])
+            keys.update(self._filterKeys[AccessType.ADMIN])
+
+            if user.get('admin') is True:
+                keys.update(self._filterKeys[AccessType.SITE_ADMIN])
+
+        if additionalKeys:
+            keys.update(additionalKeys)
+
+        keys.update(('access', 'public'))
+
+        return list(keys)
+
     def _hasGroupAccess(self, perms, groupIds, level):
         """
         Private helper method for checking group access.
@@ -809,10 +1286,15 @@ class AccessControlledModel(Model):
 
         dirty = False
 
+        userDocs = {doc['_id']: doc for doc in self.model('user').loadMany(
+            [user['id'] for user in acList['users']], force=True,
+            fields=['firstName', 'lastName', 'login'])}
+        grpDocs = {doc['_id']: doc for doc in self.model('group').loadMany(
+            [grp['id'] for grp in acList['groups']], force=True,
+            fields=['name', 'description'])}
+
         for user in acList['users'][:]:
-            userDoc = self.model('user').load(
-                user['id'], force=True,
-                fields=['firstName', 'lastName', 'login'])
+            userDoc = userDocs.get(user['id'])
             if not userDoc:
                 dirty = True
                 acList['users'].remove(user)
@@ -821,8 +1303,7 @@ class AccessControlledModel(Model):
             user['name'] = ' '.join((userDoc['firstName'], userDoc['lastName']))
 
         for grp in acList['groups'][:]:
-            grpDoc = self.model('group').load(
-                grp['id'], force=True, fields=['name', 'description'])
+            grpDoc = grpDocs.get(grp['id'])
             if not grpDoc:
                 dirty = True
                 acList['groups'].remove(grp)
@@ -958,6 +1439,37 @@ class AccessControlledModel(Model):
 
         return doc
 
+    def loadMany(self, ids, level=AccessType.ADMIN, user=None, objectId=True,
+                 force=False, fields=None, exc=False):
+        """
+        Override of Model.loadMany to also do permission checking. Takes the
+        same parameters as load(), except that it is passed a list of ids.
+
+        :raises AccessException: If the user lacks access to any of the
+            documents.
+        :returns: The matching documents, in the same order as the ids.
+        """
+        loadFields = fields
+        if not force and fields:
+            loadFields = list(set(fields) | {'access', 'public'})
+
+        docs = Model.loadMany(
+            self, ids, objectId=objectId, fields=loadFields, exc=exc)
+
+        if not force:
+            for doc in docs:
+                self.requireAccess(doc, user, level)
+
+            if fields is not None:
+                for doc in docs:
+                    if 'access' not in fields:
+                        doc.pop('access', None)
+
+                    if 'public' not in fields:
+                        doc.pop('public', None)
+
+        return docs
+
     def copyAccessPolicies(self, src, dest, save=False):
         """
         Copies the set of access control policies from one document to another.
@@ -1007,6 +1519,95 @@ class AccessControlledModel(Model):
                     del result[key]
             yield result
 
+    def permissionClauses(self, user=None, level=AccessType.READ):
+        """
+        Build a query clause that matches only the documents of this model on
+        which the given user has the given level of access. This mirrors the
+        default hasAccess() implementation, so that permission filtering (and
+        therefore sorting, offset, and limit) can be performed by the database
+        rather than by iterating over every candidate document.
+
+        :param user: The user to build the clause for.
+        :type user: dict or None
+        :param level: The access level.
+        :type level: AccessType
+        :returns: A query dict, or None if the user is not restricted.
+        """
+        if user is not None and user.get('admin', False) is True:
+            return None
+
+        clauses = []
+        if level <= AccessType.READ:
+            clauses.append({'public': True})
+
+        if user is not None:
+            clauses.append({'access.users': {'$elemMatch': {
+                'id': user['_id'],
+                'level': {'$gte': level}
+            }}})
+            if user.get('groups'):
+                clauses.append({'access.groups': {'$elemMatch': {
+                    'id': {'$in': user['groups']},
+                    'level': {'$gte': level}
+                }}})
+
+        if not clauses:
+            # Anonymous users requesting more than read access match nothing
+            return {'_id': {'$in': []}}
+
+        return {'$or': clauses}
+
+    def _addPermissionClauses(self, query, user, level):
+        """
+        Private helper that returns a copy of a query with the permission
+        clauses for the given user and level added to it.
+        """
+        query = dict(query or {})
+        clauses = self.permissionClauses(user, level)
+
+        if clauses is not None:
+            query['$and'] = query.get('$and', []) + [clauses]
+
+        return query
+
+    def _usesDefaultAccessCheck(self):
+        """
+        Private helper that determines whether the access checking of this
+        model can be expressed as a database query, i.e. whether hasAccess()
+        has not been overridden by a subclass.
+        """
+        return (six.get_unbound_function(type(self).hasAccess) is
+                six.get_unbound_function(AccessControlledModel.hasAccess))
+
+    def findWithPermissions(self, query=None, offset=0, limit=0, timeout=None,
+                            fields=None, sort=None, user=None,
+                            level=AccessType.READ, **kwargs):
+        """
+        Search the collection by a set of parameters, only returning documents
+        that the given user has the given level of access on. Unless the model
+        overrides hasAccess(), the permission filtering, sort, offset, and limit
+        are all applied within the database query. Otherwise, this falls back
+        to filtering the results with filterResultsByPermission().
+
+        The parameters are the same as Model.find, plus:
+
+        :param user: The user to apply permission filtering for.
+        :type user: dict or None
+        :param level: The access level to require.
+        :type level: girder.constants.AccessType
+        :returns: An iterable of matching documents.
+        """
+        if self._usesDefaultAccessCheck():
+            query = self._addPermissionClauses(query, user, level)
+            return self.find(
+                query, offset=offset, limit=limit, timeout=timeout,
+                fields=fields, sort=sort, **kwargs)
+
+        cursor = self.find(
+            query, timeout=timeout, fields=fields, sort=sort, **kwargs)
+        return self.filterResultsByPermission(
+            cursor=cursor, user=user, level=level, limit=limit, offset=offset)
+
     def textSearch(self, query, user=None, filters=None, limit=0, offset=0,
                    sort=None, fields=None, level=AccessType.READ):
         """
@@ -1020,6 +1621,12 @@ class AccessControlledModel(Model):
         """
         filters = filters or {}
 
+        if self._usesDefaultAccessCheck():
+            filters = self._addPermissionClauses(filters, user, level)
+            return Model.textSearch(
+                self, query=query, filters=filters, offset=offset,
+                limit=limit, sort=sort, fields=fields)
+
         cursor = Model.textSearch(
             self, query=query, filters=filters, sort=sort, fields=fields)
         return self.filterResultsByPermission(
@@ -1038,6 +1645,12 @@ class AccessControlledModel(Model):
         """
         filters = filters or {}
 
+        if self._usesDefaultAccessCheck():
+            filters = self._addPermissionClauses(filters, user, level)
+            return Model.prefixSearch(
+                self, query=query, filters=filters, offset=offset,
+                limit=limit, sort=sort, fields=fields)
+
         cursor = Model.prefixSearch(
             self, query=query, filters=filters, sort=sort, fields=fields)
         return self.filterResultsByPermission(
@@ -19,22 +19,61 @@
 
 from collections import OrderedDict
 import cherrypy
+import copy
 import six
+import time
 
 from ..constants import SettingDefault
 from .model_base import Model, ValidationException
-from girder.utility import camelcase, plugin_utilities
+from girder.utility import camelcase, config, plugin_utilities
 from bson.objectid import ObjectId
 
 
 class Setting(Model):
     """
     This model represents server-wide configuration settings as key/value pairs.
+
+    Settings are read on many hot paths, so all of them are cached in memory.
+    The cache is invalidated immediately by set() and unset(), and otherwise
+    refreshed after the number of seconds given by the "setting_ttl" option of
+    the "cache" config section, to pick up changes made by other processes.
+    Setting that option to 0 disables the cache.
     """
     def initialize(self):
         self.name = 'setting'
         self.ensureIndices(['key'])
 
+    def reconnect(self):
+        self.invalidateCache()
+        super(Setting, self).reconnect()
+
+    def invalidateCache(self):
+        """
+        Discard the in-memory setting cache, so that the next call to get()
+        reads all settings from the database again.
+        """
+        self._cache = None
+
+    def _getCachedSettings(self):
+        """
+        Return a dict of all setting values keyed by setting key, reloading it
+        from the database if it has expired, or None if the cache is disabled.
+        """
+        cacheConfig = config.getConfig().get('cache', {})
+        ttl = float(cacheConfig.get('setting_ttl') or 0)
+        if ttl <= 0:
+            return None
+
+        # Replace the cache as a single tuple so that concurrent readers always
+        # see a consistent state.
+        cache = self._cache
+        if cache is None or cache[0] < time.time():
+            values = {setting['key']: setting['value'] for setting in
+                      self.find({}, fields=['key', 'value'])}
+            cache = self._cache = (time.time() + ttl, values)
+
+        return cache[1]
+
     def validate(self, doc):
         """
         This method is in charge of validating that the setting key is a valid
@@ -217,7 +256,15 @@ class Setting(Model):
         :param default: If no such setting exists, returns this value instead.
         :returns: The value, or the default value if the key is not found.
         """
-        setting = self.findOne({'key': key})
+        settings = self._getCachedSettings()
+        if settings is not None:
+            if key in settings:
+                # Copy so that callers cannot modify the cached value
+                return copy.deepcopy(settings[key])
+            setting = None
+        else:
+            setting = self.findOne({'key': key})
+
         if setting is None:
             if default is '__default__':
                 default = self.getDefault(key)
@@ -244,7 +291,10 @@ class Setting(Model):
         else:
             setting['value'] = value
 
-        return self.save(setting)
+        try:
+            return self.save(setting)
+        finally:
+            self.invalidateCache()
 
     def unset(self, key):
         """
@@ -257,6 +307,8 @@ class Setting(Model):
         for setting in self.find({'key': key}):
             self.remove(setting)
 
+        self.invalidateCache()
+
     def getDefault(self, key):
         """
         Retrieve the system default for a value.
@@ -17,11 +17,16 @@
 #  limitations under the License.
 ###############################################################################
 
+import copy
 import datetime
 import six
 import string
 
-from girder.constants import AccessType, TerminalColor, TokenScope
+from girder import events
+from girder.constants import AccessType, CoreEventHandler, TerminalColor, \
+    TokenScope
+from girder.utility import config
+from girder.utility.lru_cache import LruCache
 from .model_base import AccessControlledModel
 
 try:
@@ -46,14 +51,109 @@ def genToken(length=64):
 class Token(AccessControlledModel):
     """
     This model stores session tokens for user authentication.
+
+    Tokens used for authentication, along with the users they belong to, are
+    kept in an in-memory cache so that authenticating repeated requests with
+    the same token does not require reading from the database. The size and
+    lifetime of the cache are controlled by the "auth_cache_size" and
+    "auth_ttl" options of the "cache" config section.
+
+    Entries are invalidated by the events of the process that changes a token
+    or user. Changes made by other server processes are only seen once the
+    entries expire, so auth_ttl bounds how long a revoked token or a user's
+    old permissions may still be accepted by this process.
     """
     def initialize(self):
         self.name = 'token'
         self.ensureIndex(('expires', {'expireAfterSeconds': 0}))
 
+        cacheConfig = config.getConfig().get('cache', {})
+        ttl = float(cacheConfig.get('auth_ttl') or 0)
+        self._authCache = LruCache(
+            maxSize=int(cacheConfig.get('auth_cache_size', 1000)) if ttl > 0
+            else 0, ttl=ttl)
+
+        for eventName in ('model.token.save.after', 'model.token.remove'):
+            events.bind(eventName, CoreEventHandler.AUTH_CACHE_INVALIDATE,
+                        self._invalidateCachedToken)
+        for eventName in ('model.user.save.after', 'model.user.remove'):
+            events.bind(eventName, CoreEventHandler.AUTH_CACHE_INVALIDATE,
+                        self._invalidateCachedUser)
+        # Deleting a group removes it from its members without saving them
+        events.bind('model.group.remove',
+                    CoreEventHandler.AUTH_CACHE_INVALIDATE,
+                    self._invalidateAllCached)
+
+    def reconnect(self):
+        self._authCache.clear()
+        super(Token, self).reconnect()
+
     def validate(self, doc):
         return doc
 
+    def _invalidateAllCached(self, event):
+        self._authCache.clear()
+
+    def _invalidateCachedToken(self, event):
+        self._authCache.pop(event.info['_id'])
+
+    def _invalidateCachedUser(self, event):
+        userId = event.info['_id']
+        self._authCache.removeIf(
+            lambda key, entry: entry['token'].get('userId') == userId)
+
+    def loadCached(self, tokenStr):
+        """
+        Load a token by its value, using the authentication cache if possible.
+        This does not perform any access checking. Expired tokens are treated
+        as missing.
+
+        :param tokenStr: The token value.
+        :type tokenStr: str
+        :returns: The token document, or None if there is no such valid token.
+        """
+        entry = self._authCache.get(tokenStr)
+        now = datetime.datetime.utcnow()
+
+        if entry is None or entry['token']['expires'] < now:
+            token = self.load(tokenStr, force=True, objectId=False)
+            if token is None or token['expires'] < now:
+                self._authCache.pop(tokenStr)
+                return token
+
+            entry = {'token': token}
+            self._authCache.set(tokenStr, entry)
+
+        # Callers may modify the document, so never hand out the cached one
+        return copy.deepcopy(entry['token'])
+
+    def loadCachedUser(self, token):
+        """
+        Load the user that owns a token, using the authentication cache if
+        possible. The cache entry is invalidated whenever the user is saved or
+        removed by this process, so group membership and admin status are
+        current here, and are at most "auth_ttl" seconds old when they were
+        changed by another process.
+
+        :param token: The token document, as returned by loadCached().
+        :type token: dict
+        :returns: The user document, or None if the user does not exist.
+        """
+        entry = self._authCache.get(token['_id'])
+
+        if entry is None or 'user' not in entry:
+            user = self.model('user').load(token['userId'], force=True)
+            if user is None:
+                return None
+
+            entry = {
+                'token': entry['token'] if entry else copy.deepcopy(token),
+                'user': user
+            }
+            self._authCache.set(token['_id'], entry)
+
+        return copy.deepcopy(entry['user'])
+
     def createToken(self, user=None, days=180, scope=None):
         """
         Creates a new token. You can create an anonymous token
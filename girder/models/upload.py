@@ -18,19 +18,35 @@
 ###############################################################################
 
 import datetime
+import os
+import re
 import six
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 
 from girder import events
+from girder.constants import AccessType
 from girder.utility import assetstore_utilities
 from .model_base import Model, ValidationException
 
+# How long a range of a parallel upload may be claimed without its data being
+# stored before the claim is considered abandoned and the range may be sent
+# again.
+PARALLEL_CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+# Fields of a file that describe its data rather than the file itself, and so
+# are not shared with a new file whose upload reuses that data.
+_FILE_FIELDS = ('_id', 'itemId', 'name', 'mimeType', 'exts', 'creatorId',
+                'created', 'copied', 'copierId', 'attachedToId',
+                'attachedToType')
+
 
 class Upload(Model):
     """
     This model stores temporary records for uploads that have been approved
     but are not yet complete, so that they can be uploaded in chunks of
-    arbitrary size. The chunks must be uploaded in order.
+    arbitrary size. The chunks must be uploaded in order, unless the upload
+    was created as a parallel upload.
     """
     def initialize(self):
         self.name = 'upload'
@@ -89,7 +105,7 @@ class Upload(Model):
 
         return doc
 
-    def handleChunk(self, upload, chunk):
+    def handleChunk(self, upload, chunk, offset=None):
         """
         When a chunk is uploaded, this should be called to process the chunk.
         If this is the final chunk of the upload, this method will finalize
@@ -99,11 +115,17 @@ class Upload(Model):
         :type upload: dict
         :param chunk: The file object representing the chunk that was uploaded.
         :type chunk: file
+        :param offset: The offset of the chunk within the file. This is only
+            used by parallel uploads, whose chunks may arrive in any order.
+        :type offset: int or None
         """
         assetstore = self.model('assetstore').load(upload['assetstoreId'])
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
 
-        upload = self.save(adapter.uploadChunk(upload, chunk))
+        if upload.get('parallel'):
+            upload = self._handleParallelChunk(upload, chunk, offset, adapter)
+        else:
+            upload = self.save(adapter.uploadChunk(upload, chunk))
 
         # If upload is finished, we finalize it
         if upload['received'] == upload['size']:
@@ -111,6 +133,129 @@ class Upload(Model):
         else:
             return upload
 
+    def _handleParallelChunk(self, upload, chunk, offset, adapter):
+        """
+        Store a chunk of a parallel upload and record the range of the file it
+        covers. The range is claimed with an atomic update that fails if it
+        overlaps one that was already claimed, before any data is stored, so
+        that chunks of the same upload can be handled concurrently without
+        overwriting each other's data, and exactly one of them completes the
+        upload.
+
+        :returns: The updated upload document.
+        """
+        if offset is None:
+            raise ValidationException(
+                'Chunks of parallel uploads must have an offset.', 'offset')
+
+        size = self._getParallelChunkSize(chunk, adapter)
+        adapter.checkUploadRange(upload, offset, size)
+        if not size:
+            return upload
+        chunkRange = {'start': offset, 'end': offset + size}
+
+        claim, result = self._claimRange(upload, chunkRange)
+        if claim is None:
+            # A chunk that was already received is accepted again without
+            # storing it.
+            ranges = [r for r in result['ranges'] if
+                      r['start'] < chunkRange['end'] and r['end'] > offset]
+            if ranges == [chunkRange]:
+                return result
+            elif len(ranges) == 1 and ranges[0].get('pending') and \
+                    ranges[0]['start'] == offset and \
+                    ranges[0]['end'] == chunkRange['end']:
+                raise ValidationException(
+                    'Chunk is already being received.', 'offset')
+            raise ValidationException(
+                'Chunk overlaps data that was already received.', 'offset')
+
+        try:
+            stored = adapter.uploadChunkAt(upload, chunk, offset)
+            if stored != size:
+                raise ValidationException(
+                    'Expected chunk size %d, but got %d.' % (size, stored))
+        except Exception:
+            self.collection.update_one({'_id': upload['_id']}, {
+                '$pull': {'ranges': {'claim': claim['claim']}}
+            })
+            raise
+
+        result = self.collection.find_one_and_update({
+            '_id': upload['_id'],
+            'ranges': {'$elemMatch': {'claim': claim['claim']}}
+        }, {
+            '$unset': {'ranges.$.pending': True, 'ranges.$.claim': True,
+                       'ranges.$.claimed': True},
+            '$inc': {'received': size},
+            '$set': {'updated': datetime.datetime.utcnow()}
+        }, return_document=ReturnDocument.AFTER)
+        # If this took so long that the claim was taken over, the chunk that
+        # took it over records the range instead.
+        return result or self.findOne({'_id': upload['_id']})
+
+    def _claimRange(self, upload, chunkRange):
+        """
+        Atomically claim a range of a parallel upload as pending, unless it
+        overlaps a range that was already claimed. Claims that have been
+        pending for longer than PARALLEL_CLAIM_TIMEOUT were abandoned, for
+        instance by a process that stopped, and are released so that their
+        ranges can be sent again.
+
+        :returns: A tuple of the claimed range, or None if the range overlaps
+            another, and the upload document.
+        """
+        claim = dict(chunkRange, pending=True, claim=ObjectId(),
+                     claimed=datetime.datetime.utcnow())
+        overlap = {'$elemMatch': {
+            'start': {'$lt': chunkRange['end']},
+            'end': {'$gt': chunkRange['start']}
+        }}
+        while True:
+            result = self.collection.find_one_and_update({
+                '_id': upload['_id'],
+                'ranges': {'$not': overlap}
+            }, {
+                '$push': {'ranges': claim},
+                '$set': {'updated': datetime.datetime.utcnow()}
+            }, return_document=ReturnDocument.AFTER)
+            if result is not None:
+                return claim, result
+
+            result = self.findOne({'_id': upload['_id']})
+            if result is None:
+                raise ValidationException('The upload no longer exists.')
+            stale = datetime.datetime.utcnow() - PARALLEL_CLAIM_TIMEOUT
+            ranges = [r for r in result['ranges'] if
+                      r['start'] < chunkRange['end'] and
+                      r['end'] > chunkRange['start']]
+            abandoned = [r for r in ranges
+                         if r.get('pending') and r['claimed'] < stale]
+            if ranges and abandoned != ranges:
+                return None, result
+            if abandoned:
+                self.collection.update_one({'_id': upload['_id']}, {
+                    '$pull': {'ranges': {'claim': {
+                        '$in': [r['claim'] for r in abandoned]}}}
+                })
+
+    def _getParallelChunkSize(self, chunk, adapter):
+        """
+        Get the size of a chunk of a parallel upload, which must be known so
+        that its range can be claimed before it is stored.
+        """
+        size = adapter.getChunkSize(chunk)
+        if size is None and hasattr(chunk, 'seek') and hasattr(chunk, 'tell'):
+            position = chunk.tell()
+            chunk.seek(0, os.SEEK_END)
+            size = chunk.tell() - position
+            chunk.seek(position)
+        if size is None:
+            raise ValidationException(
+                'The size of each chunk of a parallel upload must be known.',
+                'chunk')
+        return size
+
     def requestOffset(self, upload):
         """
         Requests the offset that should be used to resume uploading. This
@@ -170,7 +315,10 @@ class Upload(Model):
                 mimeType=upload['mimeType'], saveFile=False)
 
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
-        file = adapter.finalizeUpload(upload, file)
+        if 'sourceFileId' in upload:
+            file = self._reuseFileData(upload, file, adapter)
+        else:
+            file = adapter.finalizeUpload(upload, file)
         self.model('file').save(file)
         self.remove(upload)
 
@@ -185,6 +333,48 @@ class Upload(Model):
 
         return file
 
+    def _reuseFileData(self, upload, file, adapter):
+        """
+        Point a new file at the data of the existing file that its upload
+        matched, in the same way that copied files share their data, and
+        discard whatever the assetstore set up to receive the upload.
+        """
+        source = self.model('file').load(upload['sourceFileId'], force=True)
+        if (source is None or source['assetstoreId'] != file['assetstoreId'] or
+                source['size'] != upload['size'] or
+                source.get('sha512') != upload['sha512']):
+            raise ValidationException(
+                'The data of this upload is no longer stored.', 'sha512')
+
+        file.update({k: v for k, v in six.viewitems(source)
+                     if k not in _FILE_FIELDS})
+        file = adapter.copyFile(source, file)
+        adapter.cancelUpload(upload)
+        return file
+
+    def _findReusableFile(self, user, assetstore, size, sha512):
+        """
+        Find a file in an assetstore whose data has the given size and SHA-512
+        checksum, and that the user is allowed to read.
+
+        :returns: The file document, or None if there is no such file.
+        """
+        # Imported files are left out, since their data may be changed
+        # outside of Girder.
+        files = self.model('file').find({
+            'assetstoreId': assetstore['_id'],
+            'sha512': sha512,
+            'size': size,
+            'itemId': {'$ne': None},
+            'imported': {'$ne': True}
+        })
+        for file in files:
+            item = self.model('item').load(file['itemId'], force=True)
+            if item is not None and self.model('item').hasAccess(
+                    item, user, AccessType.READ):
+                return file
+        return None
+
     def getTargetAssetstore(self, modelType, resource):
         """
         Get the assetstore for a particular target resource, i.e. where new
@@ -207,7 +397,20 @@ class Upload(Model):
 
         return assetstore
 
-    def createUploadToFile(self, file, user, size, reference=None):
+    def _setParallel(self, upload, adapter):
+        """
+        Mark a new upload as one whose chunks may be sent in any order and
+        concurrently.
+        """
+        if not adapter.supportsParallelUpload:
+            raise ValidationException(
+                'The assetstore does not support parallel uploads.',
+                'parallel')
+        upload['parallel'] = True
+        upload['ranges'] = []
+
+    def createUploadToFile(self, file, user, size, reference=None,
+                           parallel=False):
         """
         Creates a new upload record into a file that already exists. This
         should be used when updating the contents of a file. Deletes any
@@ -221,6 +424,9 @@ class Upload(Model):
         :param reference: An optional reference string that will be sent to the
                           data.process event.
         :type reference: str
+        :param parallel: Whether the chunks may be sent in any order and
+            concurrently, each with its own offset.
+        :type parallel: bool
         """
         assetstore = self.getTargetAssetstore('file', file)
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
@@ -239,11 +445,13 @@ class Upload(Model):
         }
         if reference is not None:
             upload['reference'] = reference
+        if parallel and size > 0:
+            self._setParallel(upload, adapter)
         upload = adapter.initUpload(upload)
         return self.save(upload)
 
     def createUpload(self, user, name, parentType, parent, size, mimeType=None,
-                     reference=None):
+                     reference=None, parallel=False, sha512=None):
         """
         Creates a new upload record, and creates its temporary file
         that the chunks will be written into. Chunks should then be sent
@@ -264,6 +472,15 @@ class Upload(Model):
         :param reference: An optional reference string that will be sent to the
                           data.process event.
         :type reference: str
+        :param parallel: Whether the chunks may be sent in any order and
+            concurrently, each with its own offset.
+        :type parallel: bool
+        :param sha512: The SHA-512 checksum of the file, if it is known. If
+            the target assetstore already stores a file of the same size and
+            checksum that the user can read, its data is reused and the upload
+            is created with all of its bytes received, so it only needs to be
+            finalized.
+        :type sha512: str
         :returns: The upload document that was created.
         """
         assetstore = self.getTargetAssetstore(parentType, parent)
@@ -296,6 +513,22 @@ class Upload(Model):
         else:
             upload['userId'] = None
 
+        if sha512 is not None:
+            sha512 = sha512.lower()
+            if not re.match(r'^[0-9a-f]{128}$', sha512):
+                raise ValidationException(
+                    'The SHA-512 checksum must be 128 hexadecimal digits.',
+                    'sha512')
+            source = size > 0 and self._findReusableFile(
+                user, assetstore, size, sha512)
+            if source:
+                upload['sha512'] = sha512
+                upload['sourceFileId'] = source['_id']
+                upload['received'] = size
+                parallel = False
+
+        if parallel and size > 0:
+            self._setParallel(upload, adapter)
         upload = adapter.initUpload(upload)
         return self.save(upload)
 
@@ -377,3 +610,45 @@ class Upload(Model):
                 # this assetstore is currently unreachable, so skip it
                 pass
         return results
+
+    def checkConsistency(self, stage, progress=None, report=False):
+        """
+        Check all of the uploads in progress and make sure they are valid. This
+        operates in the same stages as the item consistency check, but only
+        the remove stage does anything: it discards uploads whose parents,
+        files, users, or assetstores do not exist.
+
+        :param stage: which stage of the check to run: count or remove.
+        :param progress: an optional progress context to update.
+        :param report: if True, only find the problems; do not correct them.
+        :type report: bool
+        :returns: numUploads: number of uploads to check or processed,
+                  changed: a set of the _ids of the uploads removed.
+        """
+        if stage == 'count':
+            return self.find(limit=1).count(), set()
+        elif stage != 'remove':
+            return 0, set()
+
+        references = [
+            ('parentId', self.model('folder'), {'parentType': 'folder'}),
+            ('parentId', self.model('item'), {'parentType': 'item'}),
+            ('fileId', self.model('file'), {'fileId': {'$exists': True}}),
+            ('userId', self.model('user'), {'userId': {'$ne': None}}),
+            ('assetstoreId', self.model('assetstore'), {})]
+        lostUploads = set()
+        for field, model, query in references:
+            missing = list(self.findDanglingReferences(field, model, query))
+            if not missing:
+                continue
+            for upload in self.find(dict(query, **{field: {'$in': missing}})):
+                if upload['_id'] in lostUploads:
+                    continue
+                lostUploads.add(upload['_id'])
+                if not report:
+                    self.cancelUpload(upload)
+
+        if lostUploads and progress is not None:
+            progress.update(message='Removed %d orphaned uploads' %
+                            len(lostUploads))
+        return len(lostUploads), lostUploads
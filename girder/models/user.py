@@ -34,7 +34,9 @@ class User(AccessControlledModel):
 
     def initialize(self):
         self.name = 'user'
-        self.ensureIndices(['login', 'email', 'groupInvites.groupId'])
+        self.ensureIndices(['login', 'email', 'groupInvites.groupId', 'public',
+                            'access.users.id', 'access.groups.id',
+                            ([('lastName', 1), ('_id', 1)], {})])
         self.prefixSearchFields = (
             'login', ('firstName', 'i'), ('lastName', 'i'))
 
@@ -147,16 +149,10 @@ class User(AccessControlledModel):
             {'$pull': {'requests': user['_id']}}
         )
 
-        # Delete all of the folders under this user
-        folders = self.model('folder').find({
-            'parentId': user['_id'],
-            'parentCollection': 'user'
-        })
-        for folder in folders:
-            self.model('folder').remove(folder, progress=progress, **kwargs)
-
-        # Finally, delete the user document itself
-        AccessControlledModel.remove(self, user)
+        # Delete all of the folders under this user in batches, and finally the
+        # user document itself
+        deletion = self.model('deletion').createDeletion(user, 'user')
+        self.model('deletion').collect(deletion, progress=progress, **kwargs)
         if progress:
             progress.update(increment=1, message='Deleted user ' +
                             user['login'])
@@ -169,7 +165,8 @@ class User(AccessControlledModel):
         """
         return self.find({'admin': True})
 
-    def search(self, text=None, user=None, limit=0, offset=0, sort=None):
+    def search(self, text=None, user=None, limit=0, offset=0, sort=None,
+               fields=None, filters=None):
         """
         List all users. Since users are access-controlled, this will filter
         them by access policy.
@@ -180,18 +177,20 @@ class User(AccessControlledModel):
         :param limit: Result limit.
         :param offset: Result offset.
         :param sort: The sort structure to pass to pymongo.
+        :param fields: The subset of fields to load from each user, or None to
+            load the full documents.
+        :param filters: Additional query operators to apply.
+        :type filters: dict
         :returns: Iterable of users.
         """
-        # Perform the find; we'll do access-based filtering of the result set
-        # afterward.
         if text is not None:
-            cursor = self.textSearch(text, sort=sort)
-        else:
-            cursor = self.find({}, sort=sort)
+            return self.textSearch(
+                text, user=user, level=AccessType.READ, limit=limit,
+                offset=offset, sort=sort, fields=fields, filters=filters)
 
-        return self.filterResultsByPermission(
-            cursor=cursor, user=user, level=AccessType.READ, limit=limit,
-            offset=offset)
+        return self.findWithPermissions(
+            filters or {}, sort=sort, user=user, level=AccessType.READ,
+            limit=limit, offset=offset, fields=fields)
 
     def setPassword(self, user, password, save=True):
         """
@@ -329,3 +328,24 @@ class User(AccessControlledModel):
             folder, includeItems=includeItems, user=user, level=level)
             for folder in folders)
         return count
+
+    def checkConsistency(self, stage, progress=None, report=False):
+        """
+        Check all of the users and make sure they are valid. Only the
+        propagate stage does anything: it corrects the size of each user to
+        the total size of the folders under it, once the folder check has
+        corrected those.
+
+        :param stage: which stage of the check to run.
+        :param progress: an optional progress context to update.
+        :param report: if True, only find the problems; do not correct them.
+        :type report: bool
+        :returns: numUsers: number of users processed,
+                  changed: a set of the _ids of the users changed.
+        """
+        if stage != 'propagate':
+            return 0, set()
+        if progress is not None:
+            progress.update(message='Checking user sizes')
+        return self.checkSizes(
+            self.model('folder'), 'baseParentId', report=report)
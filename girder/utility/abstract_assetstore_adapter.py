@@ -28,6 +28,11 @@ class AbstractAssetstoreAdapter(ModelImporter):
     """
     This defines the interface to be used by all assetstore adapters.
     """
+    # Adapters that can store the chunks of an upload at any offset, so that
+    # they may be sent in any order and concurrently, should set this and
+    # implement uploadChunkAt.
+    supportsParallelUpload = False
+
     def __init__(self, assetstore):
         self.assetstore = assetstore
 
@@ -88,6 +93,24 @@ class AbstractAssetstoreAdapter(ModelImporter):
         raise NotImplementedError('Must override processChunk in %s.' %
                                   self.__class__.__name__)  # pragma: no cover
 
+    def uploadChunkAt(self, upload, chunk, offset):
+        """
+        Call this method to store a chunk of a parallel upload at its offset
+        within the file. Chunks of the same upload may be handled concurrently,
+        so this must not modify the upload document; the caller records which
+        bytes have been received.
+
+        :param upload: The upload document.
+        :type upload: dict
+        :param chunk: The file object representing the chunk that was uploaded.
+        :type chunk: file
+        :param offset: The offset of the chunk within the file.
+        :type offset: int
+        :returns: The number of bytes that were stored.
+        """
+        raise NotImplementedError('Must override uploadChunkAt in %s.' %
+                                  self.__class__.__name__)  # pragma: no cover
+
     def finalizeUpload(self, upload, file):
         """
         Call this once the last chunk has been processed. This method does not
@@ -125,6 +148,20 @@ class AbstractAssetstoreAdapter(ModelImporter):
         raise NotImplementedError('Must override deleteFile in %s.' %
                                   self.__class__.__name__)  # pragma: no cover
 
+    def deleteFiles(self, files):
+        """
+        This is called when many Files in this assetstore are deleted at once.
+        Like deleteFile, this should not modify or delete the file objects.
+        The default implementation calls deleteFile for each of them; adapters
+        that share data between files should override it, since every file in
+        the list still exists when it is called.
+
+        :param files: The File documents about to be deleted.
+        :type files: list of dict
+        """
+        for file in files:
+            self.deleteFile(file)
+
     def downloadFile(self, file, offset=0, headers=True, endByte=None,
                      contentDisposition=None):
         """
@@ -251,6 +288,31 @@ class AbstractAssetstoreAdapter(ModelImporter):
                 SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE):
             raise ValidationException('Chunk is smaller than the minimum size.')
 
+    def checkUploadRange(self, upload, offset, chunkSize):
+        """
+        Check if a chunk of a parallel upload is valid based on its offset and
+        size. If this raises an exception, then the caller should clean up and
+        reraise the exception.
+
+        :param upload: the dictionary of upload information.  The size value
+                       is used.
+        :param offset: the offset of the chunk within the file.
+        :type offset: int
+        :param chunkSize: the chunk size that needs to be validated.
+        :type chunkSize: a non-negative integer or None if unknown.
+        """
+        if offset < 0 or offset >= upload['size']:
+            raise ValidationException(
+                'Chunk offset must be within the file.', 'offset')
+        if chunkSize is None:
+            return
+        if offset + chunkSize > upload['size']:
+            raise ValidationException('Received too many bytes.')
+        if offset + chunkSize != upload['size'] and \
+                chunkSize < self.model('setting').get(
+                SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE):
+            raise ValidationException('Chunk is smaller than the minimum size.')
+
     def cancelUpload(self, upload):
         """
         This is called when an upload has been begun and it should be
@@ -17,6 +17,7 @@
 #  limitations under the License.
 ###############################################################################
 
+import collections
 import itertools
 import six
 
@@ -65,6 +66,43 @@ class AccessControlMixin(object):
 
         return doc
 
+    def loadMany(self, ids, level=AccessType.ADMIN, user=None, objectId=True,
+                 force=False, fields=None, exc=False):
+        """
+        Calls Model.loadMany on the current model, and then loads all of the
+        distinct resourceParents of the results with a single query per parent
+        type, which the user must have access to.
+
+        Takes the same parameters as
+        :py:func:`girder.models.model_base.AccessControlledModel.loadMany`.
+        """
+        docs = Model.loadMany(
+            self, ids, objectId=objectId, fields=fields, exc=exc)
+
+        if not force:
+            parents = collections.defaultdict(set)
+            for doc in docs:
+                if doc.get(self.resourceParent):
+                    parents[self.resourceColl].add(doc[self.resourceParent])
+                else:
+                    parents[doc['attachedToType']].add(doc['attachedToId'])
+
+            for loadType, loadIds in six.viewitems(parents):
+                self.model(loadType).loadMany(
+                    list(loadIds), level=level, user=user, exc=exc)
+
+        return docs
+
+    def filterProjection(self, user=None, additionalKeys=None):
+        """
+        Override of Model.filterProjection that also includes the fields that
+        are needed to resolve access through the resourceParent.
+        """
+        keys = set(Model.filterProjection(self, user, additionalKeys))
+        keys.update((self.resourceParent, 'attachedToType', 'attachedToId'))
+
+        return list(keys)
+
     def hasAccess(self, resource, user=None, level=AccessType.READ):
         """
         Determines if a user has access to a resource based on their access to
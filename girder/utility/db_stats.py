@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module counts and times the database operations performed while handling
+each request, broken down by collection. It is controlled by the "profiling"
+config section: if "db_stats" is set, the totals are sent in the Server-Timing
+and X-Girder-Db-Ops response headers and written to the access log, and if
+"db_ops_threshold" is set, a warning is logged for any request that performs
+more operations than that.
+"""
+
+import cherrypy
+import collections
+import time
+
+from girder import logger
+from girder.external.mongodb_proxy import MongoProxy
+from girder.utility import config
+
+# Collection methods that talk to the database and are worth counting
+COUNTED_METHODS = frozenset((
+    'aggregate', 'bulk_write', 'count', 'delete_many', 'delete_one',
+    'distinct', 'find', 'find_and_modify', 'find_one', 'find_one_and_delete',
+    'find_one_and_replace', 'find_one_and_update', 'insert', 'insert_many',
+    'insert_one', 'remove', 'replace_one', 'save', 'update', 'update_many',
+    'update_one'))
+
+
+def _getConfig():
+    return config.getConfig().get('profiling', {})
+
+
+def getRequestStats():
+    """
+    Return the database statistics of the current request, or None if they
+    are not being collected. The statistics map each collection name to a dict
+    of method name to [count, seconds].
+    """
+    request = cherrypy.request
+    stats = getattr(request, 'girderDbStats', None)
+
+    if stats is None and request.app is not None:
+        cfg = _getConfig()
+        if cfg.get('db_stats') or cfg.get('db_ops_threshold'):
+            stats = request.girderDbStats = collections.defaultdict(
+                lambda: collections.defaultdict(lambda: [0, 0.0]))
+            request.hooks.attach('before_finalize', _sendHeaders)
+            request.hooks.attach('on_end_request', _logStats)
+
+    return stats
+
+
+def summarize(stats):
+    """
+    Return the total number of operations and seconds in a set of request
+    statistics, and a dict of the same totals per collection.
+    """
+    perCollection = {
+        name: (sum(op[0] for op in ops.values()),
+               sum(op[1] for op in ops.values()))
+        for name, ops in stats.items()}
+
+    return (sum(c[0] for c in perCollection.values()),
+            sum(c[1] for c in perCollection.values()), perCollection)
+
+
+def _formatOps(stats):
+    total = summarize(stats)[0]
+    return '; '.join(['%d' % total] + [
+        '%s.%s=%d' % (name, method, op[0])
+        for name, ops in sorted(stats.items())
+        for method, op in sorted(ops.items()) if op[0]])
+
+
+def _sendHeaders():
+    stats = cherrypy.request.girderDbStats
+    if not stats or not _getConfig().get('db_stats'):
+        return
+
+    count, seconds, perCollection = summarize(stats)
+    timings = ['db;dur=%.3f;desc="%d operations"' % (seconds * 1000, count)]
+    timings += [
+        'db-%s;dur=%.3f;desc="%d operations"' % (name, c[1] * 1000, c[0])
+        for name, c in sorted(perCollection.items())]
+
+    headers = cherrypy.response.headers
+    headers['Server-Timing'] = ', '.join(timings)
+    headers['X-Girder-Db-Ops'] = _formatOps(stats)
+
+
+def _logStats():
+    request = cherrypy.request
+    stats = request.girderDbStats
+    if not stats:
+        return
+
+    cfg = _getConfig()
+    count, seconds = summarize(stats)[:2]
+    line = '%s %s: %s database operations in %.1f ms' % (
+        request.method, request.path_info, _formatOps(stats), seconds * 1000)
+
+    if cfg.get('db_stats'):
+        cherrypy.log.access_log.info(line)
+
+    threshold = cfg.get('db_ops_threshold')
+    if threshold and count > threshold:
+        logger.warning('Request exceeded the database operation threshold '
+                       '(%d): %s' % (threshold, line))
+
+
+def _record(ops, method, start):
+    ops[method][1] += time.time() - start
+
+
+class _StatsExecutable(object):
+    """
+    Wraps a collection method so that calling it is counted and timed. If it
+    returns a cursor, the time spent iterating the cursor is added too.
+    """
+    def __init__(self, method, ops, name):
+        self.method = method
+        self.ops = ops
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        self.ops[self.name][0] += 1
+        start = time.time()
+        try:
+            val = self.method(*args, **kwargs)
+        finally:
+            _record(self.ops, self.name, start)
+
+        if isinstance(val, MongoProxy):
+            return _StatsCursor(val, self.ops, self.name)
+        return val
+
+
+class _StatsCursor(object):
+    """
+    Proxies a cursor, timing its iteration and counting calls to its count
+    method.
+    """
+    def __init__(self, cursor, ops, name):
+        self._cursor = cursor
+        self._ops = ops
+        self._name = name
+
+    def __getattr__(self, key):
+        attr = getattr(self._cursor, key)
+        if key == 'count':
+            return _StatsExecutable(attr, self._ops, 'count')
+        return attr
+
+    def __getitem__(self, key):
+        return self._cursor[key]
+
+    def __iter__(self):
+        iterator = iter(self._cursor)
+        while True:
+            start = time.time()
+            try:
+                doc = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _record(self._ops, self._name, start)
+            yield doc
+
+    def __nonzero__(self):
+        return True
+
+    __bool__ = __nonzero__
+
+
+class StatsCollectionProxy(MongoProxy):
+    """
+    A MongoProxy for a collection that counts and times its operations in the
+    statistics of the current request, if they are being collected.
+    """
+    def __getattr__(self, key):
+        attr = MongoProxy.__getattr__(self, key)
+
+        if key in COUNTED_METHODS:
+            stats = getRequestStats()
+            if stats is not None:
+                return _StatsExecutable(attr, stats[self.conn.name], key)
+
+        return attr
@@ -26,14 +26,36 @@ import stat
 import tempfile
 
 from six import BytesIO
-from hashlib import sha512
-from . import hash_state
+from six.moves import urllib
+from . import upload_checksum
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 from girder.models.model_base import ValidationException, GirderException
 from girder import logger
-from girder.utility import mkdir, progress
+from girder.utility import config, mkdir, progress
 
 BUF_SIZE = 65536
+# Downloads are read in larger blocks, so that fewer pass through Python
+DOWNLOAD_BUF_SIZE = 1024 * 1024
+
+
+def _adviseSequential(fd, offset, length):
+    """
+    Tell the kernel that part of a file is about to be read sequentially, so
+    that it reads ahead more aggressively. This does nothing where
+    posix_fadvise isn't available.
+
+    :param fd: The file descriptor.
+    :type fd: int
+    :param offset: The first byte that will be read.
+    :type offset: int
+    :param length: The number of bytes that will be read.
+    :type length: int
+    """
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
 
 
 class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
@@ -45,6 +67,7 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
     :param assetstore: The assetstore to act on.
     :type assetstore: dict
     """
+    supportsParallelUpload = True
 
     @staticmethod
     def validateInfo(doc):
@@ -123,7 +146,7 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         fd, path = tempfile.mkstemp(dir=self.tempDir)
         os.close(fd)  # Must close this file descriptor or it will leak
         upload['tempFile'] = path
-        upload['sha512state'] = hash_state.serializeHex(sha512())
+        upload_checksum.initChecksum(upload)
         return upload
 
     def uploadChunk(self, upload, chunk):
@@ -139,30 +162,24 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, six.binary_type):
             chunk = BytesIO(chunk)
 
-        # Restore the internal state of the streaming SHA-512 checksum
-        checksum = hash_state.restoreHex(upload['sha512state'], 'sha512')
+        checksum = upload_checksum.restoreChecksum(
+            upload, lambda: self._readTempFile(
+                upload, upload['sha512stateReceived'], upload['received']))
 
+        checkpoint = False
         if self.requestOffset(upload) > upload['received']:
             # This probably means the server died midway through writing last
             # chunk to disk, and the database record was not updated. This means
             # we need to update the sha512 state with the difference.
-            with open(upload['tempFile'], 'rb') as tempFile:
-                tempFile.seek(upload['received'])
-                while True:
-                    data = tempFile.read(BUF_SIZE)
-                    if not data:
-                        break
-                    checksum.update(data)
+            for data in self._readTempFile(upload, upload['received']):
+                checksum.update(data)
+            checkpoint = True
 
         with open(upload['tempFile'], 'a+b') as tempFile:
-            size = 0
-            while not upload['received'] + size > upload['size']:
-                data = chunk.read(BUF_SIZE)
-                if not data:
-                    break
-                size += len(data)
-                tempFile.write(data)
-                checksum.update(data)
+            size = upload_checksum.pipeline(
+                lambda: chunk.read(BUF_SIZE),
+                (tempFile.write, checksum.update),
+                limit=upload['size'] - upload['received'])
         chunk.close()
 
         try:
@@ -172,24 +189,83 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 tempFile.truncate(upload['received'])
             raise
 
-        # Persist the internal state of the checksum
-        upload['sha512state'] = hash_state.serializeHex(checksum)
         upload['received'] += size
+        # The state no longer matches what has been received if we had to
+        # recover data written by a previous request, so keep it in the
+        # document as well.
+        upload_checksum.saveChecksum(upload, checksum, checkpoint=checkpoint)
         return upload
 
+    def uploadChunkAt(self, upload, chunk, offset):
+        """
+        Writes the chunk of a parallel upload into the temporary file at its
+        offset.
+        """
+        # If we know the chunk size is too large or small, fail early.
+        self.checkUploadRange(upload, offset, self.getChunkSize(chunk))
+
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf8')
+
+        if isinstance(chunk, six.binary_type):
+            chunk = BytesIO(chunk)
+
+        size = 0
+        with open(upload['tempFile'], 'r+b') as tempFile:
+            tempFile.seek(offset)
+            while not offset + size > upload['size']:
+                data = chunk.read(BUF_SIZE)
+                if not data:
+                    break
+                size += len(data)
+                tempFile.write(data)
+
+            if offset + size > upload['size']:
+                tempFile.truncate(upload['size'])
+        chunk.close()
+
+        self.checkUploadRange(upload, offset, size)
+        return size
+
     def requestOffset(self, upload):
         """
         Returns the size of the temp file.
         """
         return os.stat(upload['tempFile']).st_size
 
+    def _readTempFile(self, upload, start, end=None):
+        """
+        Generator that reads part of the temporary file of an upload.
+
+        :param upload: The upload document.
+        :type upload: dict
+        :param start: The offset to start reading from.
+        :type start: int
+        :param end: The offset to stop reading at, or None to read to the end.
+        :type end: int or None
+        """
+        with open(upload['tempFile'], 'rb') as tempFile:
+            tempFile.seek(start)
+            while end is None or start < end:
+                data = tempFile.read(
+                    BUF_SIZE if end is None else min(BUF_SIZE, end - start))
+                if not data:
+                    break
+                start += len(data)
+                yield data
+
     def finalizeUpload(self, upload, file):
         """
         Moves the file into its permanent content-addressed location within the
         assetstore. Directory hierarchy yields 256^2 buckets.
         """
-        hash = hash_state.restoreHex(upload['sha512state'],
-                                     'sha512').hexdigest()
+        if upload.get('parallel'):
+            hash = upload_checksum.fullChecksum(self._readTempFile(upload, 0))
+        else:
+            hash = upload_checksum.finalChecksum(
+                upload, lambda: self._readTempFile(
+                    upload, upload['sha512stateReceived'],
+                    upload['received']))
         dir = os.path.join(hash[0:2], hash[2:4])
         absdir = os.path.join(self.assetstore['root'], dir)
 
@@ -244,17 +320,31 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 'file-does-not-exist')
 
         if headers:
+            # The proxy can serve the whole file or the range the client asked
+            # for, but not an offset passed as a parameter. It is only given
+            # files inside the assetstore root.
+            offload = config.getConfig().get('server', {}).get(
+                'download_offload', 'none')
+            if offload != 'none' and (
+                    'Range' in cherrypy.request.headers or
+                    (offset == 0 and endByte == file['size'])):
+                relpath = self._pathInRoot(path)
+                if relpath is not None:
+                    return self._offloadDownload(
+                        file, relpath, offload, contentDisposition)
+
             cherrypy.response.headers['Accept-Ranges'] = 'bytes'
             self.setContentHeaders(file, offset, endByte, contentDisposition)
 
         def stream():
             bytesRead = offset
             with open(path, 'rb') as f:
+                _adviseSequential(f.fileno(), offset, endByte - offset)
                 if offset > 0:
                     f.seek(offset)
 
                 while True:
-                    readLen = min(BUF_SIZE, endByte - bytesRead)
+                    readLen = min(DOWNLOAD_BUF_SIZE, endByte - bytesRead)
                     if readLen <= 0:
                         break
 
@@ -267,6 +357,64 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return stream
 
+    def _pathInRoot(self, path):
+        """
+        Get the path of a file relative to the assetstore root, after
+        resolving any symbolic links.
+
+        :param path: The absolute path of the file on disk.
+        :type path: str
+        :returns: The relative path, or None if the file is outside of the
+            assetstore root, as imported files may be.
+        """
+        root = os.path.realpath(self.assetstore['root'])
+        path = os.path.realpath(path)
+        if not path.startswith(os.path.join(root, '')):
+            return None
+        return os.path.relpath(path, root)
+
+    def _offloadDownload(self, file, relpath, offload, contentDisposition):
+        """
+        Leave sending the data of a download to the front-end proxy, by
+        responding with a header that names the file to send instead of its
+        contents. For nginx, the file is named by a path under the internal
+        location of this assetstore, which is the configured prefix followed
+        by the assetstore _id, and which should be aliased to its root.
+
+        :param file: The file being downloaded.
+        :type file: dict
+        :param relpath: The path of the file relative to the assetstore root.
+        :type relpath: str
+        :param offload: Either "x-accel-redirect" for nginx, or "x-sendfile"
+            for Apache and lighttpd.
+        :type offload: str
+        :param contentDisposition: See :py:meth:`setContentHeaders`.
+        :returns: A generator function that yields an empty body.
+        """
+        self.setContentHeaders(file, 0, file['size'], contentDisposition)
+        # The proxy works out the length and range of what it sends
+        cherrypy.response.headers['Content-Length'] = 0
+
+        if offload == 'x-accel-redirect':
+            prefix = config.getConfig()['server'].get(
+                'download_offload_prefix', '/girder-files')
+            cherrypy.response.headers['X-Accel-Redirect'] = '/'.join((
+                prefix.rstrip('/'), str(self.assetstore['_id']),
+                urllib.parse.quote(relpath.replace(os.sep, '/'))))
+        elif offload == 'x-sendfile':
+            cherrypy.response.headers['X-Sendfile'] = os.path.join(
+                os.path.realpath(self.assetstore['root']), relpath)
+        else:
+            raise GirderException(
+                'Unknown download offload mode "%s".' % offload,
+                'girder.utility.filesystem_assetstore_adapter.'
+                'unknown-download-offload')
+
+        def stream():
+            yield b''
+
+        return stream
+
     def deleteFile(self, file):
         """
         Deletes the file from disk if it is the only File in this assetstore
@@ -285,10 +433,32 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
             if os.path.isfile(path):
                 os.remove(path)
 
+    def deleteFiles(self, files):
+        """
+        Deletes many files from disk at once, using a single query to find
+        which of them share their data with files that are not being deleted.
+        Imported files are not actually deleted.
+        """
+        files = [file for file in files if not file.get('imported')]
+        if not files:
+            return
+
+        shared = {doc['sha512'] for doc in self.model('file').find({
+            'sha512': {'$in': list({file['sha512'] for file in files})},
+            'assetstoreId': self.assetstore['_id'],
+            '_id': {'$nin': [file['_id'] for file in files]}
+        }, fields=['sha512'])}
+
+        for file in files:
+            path = os.path.join(self.assetstore['root'], file['path'])
+            if file['sha512'] not in shared and os.path.isfile(path):
+                os.remove(path)
+
     def cancelUpload(self, upload):
         """
         Delete the temporary files associated with a given upload.
         """
+        upload_checksum.discardChecksum(upload)
         if os.path.exists(upload['tempFile']):
             os.unlink(upload['tempFile'])
 
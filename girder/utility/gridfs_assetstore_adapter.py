@@ -19,17 +19,18 @@
 
 import bson
 import cherrypy
+import itertools
 import pymongo
 import six
 import uuid
 
 from six import BytesIO
 from girder import logger
+from girder.utility import progress
 from girder.models import getDbConnection
 from girder.models.model_base import ValidationException
 
-from hashlib import sha512
-from . import hash_state
+from . import upload_checksum
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 
 
@@ -43,6 +44,7 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
     This assetstore type stores files within MongoDB using the GridFS data
     model.
     """
+    supportsParallelUpload = True
 
     @staticmethod
     def validateInfo(doc):
@@ -102,7 +104,8 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         Creates a UUID that will be used to uniquely link each chunk to
         """
         upload['chunkUuid'] = uuid.uuid4().hex
-        upload['sha512state'] = hash_state.serializeHex(sha512())
+        upload['sha512stateChunk'] = 0
+        upload_checksum.initChecksum(upload)
         return upload
 
     def uploadChunk(self, upload, chunk):
@@ -119,21 +122,21 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, six.binary_type):
             chunk = BytesIO(chunk)
 
-        # Restore the internal state of the streaming SHA-512 checksum
-        checksum = hash_state.restoreHex(upload['sha512state'], 'sha512')
+        checksum = upload_checksum.restoreChecksum(
+            upload, lambda: self._readChunks(
+                upload, upload['sha512stateChunk']))
 
         # This bit of code will only do anything if there is a discrepancy
         # between the received count of the upload record and the length of
         # the file stored as chunks in the database. This code simply updates
         # the sha512 state with the difference before reading the bytes sent
         # from the user.
+        checkpoint = False
         if self.requestOffset(upload) > upload['received']:
-            cursor = self.chunkColl.find({
-                'uuid': upload['chunkUuid'],
-                'n': {'$gte': upload['received'] // CHUNK_SIZE}
-            }, projection=['data']).sort('n', pymongo.ASCENDING)
-            for result in cursor:
-                checksum.update(result['data'])
+            for data in self._readChunks(
+                    upload, upload['received'] // CHUNK_SIZE):
+                checksum.update(data)
+            checkpoint = True
 
         cursor = self.chunkColl.find({
             'uuid': upload['chunkUuid']
@@ -143,13 +146,11 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         else:
             n = cursor[0]['n'] + 1
 
-        size = 0
         startingN = n
+        chunkNumbers = itertools.count(n)
 
-        while not upload['received']+size > upload['size']:
-            data = chunk.read(CHUNK_SIZE)
-            if not data:
-                break
+        def insertChunk(data):
+            n = next(chunkNumbers)
             # If a timeout occurs while we are trying to load data, we might
             # have succeeded, in which case we will get a DuplicateKeyError
             # when it automatically retries.  Therefore, log this error but
@@ -164,9 +165,10 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
                 logger.info('Received a DuplicateKeyError while uploading, '
                             'probably because we reconnected to the database '
                             '(chunk uuid %s part %d)', upload['chunkUuid'], n)
-            n += 1
-            size += len(data)
-            checksum.update(data)
+
+        size = upload_checksum.pipeline(
+            lambda: chunk.read(CHUNK_SIZE), (insertChunk, checksum.update),
+            limit=upload['size'] - upload['received'])
         chunk.close()
 
         try:
@@ -180,11 +182,64 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
             }, multi=True)
             raise
 
-        # Persist the internal state of the checksum
-        upload['sha512state'] = hash_state.serializeHex(checksum)
         upload['received'] += size
+        if upload_checksum.saveChecksum(
+                upload, checksum, checkpoint=checkpoint):
+            upload['sha512stateChunk'] = next(chunkNumbers)
         return upload
 
+    def uploadChunkAt(self, upload, chunk, offset):
+        """
+        Stores the chunk of a parallel upload as the fixed-sized pieces that
+        start at its offset. Each chunk must start on a piece boundary, and
+        only the one that ends the file may have a size that is not a multiple
+        of the piece size.
+        """
+        # If we know the chunk size is too large or small, fail early.
+        self.checkUploadRange(upload, offset, self.getChunkSize(chunk))
+        if offset % CHUNK_SIZE:
+            raise ValidationException(
+                'Chunk offset must be a multiple of %d bytes.' % CHUNK_SIZE,
+                'offset')
+
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode('utf8')
+
+        if isinstance(chunk, six.binary_type):
+            chunk = BytesIO(chunk)
+
+        startingN = n = offset // CHUNK_SIZE
+        size = 0
+        while not offset + size > upload['size']:
+            data = chunk.read(CHUNK_SIZE)
+            if not data:
+                break
+            # Replace rather than insert, so that a chunk may be sent again
+            self.chunkColl.replace_one({
+                'uuid': upload['chunkUuid'],
+                'n': n
+            }, {
+                'n': n,
+                'uuid': upload['chunkUuid'],
+                'data': bson.binary.Binary(data)
+            }, upsert=True)
+            n += 1
+            size += len(data)
+        chunk.close()
+
+        try:
+            self.checkUploadRange(upload, offset, size)
+            if size % CHUNK_SIZE and offset + size != upload['size']:
+                raise ValidationException(
+                    'Chunk size must be a multiple of %d bytes.' % CHUNK_SIZE)
+        except ValidationException:
+            self.chunkColl.delete_many({
+                'uuid': upload['chunkUuid'],
+                'n': {'$gte': startingN, '$lt': n}
+            })
+            raise
+        return size
+
     def requestOffset(self, upload):
         """
         The offset will be the CHUNK_SIZE * total number of chunks in the
@@ -202,13 +257,34 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return max(offset, upload['received'])
 
+    def _readChunks(self, upload, start):
+        """
+        Generator that reads the data an upload has stored in the chunks
+        collection, in order.
+
+        :param upload: The upload document.
+        :type upload: dict
+        :param start: The number of the first chunk to read.
+        :type start: int
+        """
+        cursor = self.chunkColl.find({
+            'uuid': upload['chunkUuid'],
+            'n': {'$gte': start}
+        }, projection=['data']).sort('n', pymongo.ASCENDING)
+        for result in cursor:
+            yield result['data']
+
     def finalizeUpload(self, upload, file):
         """
         Grab the final state of the checksum and set it on the file object,
         and write the generated UUID into the file itself.
         """
-        hash = hash_state.restoreHex(upload['sha512state'],
-                                     'sha512').hexdigest()
+        if upload.get('parallel'):
+            hash = upload_checksum.fullChecksum(self._readChunks(upload, 0))
+        else:
+            hash = upload_checksum.finalChecksum(
+                upload, lambda: self._readChunks(
+                    upload, upload['sha512stateChunk']))
 
         file['sha512'] = hash
         file['chunkUuid'] = upload['chunkUuid']
@@ -288,8 +364,83 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
                 # check will be necessary to remove the abandoned file
                 pass
 
+    def deleteFiles(self, files):
+        """
+        Delete the chunks of many files at once, except for those shared with
+        files that are not being deleted.
+        """
+        shared = {doc['chunkUuid'] for doc in self.model('file').find({
+            'chunkUuid': {'$in': [file['chunkUuid'] for file in files]},
+            'assetstoreId': self.assetstore['_id'],
+            '_id': {'$nin': [file['_id'] for file in files]}
+        }, fields=['chunkUuid'])}
+        uuids = list({file['chunkUuid'] for file in files} - shared)
+
+        if uuids:
+            try:
+                self.chunkColl.delete_many({'uuid': {'$in': uuids}})
+            except pymongo.errors.AutoReconnect:
+                # we can't reach the database.  Go ahead and return; a system
+                # check will be necessary to remove the abandoned files
+                pass
+
+    def findInvalidFiles(self, progress=progress.noProgress, filters=None,
+                         checkSize=True, **kwargs):
+        """
+        Goes through every file in this assetstore and finds those whose
+        chunks are missing, or, if checkSize is set, whose number of chunks
+        does not match their size. The chunks of each batch of files are
+        counted with one aggregation. This is a generator function; for each
+        invalid file, a dictionary is yielded that contains the file and a
+        reason, "missing" or "size".
+
+        :param progress: Pass a progress context to record progress.
+        :type progress: :py:class:`girder.utility.progress.ProgressContext`
+        :param filters: Additional query dictionary to restrict the search for
+            files. There is no need to set the ``assetstoreId`` in the filters,
+            since that is done automatically.
+        :type filters: dict or None
+        :param checkSize: Whether to make sure the number of chunks matches
+            the size of the file.
+        :type checkSize: bool
+        """
+        filters = filters or {}
+        q = dict({
+            'assetstoreId': self.assetstore['_id']
+        }, **filters)
+
+        cursor = self.model('file').find(q)
+        progress.update(total=cursor.count(), current=0)
+
+        while True:
+            files = list(itertools.islice(cursor, 1000))
+            if not files:
+                return
+            counts = {result['_id']: result['count']
+                      for result in self.chunkColl.aggregate([
+                          {'$match': {'uuid': {'$in': [
+                              file.get('chunkUuid') for file in files]}}},
+                          {'$group': {'_id': '$uuid', 'count': {'$sum': 1}}}
+                      ])}
+
+            for file in files:
+                progress.update(increment=1, message=file['name'])
+                count = counts.get(file.get('chunkUuid'), 0)
+                chunkSize = file.get('chunkSize', CHUNK_SIZE)
+                if file['size'] and not count:
+                    yield {
+                        'reason': 'missing',
+                        'file': file
+                    }
+                elif checkSize and count != -(-file['size'] // chunkSize):
+                    yield {
+                        'reason': 'size',
+                        'file': file
+                    }
+
     def cancelUpload(self, upload):
         """
         Delete all of the chunks associated with a given upload.
         """
+        upload_checksum.discardChecksum(upload)
         self.chunkColl.delete_many({'uuid': upload['chunkUuid']})
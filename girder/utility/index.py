@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module keeps track of the database indices declared by each model, and
+creates the ones that are missing. Depending on the "index_build" option of the
+"database" config section, missing indices are created when the model is
+instantiated ("sync"), on a background thread once the server has started
+("background"), or not at all ("none"), in which case the girder-index command
+should be used to create them ahead of time.
+"""
+
+import threading
+
+from six.moves import queue
+
+from girder import logger
+from girder.constants import TerminalColor
+from girder.utility import config
+
+
+class IndexBuilderThread(threading.Thread):
+    """
+    This thread creates the indices of models queued by the index registry, so
+    that building them does not delay server startup or the first requests.
+    This should not be invoked directly; it is started and stopped along with
+    the CherryPy engine.
+    """
+    def __init__(self, registry):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.registry = registry
+
+    def run(self):
+        print(TerminalColor.info('Started index builder thread.'))
+
+        while True:
+            model = self.registry.queue.get(block=True)
+            if model is None:
+                break
+            self.registry.buildIndices(model, background=True)
+
+        print(TerminalColor.info('Stopped index builder thread.'))
+
+
+class IndexRegistry(object):
+    """
+    The registry of models whose indices are managed by Girder. Models register
+    themselves each time they connect to the database.
+    """
+    def __init__(self):
+        self.models = {}
+        self.mode = None
+        self.deferred = False
+        self.queue = queue.Queue()
+        self._thread = None
+
+    def buildMode(self):
+        """
+        Return how missing indices are created: "sync", "background", or
+        "none". The mode attribute, if set, overrides the config value.
+        """
+        if self.mode is not None:
+            return self.mode
+        return config.getConfig().get('database', {}).get(
+            'index_build', 'background')
+
+    def register(self, model):
+        """
+        Register a model and create its missing indices according to the
+        build mode. Background builds are only used once deferred is set,
+        which the server does when it is configured; otherwise the indices are
+        created immediately.
+
+        :param model: The model instance to register.
+        :type model: Model
+        """
+        self.models[model.name] = model
+
+        mode = self.buildMode()
+        if mode == 'none':
+            return
+        if mode == 'background' and self.deferred:
+            self.queue.put(model)
+        else:
+            self.buildIndices(model)
+
+    def buildIndices(self, model, background=False):
+        """
+        Create the missing indices of a model, logging rather than raising any
+        failure when building in the background.
+        """
+        if not background:
+            return model.createIndices()
+
+        try:
+            model.createIndices(background=True)
+        except Exception:
+            logger.exception('Could not create indices for "%s".' % model.name)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = IndexBuilderThread(self)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the builder thread once it has finished the builds that are
+        already queued.
+        """
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread = None
+
+    def diff(self, model):
+        """
+        Compare the indices declared by a model with those in the database.
+
+        :returns: A tuple of the (keys, options) of the missing indices, and
+            the names of existing indices that the model does not declare.
+        """
+        return model.missingIndices(), model.undeclaredIndices()
+
+
+registry = IndexRegistry()
+
+
+def _loadModels(plugins):
+    """
+    Instantiate every core model, and every model of the given plugins, so
+    that they are all in the registry. The plugins are imported but not
+    loaded, so the server is not configured.
+    """
+    import importlib
+    import pkgutil
+
+    import girder.models
+    from girder.constants import SettingKey
+    from girder.utility import camelcase, plugin_utilities
+    from girder.utility.model_importer import ModelImporter
+
+    for _, name, _ in pkgutil.iter_modules(girder.models.__path__):
+        if name != 'model_base':
+            ModelImporter.model(name)
+
+    if plugins is None:
+        plugins = ModelImporter.model('setting').get(
+            SettingKey.PLUGINS_ENABLED, default=())
+    plugins = list(plugin_utilities.getToposortedPlugins(
+        plugins, ignoreMissing=True))
+
+    for plugin in plugins:
+        try:
+            if plugin_utilities.importPlugin(plugin) is None:
+                continue
+            package = importlib.import_module(
+                'girder.plugins.%s.models' % plugin)
+        except ImportError:
+            continue
+
+        for _, name, _ in pkgutil.iter_modules(package.__path__):
+            module = importlib.import_module(
+                '%s.%s' % (package.__name__, name))
+            if hasattr(module, camelcase(name)):
+                ModelImporter.model(name, plugin)
+
+
+def main():
+    """
+    This is an entry point exposed in the python sdist package under the name
+    "girder-index".
+    """
+    import argparse
+    import cherrypy
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description='Create or compare the database indices declared by the '
+                    'Girder models.')
+    parser.add_argument('action', choices=('diff', 'create'),
+                        help='"diff" lists missing and undeclared indices; '
+                             '"create" creates the missing ones.')
+    parser.add_argument('-d', '--database',
+                        help='to what database url should Girder connect')
+    parser.add_argument('-p', '--plugins',
+                        help='comma-separated list of plugins whose models '
+                             'should be included (defaults to the enabled '
+                             'plugins)')
+    parser.add_argument('-b', '--background', action='store_true',
+                        help='create the indices without blocking other '
+                             'operations on the collections')
+    args = parser.parse_args()
+
+    if args.database:
+        cherrypy.config['database']['uri'] = args.database
+    plugins = args.plugins.split(',') if args.plugins else None
+
+    registry.mode = 'none'
+    _loadModels(plugins)
+
+    missingCount = 0
+    for name, model in sorted(registry.models.items()):
+        missing, extra = registry.diff(model)
+        missingCount += len(missing)
+
+        for keys, options in missing:
+            print('%s: missing index %s' % (name, keys))
+            if args.action == 'create':
+                model.createIndices([(keys, options)],
+                                    background=args.background)
+        for indexName in extra:
+            print('%s: undeclared index %s' % (name, indexName))
+
+    if args.action == 'diff' and missingCount:
+        sys.exit(1)
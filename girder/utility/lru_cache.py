@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import collections
+import threading
+import time
+
+
+class LruCache(object):
+    """
+    A thread-safe, size-bounded cache that discards the least recently used
+    entry once it is full. Entries may also be given a maximum age, after which
+    they are treated as missing.
+
+    :param maxSize: The maximum number of entries to hold. If this is 0 or
+        less, nothing is ever stored.
+    :type maxSize: int
+    :param ttl: The number of seconds an entry stays valid, or None for no
+        limit.
+    :type ttl: float or None
+    """
+    def __init__(self, maxSize=1000, ttl=None):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for a key, marking it as recently used.
+
+        :param key: The key to look up.
+        :param default: The value to return if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+
+            if self.ttl is not None and entry[0] + self.ttl < time.time():
+                return default
+
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        Store a value for a key, evicting the least recently used entries if
+        the cache is full.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+            if self.maxSize <= 0:
+                return
+
+            while len(self._entries) >= self.maxSize:
+                self._entries.popitem(last=False)
+
+            self._entries[key] = (time.time(), value)
+
+    def pop(self, key, default=None):
+        """
+        Remove a key from the cache, returning its value if it was present.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def removeIf(self, predicate):
+        """
+        Remove every entry for which ``predicate(key, value)`` is true.
+        """
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if predicate(key, entry[1]):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_missing = object()
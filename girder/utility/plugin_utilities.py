@@ -80,10 +80,7 @@ def loadPlugins(plugins, root, appconf, apiRoot=None, curConfig=None,
             'the `girder-install plugin` command and remove this setting from '
             'your config file.'))
 
-    if ROOT_PLUGINS_PACKAGE not in sys.modules:
-        module = imp.new_module(ROOT_PLUGINS_PACKAGE)
-        girder.plugins = module
-        sys.modules[ROOT_PLUGINS_PACKAGE] = module
+    _addRootPluginsPackage()
 
     print(TerminalColor.info('Resolving plugin dependencies...'))
 
@@ -104,6 +101,48 @@ def loadPlugins(plugins, root, appconf, apiRoot=None, curConfig=None,
     return root, appconf, apiRoot
 
 
+def _addRootPluginsPackage():
+    if ROOT_PLUGINS_PACKAGE not in sys.modules:
+        module = imp.new_module(ROOT_PLUGINS_PACKAGE)
+        girder.plugins = module
+        sys.modules[ROOT_PLUGINS_PACKAGE] = module
+
+
+def importPlugin(name, curConfig=None):
+    """
+    Import the server package of a plugin as a pseudo-package, so that its
+    modules, such as its models, can be imported, without loading the plugin
+    into the application. This is for tools that use the models of plugins
+    outside of a running server. A plugin imported this way is not loaded by
+    a later call to loadPlugin in the same process.
+
+    :param name: The name of the plugin (i.e. its directory name)
+    :type name: str
+    :returns: The plugin's server package, or None if the plugin has none.
+    """
+    _addRootPluginsPackage()
+    moduleName = '.'.join((ROOT_PLUGINS_PACKAGE, name))
+    if moduleName in sys.modules:
+        return sys.modules[moduleName]
+
+    try:
+        pluginDir = os.path.join(getPluginParentDir(name, curConfig), name)
+    except Exception:
+        return None
+    if not os.path.isdir(os.path.join(pluginDir, 'server')):
+        return None
+
+    fp, pathname, description = imp.find_module('server', [pluginDir])
+    try:
+        module = imp.load_module(moduleName, fp, pathname, description)
+    finally:
+        if fp:
+            fp.close()
+    module.PLUGIN_ROOT_DIR = pluginDir
+    girder.plugins.__dict__[name] = module
+    return module
+
+
 def getToposortedPlugins(plugins, curConfig=None, ignoreMissing=False):
     """
     Given a set of plugins to load, construct the full DAG of required plugins
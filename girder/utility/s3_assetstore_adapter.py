@@ -105,6 +105,8 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
 
     CHUNK_LEN = 1024 * 1024 * 32  # Chunk size for uploading
     HMAC_TTL = 120  # Number of seconds each signed message is valid
+    # Parallel uploads send their data through Girder as multipart parts
+    supportsParallelUpload = True
 
     @staticmethod
     def validateInfo(doc):
@@ -220,6 +222,14 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
             chunkedUpload=chunked)
         upload['s3']['request']['url'] = url
         upload['s3']['request']['headers'] = headers
+
+        if chunked and upload.get('parallel'):
+            # The chunks of parallel uploads may arrive concurrently, so the
+            # multipart upload they are added to must already exist.
+            mp = self._getBucket().initiate_multipart_upload(
+                key, headers=headers)
+            upload['s3']['uploadId'] = mp.id
+            upload['s3']['keyName'] = mp.key_name
         return upload
 
     def uploadChunk(self, upload, chunk):
@@ -328,6 +338,46 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return upload
 
+    def uploadChunkAt(self, upload, chunk, offset):
+        """
+        Sends the chunk of a parallel upload to S3 as the part of the multipart
+        upload that starts at its offset. Each chunk must be exactly one part,
+        whose boundaries are multiples of CHUNK_LEN. Clients that upload
+        directly to S3 can already send the parts in any order and don't need
+        a parallel upload.
+        """
+        if isinstance(chunk, six.string_types):
+            raise ValidationException(
+                'Chunks of parallel uploads must contain the data to send.',
+                'chunk')
+
+        self.checkUploadRange(upload, offset, self.getChunkSize(chunk))
+        length = min(self.CHUNK_LEN, upload['size'] - offset)
+        if offset % self.CHUNK_LEN:
+            raise ValidationException(
+                'Chunk offset must be a multiple of %d bytes.' %
+                self.CHUNK_LEN, 'offset')
+
+        bucket = self._getBucket()
+        if upload['s3']['chunked']:
+            mp = boto.s3.multipart.MultiPartUpload(bucket)
+            mp.id = upload['s3']['uploadId']
+            mp.key_name = upload['s3']['keyName']
+            key = mp.upload_part_from_file(
+                chunk, offset // self.CHUNK_LEN + 1,
+                headers=self._getRequestHeaders(upload))
+        else:
+            key = bucket.new_key(upload['s3']['key'])
+            key.set_contents_from_file(chunk,
+                                       headers=self._getRequestHeaders(upload))
+
+        if key.size != length:
+            if not upload['s3']['chunked']:
+                bucket.delete_key(key)
+            raise ValidationException('Expected chunk size %d, but got %d.' % (
+                length, key.size))
+        return key.size
+
     def requestOffset(self, upload):
         if upload['received'] > 0:
             # This is only set when we are proxying the data to S3
@@ -482,6 +532,30 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
                     'key': file['s3Key']
                 })
 
+    def deleteFiles(self, files):
+        """
+        Queue the deletion of many files at once, using a single query to find
+        which of them share their key with files that are not being deleted.
+        """
+        files = [file for file in files
+                 if file['size'] > 0 and 'relpath' in file]
+        if not files:
+            return
+
+        shared = {doc['relpath'] for doc in self.model('file').find({
+            'relpath': {'$in': [file['relpath'] for file in files]},
+            'assetstoreId': self.assetstore['_id'],
+            '_id': {'$nin': [file['_id'] for file in files]}
+        }, fields=['relpath'])}
+
+        for key in {file['s3Key'] for file in files
+                    if file['relpath'] not in shared}:
+            events.daemon.trigger('_s3_assetstore_delete_file', {
+                'botoConnect': self.assetstore.get('botoConnect', {}),
+                'bucket': self.assetstore['bucket'],
+                'key': key
+            })
+
     def fileUpdated(self, file):
         """
         On file update, if the name or the MIME type changed, we must update
@@ -24,7 +24,7 @@ import os
 import girder.events
 from girder import constants
 from girder.utility import plugin_utilities, model_importer
-from girder.utility import config
+from girder.utility import config, index, size_aggregator
 from . import webroot
 
 
@@ -96,6 +96,15 @@ def configureServer(test=False, plugins=None, curConfig=None):
     print(constants.TerminalColor.info('Running in mode: ' + mode))
     cherrypy.config['engine.autoreload.on'] = mode == 'development'
 
+    if not test:
+        # Models instantiated from here on build their missing indices on a
+        # background thread once the server has started.
+        index.registry.deferred = True
+        cherrypy.engine.subscribe('start', index.registry.start)
+        cherrypy.engine.subscribe('stop', index.registry.stop)
+        cherrypy.engine.subscribe('start', size_aggregator.aggregator.start)
+        cherrypy.engine.subscribe('stop', size_aggregator.aggregator.stop)
+
     # Don't import this until after the configs have been read; some module
     # initialization code requires the configuration to be set up.
     from girder.api import api_main
@@ -106,6 +115,15 @@ def configureServer(test=False, plugins=None, curConfig=None):
     cherrypy.engine.subscribe('start', girder.events.daemon.start)
     cherrypy.engine.subscribe('stop', girder.events.daemon.stop)
 
+    if not test:
+        # Finish any deletions and folder moves that were interrupted by a
+        # previous shutdown
+        cherrypy.engine.subscribe(
+            'start', model_importer.ModelImporter().model('folder').resumeMoves)
+        deletionModel = model_importer.ModelImporter().model('deletion')
+        cherrypy.engine.subscribe('start', deletionModel.resume)
+        cherrypy.engine.subscribe('stop', deletionModel.stopResume)
+
     if plugins is None:
         settings = model_importer.ModelImporter().model('setting')
         plugins = settings.get(constants.SettingKey.PLUGINS_ENABLED,
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+This module merges the size changes that are propagated up the data hierarchy
+when files are added, removed or resized, so that many uploads into the same
+folder, collection or user result in one update of each document rather than
+one per upload. It is controlled by the "size_flush_interval" option of the
+"database" config section: if it is 0, every change is written immediately;
+otherwise, changes are accumulated and written every that many milliseconds
+while the server is running, and once more when it stops.
+"""
+
+import six
+import threading
+
+from pymongo import UpdateOne
+
+from girder import logger
+from girder.constants import TerminalColor
+from girder.utility import config
+
+
+class SizeFlushThread(threading.Thread):
+    """
+    This thread periodically writes the size changes accumulated by the
+    aggregator. This should not be invoked directly; it is started and stopped
+    along with the CherryPy engine.
+    """
+    def __init__(self, aggregator, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.aggregator = aggregator
+        self.interval = interval
+        self.stopEvent = threading.Event()
+
+    def run(self):
+        print(TerminalColor.info('Started size aggregator thread.'))
+
+        while not self.stopEvent.wait(self.interval):
+            self.aggregator.flush()
+
+        print(TerminalColor.info('Stopped size aggregator thread.'))
+
+    def stop(self):
+        self.stopEvent.set()
+
+
+class SizeAggregator(object):
+    """
+    Accumulates $inc updates per model, document, and field until they are
+    flushed with one bulk write per model. Updates are only deferred while the
+    flush thread is running; otherwise they are applied immediately.
+    """
+    def __init__(self):
+        self.interval = None
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def flushInterval(self):
+        """
+        Return the number of milliseconds between flushes, or 0 if changes
+        should not be deferred. The interval attribute, if set, overrides the
+        config value.
+        """
+        if self.interval is not None:
+            return self.interval
+        return config.getConfig().get('database', {}).get(
+            'size_flush_interval', 0)
+
+    @property
+    def deferred(self):
+        return self._thread is not None
+
+    def increment(self, model, ids, inc, requireField=None, sync=False):
+        """
+        Increment fields of one or more documents.
+
+        :param model: The model of the documents.
+        :type model: Model
+        :param ids: The _id of the documents to update.
+        :type ids: list
+        :param inc: A dict of field names to the amount to increment them by.
+        :type inc: dict
+        :param requireField: If set, only documents that already have this
+            field are updated.
+        :type requireField: str or None
+        :param sync: Whether to apply the update immediately, even when
+            updates are being deferred.
+        :type sync: bool
+        """
+        if not ids or not inc:
+            return
+
+        if sync or not self.deferred:
+            query = {'_id': {'$in': list(ids)}}
+            if requireField:
+                query[requireField] = {'$exists': True}
+            model.update(query, {'$inc': inc})
+            return
+
+        with self._lock:
+            docs = self.pending.setdefault((model, requireField), {})
+            for id in ids:
+                fields = docs.setdefault(id, {})
+                for field, amount in six.viewitems(inc):
+                    fields[field] = fields.get(field, 0) + amount
+
+    def flush(self):
+        """
+        Write all of the accumulated updates. Updates that fail are logged and
+        dropped; the system consistency check will correct the sizes.
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+
+        for (model, requireField), docs in six.viewitems(pending):
+            requests = []
+            for id, fields in six.viewitems(docs):
+                fields = {k: v for k, v in six.viewitems(fields) if v}
+                if fields:
+                    query = {'_id': id}
+                    if requireField:
+                        query[requireField] = {'$exists': True}
+                    requests.append(UpdateOne(query, {'$inc': fields}))
+            if not requests:
+                continue
+
+            try:
+                model.collection.bulk_write(requests, ordered=False)
+            except Exception:
+                logger.exception('Could not update the sizes of %d %s '
+                                 'documents.' % (len(requests), model.name))
+            model._invalidateIdentityMap()
+
+    def start(self):
+        interval = self.flushInterval()
+        if interval and self._thread is None:
+            self._thread = SizeFlushThread(self, interval / 1000.0)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop deferring updates, and write any that are still pending.
+        """
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        self.flush()
+
+
+aggregator = SizeAggregator()
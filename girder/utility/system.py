@@ -18,6 +18,7 @@
 ###############################################################################
 
 import cherrypy
+import collections
 import os
 import psutil
 import six
@@ -25,9 +26,13 @@ import socket
 import threading
 import time
 
+from multiprocessing.pool import ThreadPool
+
 import girder
 from girder import logger
 from girder.models import getDbConnection
+from girder.utility.model_importer import ModelImporter
+from girder.utility.progress import noProgress
 
 
 def _objectToDict(obj):
@@ -183,6 +188,100 @@ def formatSize(sizeBytes):
     return '%.*f %s' % (precision, sizeVal, suffixes[idx])
 
 
+# The stages of the system consistency check. Each entry is a list of (model,
+# stage) checks that do not depend on each other, and so are run in parallel;
+# each entry depends on the ones before it.
+CONSISTENCY_PHASES = (
+    (('folder', 'remove'),),
+    (('item', 'remove'),),
+    (('file', 'remove'), ('upload', 'remove')),
+    (('folder', 'verify'), ('item', 'verify'), ('file', 'verify')),
+    (('folder', 'propagate'), ('item', 'propagate')),
+    (('collection', 'propagate'), ('user', 'propagate'))
+)
+
+# The models whose verify stage reports progress for each of their documents
+CONSISTENCY_COUNTED_MODELS = ('folder', 'item', 'file')
+
+
+class _LockedProgress(object):
+    """
+    Wraps a progress context so that the checks running in parallel can
+    update it safely.
+    """
+    def __init__(self, progress):
+        self.progress = progress
+        self.lock = threading.Lock()
+
+    def update(self, **kwargs):
+        with self.lock:
+            self.progress.update(**kwargs)
+
+
+def checkConsistency(progress=noProgress, report=False):
+    """
+    Check the data hierarchy for documents that refer to others that do not
+    exist, incorrect base parents and ancestors, incorrect sizes, and files
+    whose data is missing, and correct what can be corrected. This runs the
+    checkConsistency method of each model in the order given by
+    CONSISTENCY_PHASES.
+
+    :param progress: A progress context to record progress on.
+    :type progress: girder.utility.progress.ProgressContext
+    :param report: If True, only find the problems; do not correct anything.
+    :type report: bool
+    :returns: A dictionary of results. For each model, <model>Removed is the
+        number of documents that were (or would be) removed,
+        <model>Corrected the number that were (or would be) corrected, and
+        <model>Count the number that were checked. fileInvalid is the number of
+        files whose data is missing or has the wrong size.
+    """
+    models = ModelImporter()
+    total = sum(models.model(model).checkConsistency(stage='count')[0]
+                for model in CONSISTENCY_COUNTED_MODELS)
+    progress.update(total=total, current=0, message='Checking system...')
+    lockedProgress = _LockedProgress(progress)
+
+    # The checks run on other threads, which need the request and response
+    # of this one so that they extend its time limit and record their
+    # database activity on it.
+    request, response = cherrypy.serving.request, cherrypy.serving.response
+
+    def runCheck(check):
+        model, stage = check
+        cherrypy.serving.load(request, response)
+        try:
+            return models.model(model).checkConsistency(
+                stage=stage, progress=lockedProgress, report=report)
+        finally:
+            cherrypy.serving.clear()
+
+    results = {}
+    corrected = collections.defaultdict(set)
+    pool = ThreadPool(max(len(phase) for phase in CONSISTENCY_PHASES))
+    try:
+        for phase in CONSISTENCY_PHASES:
+            for (model, stage), (count, changed) in zip(
+                    phase, pool.map(runCheck, phase)):
+                if stage == 'remove':
+                    if changed:
+                        results[model + 'Removed'] = len(changed)
+                elif model == 'file':
+                    if changed:
+                        results['fileInvalid'] = len(changed)
+                else:
+                    if stage == 'verify' and count:
+                        results[model + 'Count'] = count
+                    corrected[model].update(changed)
+    finally:
+        pool.close()
+
+    for model, changed in six.viewitems(corrected):
+        if changed:
+            results[model + 'Corrected'] = len(changed)
+    return results
+
+
 # This class is used to monitor which threads in cherrypy are actively serving
 # responses, and what each was last used for.  It is based on the example at
 # http://tools.cherrypy.org/wiki/StatusTool, but has changes to handle yield-
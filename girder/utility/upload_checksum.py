@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2016 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+# Streaming SHA-512 checksums of uploads in progress. The live hash object of
+# each upload is kept in this process between chunks, so that it doesn't have
+# to be restored from and serialized back into the upload document for every
+# chunk. The serialized state is only saved every so often, and is used when
+# a chunk arrives at a process that doesn't hold the live hash object.
+
+import six
+import sys
+import threading
+
+from hashlib import sha512
+from six.moves import queue
+from . import hash_state
+from .lru_cache import LruCache
+
+#: Number of bytes that may be received between two saves of the serialized
+#: checksum state into the upload document.
+CHECKPOINT_SIZE = 64 * 1024 ** 2
+
+#: Number of buffers that may be waiting for each stage of a pipeline.
+PIPELINE_DEPTH = 4
+
+# Maps the id of an upload to a tuple of the number of bytes hashed and the
+# live SHA-512 object.
+_checksums = LruCache(maxSize=1000)
+
+
+def initChecksum(upload):
+    """
+    Set the initial checksum state of a new upload.
+
+    :param upload: The upload document, which need not be saved yet.
+    :type upload: dict
+    """
+    upload['sha512state'] = hash_state.serializeHex(sha512())
+    upload['sha512stateReceived'] = 0
+
+
+def restoreChecksum(upload, catchUp):
+    """
+    Get the checksum of the bytes received so far by an upload. The live hash
+    object is handed over to the caller, who should pass it back to
+    :py:func:`saveChecksum` once the next chunk has been hashed.
+
+    :param upload: The upload document.
+    :type upload: dict
+    :param catchUp: A function that returns an iterable of the data received
+        since the serialized state was last saved. It is only called if this
+        process doesn't hold the current hash object.
+    :returns: A SHA-512 hash object.
+    """
+    entry = _checksums.pop(upload['_id'])
+    if entry is not None and entry[0] == upload['received']:
+        return entry[1]
+
+    checksum = hash_state.restoreHex(upload['sha512state'], 'sha512')
+    # Uploads that were started when the state was saved with every chunk
+    # don't record where it was saved, since it always matches what has been
+    # received.
+    if upload.get('sha512stateReceived', upload['received']) < \
+            upload['received']:
+        for data in catchUp():
+            checksum.update(data)
+    return checksum
+
+
+def saveChecksum(upload, checksum, checkpoint=False):
+    """
+    Keep the live hash object of an upload after a chunk has been hashed and
+    ``upload['received']`` has been updated. The serialized state is saved to
+    the upload document when enough has been received since the last save.
+
+    :param upload: The upload document.
+    :type upload: dict
+    :param checksum: The SHA-512 object of everything received so far.
+    :param checkpoint: Whether to save the serialized state regardless of how
+        much has been received.
+    :type checkpoint: bool
+    :returns: Whether the serialized state was saved.
+    """
+    _checksums.set(upload['_id'], (upload['received'], checksum))
+
+    # Uploads without a record of where the state was saved need one before
+    # the state can be allowed to fall behind.
+    if (checkpoint or 'sha512stateReceived' not in upload or
+            upload['received'] - upload['sha512stateReceived'] >=
+            CHECKPOINT_SIZE):
+        upload['sha512state'] = hash_state.serializeHex(checksum)
+        upload['sha512stateReceived'] = upload['received']
+        return True
+    return False
+
+
+def finalChecksum(upload, catchUp):
+    """
+    Get the hex digest of a completely received upload, and drop its live
+    hash object.
+
+    :param upload: The upload document.
+    :type upload: dict
+    :param catchUp: See :py:func:`restoreChecksum`.
+    :returns: The SHA-512 hex digest.
+    """
+    return restoreChecksum(upload, catchUp).hexdigest()
+
+
+def fullChecksum(data):
+    """
+    Get the hex digest of an upload whose chunks may have been received in
+    any order, by hashing all of its data in one pass.
+
+    :param data: An iterable of the data of the whole file, in order.
+    :returns: The SHA-512 hex digest.
+    """
+    checksum = sha512()
+    for buf in data:
+        checksum.update(buf)
+    return checksum.hexdigest()
+
+
+def discardChecksum(upload):
+    """
+    Drop the live hash object of an upload that has been canceled.
+    """
+    if '_id' in upload:
+        _checksums.pop(upload['_id'])
+
+
+def _consume(buffers, consumer, errors):
+    for data in iter(buffers.get, None):
+        if not errors:
+            try:
+                consumer(data)
+            except Exception:
+                errors.append(sys.exc_info())
+
+
+def pipeline(read, consumers, limit=None):
+    """
+    Read buffers and pass each one to every consumer in order. Each consumer
+    runs on its own thread, so reading, hashing and writing overlap. Chunks
+    that are read in a single buffer skip the threads.
+
+    :param read: A function returning the next buffer, or an empty one once
+        there is nothing more to read.
+    :param consumers: A list of functions that are called with each buffer.
+    :param limit: Stop reading once more than this many bytes have been read.
+    :type limit: int or None
+    :returns: The total number of bytes read.
+    """
+    data = read()
+    if not data:
+        return 0
+    nextData = read() if limit is None or len(data) <= limit else None
+    if not nextData:
+        for consumer in consumers:
+            consumer(data)
+        return len(data)
+
+    errors = []
+    stages = []
+    for consumer in consumers:
+        buffers = queue.Queue(PIPELINE_DEPTH)
+        thread = threading.Thread(
+            target=_consume, args=(buffers, consumer, errors))
+        thread.daemon = True
+        thread.start()
+        stages.append((buffers, thread))
+
+    size = 0
+    try:
+        while data and not errors:
+            size += len(data)
+            for buffers, _ in stages:
+                buffers.put(data)
+            if limit is not None and size > limit:
+                break
+            data, nextData = nextData, (nextData and read())
+    finally:
+        for buffers, thread in stages:
+            buffers.put(None)
+        for buffers, thread in stages:
+            thread.join()
+
+    if errors:
+        six.reraise(*errors[0])
+    return size
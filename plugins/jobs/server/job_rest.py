@@ -42,7 +42,8 @@ class Job(Resource):
                'not passed or empty, will use the currently logged in user. If '
                'set to "None", will list all jobs that do not have an owning '
                'user.', required=False)
-        .pagingParams(defaultSort='created', defaultSortDir=SortDir.DESCENDING)
+        .pagingParams(defaultSort='created', defaultSortDir=SortDir.DESCENDING,
+                      keyset=True)
     )
     def listJobs(self, params):
         limit, offset, sort = self.getPagingParameters(
@@ -57,9 +58,12 @@ class Job(Resource):
             user = self.model('user').load(
                 params['userId'], user=currentUser, level=AccessType.READ)
 
-        return list(self.model('job', 'jobs').list(
+        sort, afterQuery = self.getKeysetParameters(params, sort)
+        jobs = list(self.model('job', 'jobs').list(
             user=user, offset=offset, limit=limit, sort=sort,
-            currentUser=currentUser))
+            currentUser=currentUser, filters=afterQuery))
+        self.setKeysetHeader(jobs, sort, limit)
+        return jobs
 
     @access.public
     @loadmodel(model='job', plugin='jobs', level=AccessType.READ)
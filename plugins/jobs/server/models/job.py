@@ -32,7 +32,8 @@ class Job(AccessControlledModel):
         self.name = 'job'
         compoundSearchIndex = (
             ('userId', SortDir.ASCENDING),
-            ('created', SortDir.DESCENDING)
+            ('created', SortDir.DESCENDING),
+            ('_id', SortDir.DESCENDING)
         )
         self.ensureIndices([(compoundSearchIndex, {})])
 
@@ -51,7 +52,8 @@ class Job(AccessControlledModel):
 
         return job
 
-    def list(self, user=None, limit=0, offset=0, sort=None, currentUser=None):
+    def list(self, user=None, limit=0, offset=0, sort=None, currentUser=None,
+             filters=None):
         """
         List a page of jobs for a given user.
 
@@ -61,13 +63,16 @@ class Job(AccessControlledModel):
         :param offset: The page offset
         :param sort: The sort field.
         :param currentUser: User for access filtering.
+        :param filters: Additional query operators to apply.
+        :type filters: dict
         """
-        userId = user['_id'] if user else None
-        cursor = self.find({'userId': userId}, sort=sort)
+        query = dict(filters or {})
+        query['userId'] = user['_id'] if user else None
+        cursor = self.findWithPermissions(
+            query, sort=sort, user=currentUser,
+            level=AccessType.READ, limit=limit, offset=offset)
 
-        for r in self.filterResultsByPermission(cursor=cursor, user=currentUser,
-                                                level=AccessType.READ,
-                                                limit=limit, offset=offset):
+        for r in cursor:
             yield r
 
     def cancelJob(self, job):
@@ -18,7 +18,9 @@
 ###############################################################################
 
 import json
+import six
 
+from bson.objectid import ObjectId
 from tests import base
 from girder import events
 from girder.constants import AccessType
@@ -368,6 +370,43 @@ class ProvenanceTestCase(base.TestCase):
                                    resource='folder', checkOk=False)
         self.assertStatus(resp, 400)
 
+    def testProvenanceFolderCopy(self):
+        """
+        Test that copying a folder records the provenance of the folders,
+        items, and files that are copied along with it.
+        """
+        admin = self.admin
+        sub = self.model('folder').createFolder(
+            self.folder1, 'Sub', creator=admin)
+        item = self.model('item').createItem('Sub object', admin, sub)
+        file = self.model('upload').uploadFromFile(
+            six.BytesIO(b'data'), 4, 'data.txt', 'item', item, admin)
+        self._checkProvenance(None, item, 2, admin, 'fileAdded')
+
+        resp = self.request(
+            path='/folder/%s/copy' % self.folder1['_id'], method='POST',
+            user=admin, params={'name': 'Copied folder'})
+        self.assertStatusOk(resp)
+        newFolder = resp.json
+        self._checkProvenance(None, newFolder, 2, admin, 'copy',
+                              {'originalId': str(self.folder1['_id'])},
+                              resource='folder')
+
+        newSub = self.model('folder').findOne(
+            {'parentId': ObjectId(newFolder['_id'])})
+        self._checkProvenance(None, newSub, 2, admin, 'copy',
+                              {'originalId': str(sub['_id'])},
+                              resource='folder')
+        newItem = self.model('item').findOne({'folderId': newSub['_id']})
+        resp = self._getProvenance(newItem, admin, 3)
+        self._checkProvenance(resp, newItem, 3, admin, 'copy',
+                              {'originalId': str(item['_id'])})
+        newFile = self.model('file').findOne({'itemId': newItem['_id']})
+        self._checkProvenance(None, newItem, 4, admin, 'fileAdded',
+                              fileInfo={'fileId': str(newFile['_id']),
+                                        'new': {'size': file['size'],
+                                                'name': file['name']}})
+
     def testProvenanceSetting(self):
         # After trying to set this set, only some of them should have events
         self.model('setting').set(
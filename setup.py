@@ -139,7 +139,8 @@ setup(
     entry_points={
         'console_scripts': [
             'girder-server = girder.__main__:main',
-            'girder-install = girder.utility.install:main'
+            'girder-install = girder.utility.install:main',
+            'girder-index = girder.utility.index:main'
         ]
     }
 )
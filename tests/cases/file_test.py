@@ -30,6 +30,9 @@ from .. import base, mock_s3
 from girder.constants import SettingKey
 from girder.models import getDbConnection
 from girder.models.model_base import AccessException
+from girder.utility import config, upload_checksum
+from girder.utility.filesystem_assetstore_adapter import \
+    FilesystemAssetstoreAdapter
 from girder.utility.s3_assetstore_adapter import (makeBotoConnectParams,
                                                   S3AssetstoreAdapter)
 from six.moves import urllib
@@ -522,6 +525,72 @@ class FileTestCase(base.TestCase):
         self._testDownloadFolder()
         self._testDownloadCollection()
 
+        # Downloads ask the kernel to read ahead where it is supported
+        if hasattr(os, 'posix_fadvise'):
+            with mock.patch('os.posix_fadvise') as fadvise:
+                resp = self.request(
+                    path='/file/%s/download' % file['_id'], user=self.user,
+                    isJson=False, additionalHeaders=[('Range', 'bytes=2-7')])
+                self.assertEqual(self.getBody(resp), (chunk1 + chunk2)[2:8])
+            fadvise.assert_called_once_with(
+                mock.ANY, 2, 6, os.POSIX_FADV_SEQUENTIAL)
+
+        # Downloads can be left to a front-end proxy
+        serverConfig = config.getConfig()['server']
+        serverConfig['download_offload'] = 'x-accel-redirect'
+        try:
+            resp = self.request(
+                path='/file/%s/download' % file['_id'], user=self.user,
+                isJson=False)
+            self.assertStatusOk(resp)
+            self.assertEqual(self.getBody(resp), '')
+            self.assertEqual(
+                resp.headers['X-Accel-Redirect'], '/girder-files/%s/%s' % (
+                    file['assetstoreId'], file['path']))
+            self.assertEqual(resp.headers['Content-Disposition'],
+                             'attachment; filename="%s"' % file['name'])
+
+            # The proxy serves requested ranges itself
+            resp = self.request(
+                path='/file/%s/download' % file['_id'], user=self.user,
+                isJson=False, additionalHeaders=[('Range', 'bytes=2-7')])
+            self.assertStatusOk(resp)
+            self.assertIn('X-Accel-Redirect', resp.headers)
+
+            # Offsets given as parameters are still sent by Girder
+            resp = self.request(
+                path='/file/%s/download' % file['_id'], user=self.user,
+                isJson=False, params={'offset': 2})
+            self.assertEqual(self.getBody(resp), (chunk1 + chunk2)[2:])
+            self.assertNotIn('X-Accel-Redirect', resp.headers)
+
+            serverConfig['download_offload'] = 'x-sendfile'
+            resp = self.request(
+                path='/file/%s/download' % file['_id'], user=self.user,
+                isJson=False)
+            self.assertStatusOk(resp)
+            self.assertEqual(resp.headers['X-Sendfile'],
+                             os.path.realpath(abspath))
+
+            # Files outside of the assetstore root are sent by Girder
+            outside = os.path.join(
+                os.path.dirname(os.path.realpath(root)), 'outside.txt')
+            shutil.copy(abspath, outside)
+            try:
+                with mock.patch.object(
+                        FilesystemAssetstoreAdapter, 'fullPath',
+                        return_value=outside):
+                    resp = self.request(
+                        path='/file/%s/download' % file['_id'],
+                        user=self.user, isJson=False)
+                self.assertStatusOk(resp)
+                self.assertNotIn('X-Sendfile', resp.headers)
+                self.assertEqual(self.getBody(resp), chunk1 + chunk2)
+            finally:
+                os.remove(outside)
+        finally:
+            serverConfig['download_offload'] = 'none'
+
         # Test updating of the file contents
         newContents = 'test'
         resp = self.request(
@@ -620,6 +689,40 @@ class FileTestCase(base.TestCase):
         copyTestFile = self._testUploadFile('helloWorld1.txt')
         self._testCopyFile(copyTestFile)
 
+    def testUploadChecksumFallback(self):
+        """
+        Test that uploads get the right checksum when their chunks are handled
+        by processes that don't hold the live hash object.
+        """
+        self.model('setting').set(SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE, 0)
+        uploadModel = self.model('upload')
+
+        def uploadFile(checkpointSize=upload_checksum.CHECKPOINT_SIZE):
+            upload = uploadModel.createUpload(
+                self.user, 'fallback.txt', 'folder', self.privateFolder,
+                len(chunkData))
+            with mock.patch.object(
+                    upload_checksum, 'CHECKPOINT_SIZE', checkpointSize):
+                upload = uploadModel.handleChunk(upload, chunk1.encode('utf8'))
+
+            # Forget the live hash object, as another process would not have it
+            upload_checksum._checksums.clear()
+            file = uploadModel.handleChunk(upload, chunk2.encode('utf8'))
+            self.assertEqual(file['sha512'], sha512(chunkData).hexdigest())
+            return upload
+
+        self.assertEqual(uploadFile()['sha512stateReceived'], 0)
+        self.assertEqual(uploadFile(0)['sha512stateReceived'], len(chunk1))
+
+        conn = getDbConnection()
+        conn.drop_database('girder_test_file_checksum')
+        assetstore = self.model('assetstore').createGridFsAssetstore(
+            name='Test', db='girder_test_file_checksum')
+        assetstore['current'] = True
+        self.model('assetstore').save(assetstore)
+        self.assertEqual(uploadFile()['sha512stateChunk'], 0)
+        self.assertEqual(uploadFile(0)['sha512stateChunk'], 1)
+
     @moto.mock_s3bucket_path
     def testS3Assetstore(self):
         botoParams = makeBotoConnectParams('access', 'secret')
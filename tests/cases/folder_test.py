@@ -19,8 +19,12 @@
 
 import datetime
 import json
+import mock
+import os
 import six
 
+from bson.objectid import ObjectId
+
 from .. import base
 
 from girder import events
@@ -620,3 +624,413 @@ class FolderTestCase(base.TestCase):
                 'parentType': 'folder',
                 'parentId': str(subFolder['_id'])})
         self.assertStatusOk(resp)
+
+    def testAncestors(self):
+        folderModel = self.model('folder')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin,
+            name='Top')
+        middle = folderModel.createFolder(
+            parent=top, creator=self.admin, name='Middle')
+        bottom = folderModel.createFolder(
+            parent=middle, creator=self.admin, name='Bottom')
+        item = self.model('item').createItem('Item', self.admin, bottom)
+
+        def ids(doc):
+            return [(a['type'], a['_id']) for a in doc['ancestors']]
+
+        self.assertEqual(ids(top), [('user', self.admin['_id'])])
+        self.assertEqual(ids(bottom), [
+            ('user', self.admin['_id']), ('folder', top['_id']),
+            ('folder', middle['_id'])])
+        self.assertEqual(ids(item), ids(bottom) + [('folder', bottom['_id'])])
+        self.assertEqual(
+            [p['object']['_id'] for p in self.model('item').parentsToRoot(
+                item, user=self.admin)],
+            [self.admin['_id'], top['_id'], middle['_id'], bottom['_id']])
+        self.assertTrue(folderModel._isAncestor(top, bottom))
+        self.assertFalse(folderModel._isAncestor(bottom, top))
+        self.assertEqual(folderModel.subtreeCount(top), 4)
+
+        # Moving a folder updates the ancestors of everything underneath it
+        other = folderModel.createFolder(
+            parent=self.user, parentType='user', creator=self.user,
+            name='Other')
+        folderModel.move(middle, other, 'folder')
+        bottom = folderModel.load(bottom['_id'], force=True)
+        item = self.model('item').load(item['_id'], force=True)
+        self.assertEqual(ids(bottom), [
+            ('user', self.user['_id']), ('folder', other['_id']),
+            ('folder', middle['_id'])])
+        self.assertEqual(ids(item), ids(bottom) + [('folder', bottom['_id'])])
+        self.assertEqual(item['baseParentId'], self.user['_id'])
+        self.assertEqual(folderModel.subtreeCount(top), 1)
+
+        # Progress is recorded for each folder whose children are updated,
+        # whether or not the subtree has to be walked
+        for complete in (True, False):
+            progress = mock.Mock()
+            with mock.patch.object(folderModel, 'hasCompleteAncestors',
+                                   return_value=complete):
+                folderModel._updateDescendants(
+                    other['_id'], {'$set': {'touched': True}},
+                    progress=progress)
+            self.assertEqual(sum(
+                call[1]['increment'] for call in progress.update.call_args_list
+            ), 3)
+
+        # Documents without ancestors are backfilled by the system check
+        folderModel.update({}, {'$unset': {'ancestors': True}})
+        self.model('item').update({}, {'$unset': {'ancestors': True}})
+        folderModel._ancestorsComplete = False
+        self.assertFalse(folderModel.hasCompleteAncestors())
+
+        resp = self.request(path='/system/check', method='PUT',
+                            user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertGreaterEqual(resp.json['folderCorrected'], 4)
+        self.assertTrue(folderModel.hasCompleteAncestors())
+        self.assertEqual(
+            ids(folderModel.load(bottom['_id'], force=True)), ids(bottom))
+        self.assertEqual(
+            ids(self.model('item').load(item['_id'], force=True)), ids(item))
+
+        # Folders and items saved without createFolder or createItem are
+        # still given ancestors, so subtree queries keep finding them
+        extra = {key: value for key, value in six.viewitems(bottom)
+                 if key not in ('_id', 'ancestors')}
+        extra.update(name='Extra', parentId=bottom['_id'])
+        extra = folderModel.save(extra)
+        self.assertEqual(ids(extra), ids(bottom) + [('folder', bottom['_id'])])
+        extraItem = {key: value for key, value in six.viewitems(item)
+                     if key not in ('_id', 'ancestors')}
+        extraItem.update(name='Extra', folderId=extra['_id'])
+        extraItem = self.model('item').save(extraItem, validate=False)
+        self.assertEqual(
+            ids(extraItem), ids(extra) + [('folder', extra['_id'])])
+        self.assertTrue(folderModel.hasCompleteAncestors())
+        self.assertEqual(self.model('item').find({
+            'ancestors._id': middle['_id'], '_id': extraItem['_id']
+        }).count(), 1)
+
+        # A move that was interrupted while the ancestors underneath the
+        # folder were being replaced is finished when the server starts
+        # again, whether or not each document was already updated
+        oldAncestors = folderModel.getChildAncestors(other)
+        newAncestors = folderModel.getChildAncestors(top)
+        moveId = ObjectId()
+        folderModel.update({'_id': middle['_id']}, {'$set': {
+            'parentId': top['_id'],
+            'ancestors': newAncestors,
+            'ancestorsMove': {'_id': moveId, 'from': oldAncestors}
+        }})
+        folderModel.update({'_id': bottom['_id']}, {'$push': {'ancestors': {
+            '$each': [dict(doc, move=moveId) for doc in newAncestors],
+            '$position': 0
+        }}})
+        folderModel.resumeMoves()
+        folderModel.resumeMoves()
+        middle = folderModel.load(middle['_id'], force=True)
+        self.assertNotIn('ancestorsMove', middle)
+        for doc in (folderModel.load(bottom['_id'], force=True),
+                    folderModel.load(extra['_id'], force=True)):
+            self.assertEqual(doc['ancestors'][:3], newAncestors + [{
+                '_id': middle['_id'], 'type': 'folder'}])
+            self.assertFalse(any('move' in a for a in doc['ancestors']))
+        item = self.model('item').load(item['_id'], force=True)
+        self.assertEqual(ids(item), [
+            ('user', self.admin['_id']), ('folder', top['_id']),
+            ('folder', middle['_id']), ('folder', bottom['_id'])])
+
+        # Items whose folder is missing are loaded without ancestors
+        self.model('item').update({'_id': extraItem['_id']}, {
+            '$unset': {'ancestors': True},
+            '$set': {'folderId': ObjectId()}})
+        extraItem = self.model('item').load(extraItem['_id'], force=True)
+        self.assertNotIn('ancestors', extraItem)
+
+    def testMoveSubtree(self):
+        folderModel = self.model('folder')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin,
+            name='Top')
+        folders = [top]
+        for i in range(3):
+            folders.append(folderModel.createFolder(
+                parent=folders[-1], creator=self.admin, name='Level %d' % i))
+        sibling = folderModel.createFolder(
+            parent=folders[1], creator=self.admin, name='Sibling')
+        items = [self.model('item').createItem('Item', self.admin, folder)
+                 for folder in (folders[-1], sibling)]
+
+        # Give each folder a size and account for it on the owning user
+        folderModel.update({'_id': {'$in': [f['_id'] for f in folders]}},
+                           {'$set': {'size': 10}})
+        self.model('user').update({'_id': self.admin['_id']},
+                                  {'$set': {'size': 40}})
+
+        # Walk the subtree level by level rather than using the ancestors
+        folderModel.update({}, {'$unset': {'ancestors': True}})
+        folderModel._ancestorsComplete = False
+        self.assertFalse(folderModel.hasCompleteAncestors())
+
+        resp = self.request(
+            path='/folder/%s' % top['_id'], method='PUT', user=self.admin,
+            params={
+                'parentType': 'user',
+                'parentId': self.user['_id'],
+                'progress': True
+            })
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['baseParentId'], str(self.user['_id']))
+
+        for folder in folders[1:] + [sibling]:
+            folder = folderModel.load(folder['_id'], force=True)
+            self.assertEqual(folder['baseParentType'], 'user')
+            self.assertEqual(folder['baseParentId'], self.user['_id'])
+        for item in items:
+            item = self.model('item').load(item['_id'], force=True)
+            self.assertEqual(item['baseParentId'], self.user['_id'])
+
+        self.assertEqual(self.model('user').load(
+            self.admin['_id'], force=True)['size'], 0)
+        self.assertEqual(self.model('user').load(
+            self.user['_id'], force=True)['size'], 40)
+
+        # Moving a folder underneath one of its descendants is refused
+        resp = self.request(
+            path='/folder/%s' % top['_id'], method='PUT', user=self.admin,
+            params={
+                'parentType': 'folder',
+                'parentId': folders[2]['_id']
+            })
+        self.assertStatus(resp, 400)
+
+    def testDeletionEngine(self):
+        folderModel = self.model('folder')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin,
+            name='Top')
+        sub = folderModel.createFolder(
+            parent=top, creator=self.admin, name='Sub')
+        outside = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin,
+            name='Outside')
+
+        paths = {}
+        for folder, name, contents in ((top, 'shared', 'shared data'),
+                                       (sub, 'unique', 'unique data'),
+                                       (outside, 'copy', 'shared data')):
+            item = self.model('item').createItem(name, self.admin, folder)
+            resp = self.request(
+                path='/file', method='POST', user=self.admin, params={
+                    'parentType': 'item',
+                    'parentId': item['_id'],
+                    'name': name,
+                    'size': len(contents)
+                })
+            self.assertStatusOk(resp)
+            resp = self.multipartRequest(
+                path='/file/chunk', user=self.admin,
+                fields=[('offset', 0), ('uploadId', resp.json['_id'])],
+                files=[('chunk', name, contents)])
+            self.assertStatusOk(resp)
+            file = self.model('file').load(resp.json['_id'], force=True)
+            paths[name] = os.path.join(self.assetstore['root'], file['path'])
+        self.assertEqual(paths['shared'], paths['copy'])
+
+        # Marking the subtree hides it before anything is removed
+        deletion = self.model('deletion').createDeletion(top, 'folder')
+        self.assertEqual(deletion['resourceId'], top['_id'])
+        names = [folder['name'] for folder in folderModel.childFolders(
+            self.admin, 'user', user=self.admin)]
+        self.assertNotIn('Top', names)
+        self.assertIn('Outside', names)
+        self.assertEqual(list(folderModel.childItems(top)), [])
+        self.assertIsNotNone(folderModel.load(sub['_id'], force=True))
+
+        # A deletion that another live process owns is left alone
+        deletionModel = self.model('deletion')
+        deletionModel.update({'_id': deletion['_id']}, {
+            '$set': {'owner': 'other'}})
+        self.assertTrue(deletionModel.resumeStale())
+        self.assertIsNotNone(folderModel.load(sub['_id'], force=True))
+
+        # The owner stops collecting it once it has been taken over
+        deletionModel.collect(deletion)
+        self.assertIsNotNone(folderModel.load(sub['_id'], force=True))
+
+        # Remove it as another process would once the owner has stopped
+        deletionModel.update({'_id': deletion['_id']}, {'$set': {
+            'heartbeat': datetime.datetime.utcnow() - datetime.timedelta(1)}})
+        self.assertFalse(deletionModel.resumeStale())
+        self.assertEqual(deletionModel.find().count(), 0)
+        self.assertIsNone(folderModel.load(top['_id'], force=True))
+        self.assertIsNone(folderModel.load(sub['_id'], force=True))
+        self.assertEqual(self.model('item').find({
+            'folderId': {'$in': [top['_id'], sub['_id']]}}).count(), 0)
+        self.assertEqual(self.model('file').find().count(), 1)
+        self.assertFalse(os.path.isfile(paths['unique']))
+        self.assertTrue(os.path.isfile(paths['shared']))
+
+    def testRecursiveAccess(self):
+        folderModel = self.model('folder')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin,
+            name='Top', public=False)
+        sub = folderModel.createFolder(
+            parent=top, creator=self.admin, name='Sub')
+        subsub = folderModel.createFolder(
+            parent=sub, creator=self.admin, name='SubSub')
+        hidden = folderModel.createFolder(
+            parent=top, creator=self.admin, name='Hidden')
+        hiddenSub = folderModel.createFolder(
+            parent=hidden, creator=self.admin, name='Hidden sub')
+        for folder in (top, sub, subsub, hiddenSub):
+            folderModel.setUserAccess(
+                folder, self.user, AccessType.ADMIN, save=True)
+
+        # The user can only change the folders they administer, and nothing
+        # underneath a folder they do not
+        access = {'users': [{'id': str(self.user['_id']),
+                             'level': AccessType.ADMIN}]}
+        resp = self.request(
+            path='/folder/%s/access' % top['_id'], method='PUT',
+            user=self.user, params={
+                'access': json.dumps(access),
+                'public': True,
+                'recurse': True,
+                'progress': True
+            })
+        self.assertStatusOk(resp)
+        expected = {'users': [{'id': self.user['_id'],
+                               'level': AccessType.ADMIN}], 'groups': []}
+        for folder in (top, sub, subsub):
+            folder = folderModel.load(folder['_id'], force=True)
+            self.assertEqual(folder['access'], expected)
+            self.assertTrue(folder['public'])
+        for folder in (hidden, hiddenSub):
+            folder = folderModel.load(folder['_id'], force=True)
+            self.assertNotEqual(folder['access'], expected)
+            self.assertFalse(folder['public'])
+
+        # An admin updates the whole subtree
+        access['users'].append({'id': str(self.admin['_id']),
+                                'level': AccessType.ADMIN})
+        resp = self.request(
+            path='/folder/%s/access' % top['_id'], method='PUT',
+            user=self.admin, params={
+                'access': json.dumps(access),
+                'public': False,
+                'recurse': True
+            })
+        self.assertStatusOk(resp)
+        for folder in (sub, subsub, hidden, hiddenSub):
+            folder = folderModel.load(folder['_id'], force=True)
+            self.assertEqual(len(folder['access']['users']), 2)
+            self.assertFalse(folder['public'])
+
+        # Handlers of the save events see each folder that is changed
+        saved = []
+
+        def onSave(event):
+            saved.append((event.info['_id'], event.info['public']))
+
+        with events.bound('model.folder.save.after', 'test', onSave):
+            folderModel.setAccessList(
+                top, top['access'], save=True, recurse=True,
+                user=self.admin, setPublic=True)
+        self.assertEqual(sorted(saved), sorted(
+            (folder['_id'], True)
+            for folder in (top, sub, subsub, hidden, hiddenSub)))
+
+    def testWalkSubtree(self):
+        folderModel = self.model('folder')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin,
+            name='Top', public=True)
+        folderModel.setMetadata(top, {'key': 'value'})
+        subs = [folderModel.createFolder(
+            parent=top, creator=self.admin, name='Sub %d' % i)
+            for i in range(3)]
+        private = folderModel.createFolder(
+            parent=subs[0], creator=self.admin, name='Private', public=False)
+        folderModel.createFolder(
+            parent=private, creator=self.admin, name='Private sub',
+            public=True)
+        for folder in subs + [private]:
+            item = self.model('item').createItem(
+                'Item', self.admin, folder)
+            self.model('file').createLinkFile(
+                'File', item, 'item', 'http://example.com', self.admin)
+
+        walked = [(len(folders), len(subfolders), len(items))
+                  for folders, subfolders, items, files in
+                  folderModel.walkSubtree(top, user=self.user)]
+        self.assertEqual(walked, [(1, 3, 0), (3, 0, 3)])
+
+        # Subfolders and items that do not fit in one batch are yielded in
+        # further batches of the same folders
+        with mock.patch('girder.models.folder.DESCENDANT_BATCH_SIZE', 2):
+            walked = [(len(folders), len(subfolders), len(items))
+                      for folders, subfolders, items, files in
+                      folderModel.walkSubtree(top, user=self.user)]
+        self.assertEqual(walked, [(1, 2, 0), (1, 1, 0), (2, 0, 2), (1, 0, 1)])
+
+        self.assertEqual(folderModel.subtreeCount(top), 10)
+        self.assertEqual(folderModel.subtreeCount(
+            top, user=self.user, level=AccessType.READ), 7)
+        self.assertEqual(folderModel.subtreeCount(
+            top, includeItems=False, user=self.user, level=AccessType.READ), 4)
+
+        paths = [path for path, stream in folderModel.fileList(
+            top, user=self.user, includeMetadata=True)]
+        self.assertEqual(sorted(paths), [
+            'Top/Sub 0/Item/File', 'Top/Sub 1/Item/File',
+            'Top/Sub 2/Item/File', 'Top/girder-folder-metadata.json'])
+
+    def testSystemCheckOrphans(self):
+        folderModel = self.model('folder')
+        top = folderModel.createFolder(
+            parent=self.admin, parentType='user', creator=self.admin,
+            name='Top')
+        sub = folderModel.createFolder(
+            parent=top, creator=self.admin, name='Sub')
+        lostItem = self.model('item').createItem('Lost', self.admin, sub)
+        keptItem = self.model('item').createItem('Kept', self.admin, top)
+        lostFile = self.model('file').createFile(
+            self.admin, keptItem, 'Lost file', 5, self.assetstore)
+        self.model('file').update({'_id': lostFile['_id']}, {
+            '$set': {'itemId': ObjectId(), 'path': 'lost'}})
+        upload = self.model('upload').createUpload(
+            self.admin, 'Lost upload', 'folder', sub, 10)
+
+        # Remove the top folder without removing anything underneath it
+        folderModel.removeWithQuery({'_id': top['_id']})
+
+        resp = self.request(path='/system/check', method='PUT',
+                            user=self.admin, params={'report': True})
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['folderRemoved'], 1)
+        self.assertEqual(resp.json['itemRemoved'], 1)
+        self.assertEqual(resp.json['fileRemoved'], 1)
+        self.assertIsNotNone(folderModel.findOne({'_id': sub['_id']}))
+
+        resp = self.request(path='/system/check', method='PUT',
+                            user=self.admin, params={'progress': True})
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['folderRemoved'], 1)
+        self.assertEqual(resp.json['itemRemoved'], 1)
+        self.assertEqual(resp.json['fileRemoved'], 1)
+        self.assertIsNone(folderModel.findOne({'_id': sub['_id']}))
+        for model, doc in (('item', lostItem), ('item', keptItem),
+                           ('file', lostFile), ('upload', upload)):
+            self.assertIsNone(self.model(model).findOne({'_id': doc['_id']}))
+
+        # Nothing is left to correct
+        resp = self.request(path='/system/check', method='PUT',
+                            user=self.admin, params={'report': True})
+        self.assertStatusOk(resp)
+        self.assertNotIn('folderRemoved', resp.json)
+        self.assertNotIn('itemRemoved', resp.json)
+        self.assertNotIn('fileRemoved', resp.json)
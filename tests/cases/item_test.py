@@ -654,6 +654,16 @@ class ItemTestCase(base.TestCase):
         item['baseParentType'] = 'collection'
         item['baseParentId'] = ObjectId()
         self.model('item').save(item, validate=False)
+        # A report finds the problems without changing anything
+        resp = self.request(path='/system/check', method='PUT',
+                            user=self.users[0], params={'report': True})
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['itemCorrected'], 1)
+        self.assertEqual(resp.json['itemRemoved'], 1)
+        self.assertIsNotNone(
+            self.model('item').findOne({'_id': ObjectId(item1['_id'])}))
+        item = self.model('item').findOne({'_id': ObjectId(item2['_id'])})
+        self.assertEqual(item['size'], len('foobar') + 1)
         # Use the system check to repair this.  item1 should vanish, item2's
         # size should be fized.
         resp = self.request(path='/system/check', method='PUT',
@@ -697,3 +707,72 @@ class ItemTestCase(base.TestCase):
         resp = self.request(path='/item/%s/download' % item['_id'],
                             cookie='girderToken=invalid_token')
         self.assertStatus(resp, 401)
+
+    def testKeysetPagination(self):
+        names = ['b', 'a', 'c', 'a', 'b', 'd', 'a']
+        for i, name in enumerate(names):
+            item = self.model('item').createItem(name, self.users[0],
+                                                 self.publicFolder)
+            if i % 2:
+                self.model('item').setMetadata(item, {'rank': i})
+
+        def getPages(params):
+            pages = []
+            while True:
+                resp = self.request(path='/item', user=self.users[0],
+                                    params=params)
+                self.assertStatusOk(resp)
+                pages.append([item['_id'] for item in resp.json])
+                if 'Girder-After' not in resp.headers:
+                    return pages
+                params['after'] = resp.headers['Girder-After']
+
+        params = {
+            'folderId': self.publicFolder['_id'],
+            'limit': 3
+        }
+        pages = getPages(params)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+
+        # Items without the sort field come last in descending order
+        resp = self.request(path='/item', user=self.users[0], params={
+            'folderId': self.publicFolder['_id'],
+            'sort': 'meta.rank',
+            'sortdir': -1,
+            'limit': 0
+        })
+        self.assertStatusOk(resp)
+        self.assertEqual([item.get('meta', {}).get('rank')
+                          for item in resp.json][:4], [5, 3, 1, None])
+        self.assertEqual(sum(getPages({
+            'folderId': self.publicFolder['_id'],
+            'sort': 'meta.rank',
+            'sortdir': -1,
+            'limit': 2
+        }), []), [item['_id'] for item in resp.json])
+
+        # The pages match a single sorted listing, with ties broken by id
+        resp = self.request(path='/item', user=self.users[0], params={
+            'folderId': self.publicFolder['_id'],
+            'limit': 0
+        })
+        self.assertStatusOk(resp)
+        self.assertEqual(sum(pages, []), [item['_id'] for item in resp.json])
+        self.assertEqual([item['name'] for item in resp.json], sorted(names))
+
+        # Tokens are tied to the sort order
+        resp = self.request(path='/item', user=self.users[0], params={
+            'folderId': self.publicFolder['_id'],
+            'sort': 'created',
+            'after': params['after']
+        })
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json['message'],
+                         'The "after" token does not match the sort order.')
+
+        resp = self.request(path='/item', user=self.users[0], params={
+            'folderId': self.publicFolder['_id'],
+            'after': 'bogus'
+        })
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json['message'], 'Invalid "after" token.')
@@ -17,8 +17,16 @@
 #  limitations under the License.
 ###############################################################################
 
+import cherrypy
+import six
+
+from bson.objectid import ObjectId
+
 from .. import base
-from girder.models.model_base import AccessControlledModel, Model, AccessType
+from girder import events
+from girder.models.model_base import AccessControlledModel, Model, \
+    AccessType, AccessException, ValidationException
+from girder.utility.index import registry as indexRegistry
 from girder.utility.model_importer import ModelImporter
 
 
@@ -189,3 +197,259 @@ class ModelTestCase(base.TestCase):
         self.assertEqual(len(doc1['access']['users']), 1)
         self.assertEqual(len(doc1['access']['groups']), 0)
         self.assertIsNone(doc1.get('creatorId'))
+
+    def testPermissionQueryFiltering(self):
+        admin = self.model('user').createUser(
+            email='admin@place.com', login='admin', firstName='Admin',
+            lastName='Admin', password='adminpassword')
+        user = self.model('user').createUser(
+            email='user@place.com', login='user', firstName='Regular',
+            lastName='User', password='userpassword')
+        group = self.model('group').createGroup(name='agroup', creator=admin)
+        self.model('group').addUser(group, user, level=AccessType.READ)
+        user = self.model('user').load(user['_id'], force=True)
+
+        model = self.model('fake_ac')
+        docs = [
+            model.setPublic({'name': 'public'}, True),
+            model.setPublic({'name': 'private'}, False),
+            model.setUserAccess(
+                {'name': 'userRead', 'public': False}, user, AccessType.READ),
+            model.setUserAccess(
+                {'name': 'userWrite', 'public': False}, user,
+                AccessType.WRITE),
+            model.setGroupAccess(
+                {'name': 'groupWrite', 'public': False}, group,
+                AccessType.WRITE)
+        ]
+        for doc in docs:
+            model.save(doc)
+
+        def names(user, level, **kwargs):
+            return [d['name'] for d in model.findWithPermissions(
+                {}, user=user, level=level, sort=[('name', 1)], **kwargs)]
+
+        self.assertIsNone(model.permissionClauses(admin, AccessType.ADMIN))
+        self.assertEqual(names(admin, AccessType.ADMIN), [
+            'groupWrite', 'private', 'public', 'userRead', 'userWrite'])
+        self.assertEqual(names(None, AccessType.READ), ['public'])
+        self.assertEqual(names(None, AccessType.WRITE), [])
+        self.assertEqual(names(user, AccessType.READ), [
+            'groupWrite', 'public', 'userRead', 'userWrite'])
+        self.assertEqual(names(user, AccessType.WRITE), [
+            'groupWrite', 'userWrite'])
+        self.assertEqual(names(user, AccessType.ADMIN), [])
+        self.assertEqual(
+            names(user, AccessType.READ, offset=1, limit=2),
+            ['public', 'userRead'])
+
+        # The query-based filtering must agree with hasAccess
+        for level in (AccessType.READ, AccessType.WRITE, AccessType.ADMIN):
+            expected = sorted(
+                d['name'] for d in model.find({})
+                if model.hasAccess(d, user=user, level=level))
+            self.assertEqual(names(user, level), expected)
+
+    def testIdentityMap(self):
+        model = self.model('fake')
+        doc = model.save({'read': 1, 'sa': 2})
+
+        cherrypy.request.girderIdentityMap = {}
+        try:
+            loaded = model.load(doc['_id'])
+            self.assertEqual(loaded['read'], 1)
+            self.assertIn(
+                doc['_id'], cherrypy.request.girderIdentityMap['fake'])
+
+            # Modifying the returned document must not affect the cache
+            loaded['read'] = 100
+            self.assertEqual(model.load(doc['_id'])['read'], 1)
+
+            # Projections are cached separately
+            self.assertEqual(
+                set(model.load(doc['_id'], fields=['sa'])), {'_id', 'sa'})
+            self.assertIn('read', model.load(doc['_id']))
+
+            # Changes made behind the cache's back are not seen...
+            model.collection.update_one(
+                {'_id': doc['_id']}, {'$set': {'read': 2}})
+            self.assertEqual(model.load(doc['_id'])['read'], 1)
+
+            # ...but writes through the model invalidate it
+            model.increment({'_id': doc['_id']}, 'read', 1)
+            self.assertEqual(model.load(doc['_id'])['read'], 3)
+
+            loaded = model.load(doc['_id'])
+            loaded['read'] = 4
+            model.save(loaded)
+            self.assertEqual(model.load(doc['_id'])['read'], 4)
+
+            model.remove(loaded)
+            self.assertIsNone(model.load(doc['_id']))
+        finally:
+            del cherrypy.request.girderIdentityMap
+
+    def testLoadMany(self):
+        admin = self.model('user').createUser(
+            email='admin@place.com', login='admin', firstName='Admin',
+            lastName='Admin', password='adminpassword')
+        user = self.model('user').createUser(
+            email='user@place.com', login='user', firstName='Regular',
+            lastName='User', password='userpassword')
+
+        model = self.model('fake_ac')
+        docs = [model.save(model.setUserAccess(
+            {'read': i}, user, AccessType.READ if i else AccessType.WRITE))
+            for i in range(4)]
+        ids = [doc['_id'] for doc in reversed(docs)]
+
+        # Order of the ids is preserved, and string ids are coerced
+        loaded = model.loadMany(
+            [str(id) for id in ids], user=user, level=AccessType.READ)
+        self.assertEqual([doc['read'] for doc in loaded], [3, 2, 1, 0])
+
+        # Projections hide the access fields that were needed for checking
+        loaded = model.loadMany(
+            ids, user=user, level=AccessType.READ, fields=['read'])
+        self.assertEqual(set(loaded[0]), {'_id', 'read'})
+
+        # Access is checked on every document
+        with self.assertRaises(AccessException):
+            model.loadMany(ids, user=user, level=AccessType.WRITE)
+        self.assertEqual(len(model.loadMany(
+            ids[-1:], user=user, level=AccessType.WRITE)), 1)
+        self.assertEqual(len(model.loadMany(ids, user=admin)), 4)
+
+        # Missing ids are skipped, or raise if exc is set
+        missing = ObjectId()
+        loaded = model.loadMany([ids[0], missing, ids[1]], force=True)
+        self.assertEqual([doc['read'] for doc in loaded], [3, 2])
+        with self.assertRaises(ValidationException):
+            model.loadMany([ids[0], missing], force=True, exc=True)
+
+        # Mixin models check access on the distinct parents
+        folder = six.next(self.model('folder').childFolders(
+            parent=user, parentType='user', user=user,
+            filters={'name': 'Private'}))
+        item = self.model('item').createItem('item', user, folder)
+        self.assertEqual(len(self.model('item').loadMany(
+            [item['_id']], user=user, level=AccessType.ADMIN)), 1)
+        with self.assertRaises(AccessException):
+            self.model('item').loadMany(
+                [item['_id']], user=None, level=AccessType.READ)
+
+    def testSaveMany(self):
+        model = self.model('fake')
+        eventNames = []
+
+        def record(event):
+            eventNames.append((event.name, len(event.info) if isinstance(
+                event.info, list) else 1))
+
+        existing = model.save({'read': 0})
+        existing['read'] = 100
+        docs = [{'read': i} for i in range(1, 5)] + [existing]
+
+        with events.bound('model.fake.save.bulk', 'test', record), \
+                events.bound('model.fake.save.bulk.after', 'test', record), \
+                events.bound('model.fake.save.created', 'test', record), \
+                events.bound('model.fake.save', 'test', record):
+            saved = model.saveMany(docs)
+
+        self.assertEqual(len(saved), 5)
+        self.assertTrue(all('_id' in doc for doc in saved))
+        self.assertEqual(model.find().count(), 5)
+        self.assertEqual(model.load(existing['_id'])['read'], 100)
+        self.assertEqual(eventNames, [('model.fake.save.bulk', 5)] + [
+            ('model.fake.save.created', 1)] * 4 + [
+            ('model.fake.save.bulk.after', 5)])
+
+        # Preventing the default action skips the write
+        def prevent(event):
+            event.preventDefault()
+
+        with events.bound('model.fake.save.bulk', 'test', prevent):
+            model.saveMany([{'read': 6}])
+        self.assertEqual(model.find().count(), 5)
+
+        # Validation failures prevent the whole batch from being written
+        def validate(event):
+            for doc in event.info:
+                if doc['read'] > 6:
+                    raise ValidationException('Too large.')
+
+        with events.bound('model.fake.save.bulk', 'test', validate):
+            with self.assertRaises(ValidationException):
+                model.saveMany([{'read': 6}, {'read': 7}])
+        self.assertEqual(model.find().count(), 5)
+
+    def testFilterProjection(self):
+        admin = self.model('user').createUser(
+            email='admin@place.com', login='admin', firstName='Admin',
+            lastName='Admin', password='adminpassword')
+        user = self.model('user').createUser(
+            email='user@place.com', login='user', firstName='Regular',
+            lastName='User', password='userpassword')
+
+        model = self.model('fake_ac')
+        self.assertEqual(
+            set(model.filterProjection(None)), {'read', 'access', 'public'})
+        self.assertEqual(set(model.filterProjection(user)), {
+            'read', 'write', 'write2', 'admin', 'access', 'public'})
+        self.assertEqual(set(model.filterProjection(admin, ['extra'])), {
+            'read', 'write', 'write2', 'admin', 'sa', 'extra', 'access',
+            'public'})
+        self.assertEqual(
+            set(self.model('fake').filterProjection(user)), {'read'})
+        self.assertIn('folderId', self.model('item').filterProjection(None))
+
+        # Filtering a projected document gives the same result as filtering
+        # the whole document
+        doc = model.save(model.setUserAccess({
+            'hidden': 1, 'read': 1, 'write': 1, 'write2': 1, 'admin': 1,
+            'sa': 1}, user, AccessType.WRITE))
+        for u in (user, admin):
+            projected = model.load(
+                doc['_id'], user=u, fields=model.filterProjection(u))
+            self.assertNotIn('hidden', projected)
+            self.assertEqual(model.filter(projected, u), model.filter(doc, u))
+
+    def testIndexRegistry(self):
+        model = self.model('folder')
+        self.assertIs(indexRegistry.models['folder'], model)
+        self.assertEqual(model.missingIndices(), [])
+        self.assertEqual(model.undeclaredIndices(), [])
+
+        keys = [('parentId', 1)]
+        self.assertIn((keys, {}), model.indexSpecs())
+        model.collection.drop_index(keys)
+        model.collection.create_index([('undeclared', 1)])
+        self.assertEqual(model.missingIndices(), [(keys, {})])
+        self.assertEqual(indexRegistry.diff(model),
+                         ([(keys, {})], ['undeclared_1']))
+
+        # Background builds are queued until the builder thread runs, which
+        # finishes the queued builds before it stops
+        indexRegistry.deferred = True
+        try:
+            indexRegistry.register(model)
+            self.assertEqual(model.missingIndices(), [(keys, {})])
+            indexRegistry.start()
+            thread = indexRegistry._thread
+            indexRegistry.stop()
+            thread.join(30)
+        finally:
+            indexRegistry.deferred = False
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(model.missingIndices(), [])
+
+        # Nothing is created when index building is turned off
+        model.collection.drop_index(keys)
+        indexRegistry.mode = 'none'
+        try:
+            model.reconnect()
+        finally:
+            indexRegistry.mode = None
+        self.assertEqual(model.missingIndices(), [(keys, {})])
+        model.createIndices()
+        self.assertEqual(model.missingIndices(), [])
@@ -17,6 +17,9 @@
 #  limitations under the License.
 ###############################################################################
 
+import mock
+import pymongo
+
 from .. import base
 
 from girder.constants import AccessType
@@ -235,3 +238,35 @@ class SearchTestCase(base.TestCase):
             '_id': str(item1['_id']),
             'name': item1['name']
         }, resp.json['item'][0])
+
+    def testTextScoreSort(self):
+        """
+        Test that text search results are only sorted by score when there are
+        fewer matches than TEXT_SCORE_SORT_MAX.
+        """
+        admin = self.model('user').createUser(
+            login='adminlogin', password='adminpassword', firstName='Admin',
+            lastName='Last', email='admin@email.com', admin=True)
+        for name, description in (('Plain', 'needle'),
+                                  ('Needle', 'needle in a haystack'),
+                                  ('Needle point', '')):
+            self.model('collection').createCollection(
+                name, admin, description)
+
+        def search(threshold):
+            with mock.patch('girder.models.model_base.TEXT_SCORE_SORT_MAX',
+                            threshold), \
+                    mock.patch.object(
+                        pymongo.cursor.Cursor, 'sort', autospec=True,
+                        side_effect=pymongo.cursor.Cursor.sort) as sort:
+                results = list(self.model('collection').textSearch('needle'))
+            self.assertEqual(len(results), 3)
+            return results, sort.called
+
+        results, scoreSorted = search(4)
+        self.assertTrue(scoreSorted)
+        scores = [doc['_textScore'] for doc in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        results, scoreSorted = search(2)
+        self.assertFalse(scoreSorted)
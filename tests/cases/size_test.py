@@ -17,8 +17,12 @@
 #  limitations under the License.
 ###############################################################################
 
+from bson.objectid import ObjectId
+
 from .. import base
 
+from girder.utility.size_aggregator import aggregator
+
 
 def setUpModule():
     base.startServer()
@@ -192,3 +196,134 @@ class SizeTestCase(base.TestCase):
         self.assertStatusOk(resp)
         self.assertNodeSize(self.admin, 'user', 0)
         self.assertNodeSize(self.coll2, 'collection', 1)
+
+    def assertRecursiveCounts(self, folder, size, items, folders, files):
+        folder = self.model('folder').load(folder['_id'], force=True)
+        self.assertEqual((
+            folder['recursiveSize'], folder['recursiveItemCount'],
+            folder['recursiveFolderCount'], folder['recursiveFileCount']),
+            (size, items, folders, files))
+
+    def testRecursiveCounts(self):
+        self.assertRecursiveCounts(self.folder1, 11, 2, 1, 2)
+        self.assertRecursiveCounts(self.folder2, 10, 1, 0, 1)
+        self.assertEqual(self.model('folder').getSizeRecursive(
+            self.model('folder').load(self.folder1['_id'], force=True)), 11)
+
+        # Move item1 down into the subfolder
+        resp = self.request(
+            path='/item/%s' % self.item1['_id'], method='PUT',
+            user=self.admin, params={
+                'folderId': self.folder2['_id']
+            })
+        self.assertStatusOk(resp)
+        self.assertRecursiveCounts(self.folder1, 11, 2, 1, 2)
+        self.assertRecursiveCounts(self.folder2, 11, 2, 0, 2)
+
+        # Add a subfolder and an empty file
+        folder3 = self.model('folder').createFolder(
+            self.folder2, 'Folder3', creator=self.admin)
+        item3 = self.model('item').createItem('Item3', self.admin, folder3)
+        self.model('file').createFile(
+            self.admin, item3, 'File3', 0, self.assetstore)
+        self.assertRecursiveCounts(self.folder1, 11, 3, 2, 3)
+        self.assertRecursiveCounts(self.folder2, 11, 3, 1, 3)
+        self.assertEqual(self.model('folder').subtreeCount(
+            self.model('folder').load(self.folder1['_id'], force=True)), 6)
+
+        # Move the subfolder to another collection
+        resp = self.request(
+            path='/folder/%s' % self.folder2['_id'], method='PUT',
+            user=self.admin, params={
+                'parentId': self.coll2['_id'],
+                'parentType': 'collection'
+            })
+        self.assertStatusOk(resp)
+        self.assertRecursiveCounts(self.folder1, 0, 0, 0, 0)
+        self.assertRecursiveCounts(self.folder2, 11, 3, 1, 3)
+
+        # Delete a file and a folder
+        self.model('file').remove(self.file10)
+        self.model('folder').remove(folder3)
+        self.assertRecursiveCounts(self.folder2, 1, 2, 0, 1)
+
+        # The consistency check repairs values that are wrong or missing
+        self.model('folder').update({'_id': self.folder2['_id']}, {
+            '$set': {'recursiveSize': 100}})
+        self.model('folder').update({'_id': self.folder1['_id']}, {
+            '$unset': {'recursiveSize': '', 'recursiveItemCount': ''}})
+        resp = self.request(path='/system/check', method='PUT',
+                            user=self.admin)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['folderCorrected'], 2)
+        self.assertRecursiveCounts(self.folder1, 0, 0, 0, 0)
+        self.assertRecursiveCounts(self.folder2, 1, 2, 0, 1)
+
+    def testSizeAggregator(self):
+        # Defer size changes without ever flushing them on a timer
+        aggregator.interval = 10 ** 9
+        aggregator.start()
+        try:
+            for size in (5, 7):
+                self.model('file').createFile(
+                    self.admin, self.item1, 'File', size, self.assetstore)
+            self.assertEqual(
+                aggregator.pending[(self.model('item'), None)],
+                {self.item1['_id']: {'size': 12}})
+            self.assertNodeSize(self.item1, 'item', 1)
+            self.assertNodeSize(self.coll1, 'collection', 11)
+
+            # Changes can still be written immediately
+            aggregator.increment(self.model('collection'), [self.coll2['_id']],
+                                 {'size': 3}, sync=True)
+            self.assertNodeSize(self.coll2, 'collection', 3)
+        finally:
+            aggregator.stop()
+            aggregator.interval = None
+
+        self.assertEqual(aggregator.pending, {})
+        self.assertNodeSize(self.item1, 'item', 13)
+        self.assertNodeSize(self.folder1, 'folder', 13)
+        self.assertNodeSize(self.coll1, 'collection', 23)
+        self.assertRecursiveCounts(self.folder1, 23, 2, 1, 4)
+
+    def testCopyFolder(self):
+        # Copy the tree into another collection
+        resp = self.request(
+            path='/folder/%s/copy' % self.folder1['_id'], method='POST',
+            user=self.admin, params={
+                'parentId': self.coll2['_id'],
+                'parentType': 'collection',
+                'progress': True
+            })
+        self.assertStatusOk(resp)
+        newFolder1 = resp.json
+        self.assertNodeSize(newFolder1, 'folder', 1)
+        self.assertNodeSize(self.coll2, 'collection', 11)
+        self.assertRecursiveCounts(newFolder1, 11, 2, 1, 2)
+
+        newFolder2 = self.model('folder').findOne({
+            'parentId': ObjectId(newFolder1['_id'])})
+        self.assertEqual(newFolder2['name'], 'Subfolder')
+        self.assertEqual(newFolder2['ancestors'], [
+            {'_id': self.coll2['_id'], 'type': 'collection'},
+            {'_id': ObjectId(newFolder1['_id']), 'type': 'folder'}])
+        self.assertRecursiveCounts(newFolder2, 10, 1, 0, 1)
+        newItem10 = self.model('item').findOne({'folderId': newFolder2['_id']})
+        self.assertEqual(newItem10['size'], 10)
+        newFile10 = self.model('file').findOne({'itemId': newItem10['_id']})
+        self.assertEqual(newFile10['size'], 10)
+        self.assertEqual(newFile10['copierId'], self.admin['_id'])
+
+        # Copy the tree into its own subfolder; the copy is not copied again
+        resp = self.request(
+            path='/folder/%s/copy' % self.folder1['_id'], method='POST',
+            user=self.admin, params={
+                'parentId': self.folder2['_id'],
+                'parentType': 'folder'
+            })
+        self.assertStatusOk(resp)
+        self.assertRecursiveCounts(resp.json, 11, 2, 1, 2)
+        self.assertRecursiveCounts(self.folder2, 21, 3, 2, 3)
+        self.assertRecursiveCounts(self.folder1, 22, 4, 3, 4)
+        self.assertNodeSize(self.coll1, 'collection', 22)
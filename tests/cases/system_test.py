@@ -17,7 +17,9 @@
 #  limitations under the License.
 ###############################################################################
 
+import cherrypy
 import json
+import mock
 import os
 import time
 import six
@@ -222,6 +224,54 @@ class SystemTestCase(base.TestCase):
             }, user=users[0])
             self.assertStatusOk(resp)
 
+    def testSettingCache(self):
+        settingModel = self.model('setting')
+        cacheConfig = config.getConfig().setdefault('cache', {})
+        oldTtl = cacheConfig.get('setting_ttl', 0)
+        cacheConfig['setting_ttl'] = 1000
+        try:
+            self._testSettingCache(settingModel, cacheConfig)
+        finally:
+            cacheConfig['setting_ttl'] = oldTtl
+            settingModel.invalidateCache()
+
+    def _testSettingCache(self, settingModel, cacheConfig):
+        settingModel.set(SettingKey.SMTP_HOST, 'smtp.first.com')
+        self.assertEqual(
+            settingModel.get(SettingKey.SMTP_HOST), 'smtp.first.com')
+
+        # Changes made directly in the database are not seen until the cache
+        # expires or is invalidated
+        settingModel.collection.update_one(
+            {'key': SettingKey.SMTP_HOST},
+            {'$set': {'value': 'smtp.other.com'}})
+        self.assertEqual(
+            settingModel.get(SettingKey.SMTP_HOST), 'smtp.first.com')
+        settingModel.invalidateCache()
+        self.assertEqual(
+            settingModel.get(SettingKey.SMTP_HOST), 'smtp.other.com')
+
+        # Setting and unsetting invalidates the cache immediately
+        settingModel.set(SettingKey.SMTP_HOST, 'smtp.second.com')
+        self.assertEqual(
+            settingModel.get(SettingKey.SMTP_HOST), 'smtp.second.com')
+        settingModel.unset(SettingKey.SMTP_HOST)
+        self.assertEqual(
+            settingModel.get(SettingKey.SMTP_HOST),
+            SettingDefault.defaults[SettingKey.SMTP_HOST])
+
+        # Cached values cannot be modified by callers
+        settingModel.set(SettingKey.PLUGINS_ENABLED, [])
+        settingModel.get(SettingKey.PLUGINS_ENABLED).append('foo')
+        self.assertEqual(settingModel.get(SettingKey.PLUGINS_ENABLED), [])
+
+        # With a TTL of 0, the database is always read
+        cacheConfig['setting_ttl'] = 0
+        settingModel.collection.update_one(
+            {'key': SettingKey.PLUGINS_ENABLED}, {'$set': {'value': ['x']}})
+        self.assertEqual(settingModel.get(SettingKey.PLUGINS_ENABLED), ['x'])
+        settingModel.set(SettingKey.PLUGINS_ENABLED, [])
+
     def testPlugins(self):
         resp = self.request(path='/system/plugins', user=self.users[0])
         self.assertStatusOk(resp)
@@ -314,6 +364,23 @@ class SystemTestCase(base.TestCase):
         # tests that check repair of different models are convered in the
         # individual models' tests
 
+        # The checks run on other threads, but on behalf of the request
+        itemModel = self.model('item')
+        checkConsistency = itemModel.checkConsistency
+        requests = []
+
+        def recordRequest(*args, **kwargs):
+            requests.append(cherrypy.request.path_info)
+            return checkConsistency(*args, **kwargs)
+
+        with mock.patch.object(itemModel, 'checkConsistency', recordRequest):
+            resp = self.request(path='/system/check', method='PUT',
+                                user=self.users[0])
+        self.assertStatusOk(resp)
+        self.assertGreater(len(requests), 1)
+        for path in requests:
+            self.assertEqual(path, '/api/v1/system/check')
+
     def testLogRoute(self):
         logRoot = os.path.join(ROOT_DIR, 'tests', 'cases', 'dummylogs')
         config.getConfig()['logging'] = {'log_root': logRoot}
@@ -352,3 +419,24 @@ class SystemTestCase(base.TestCase):
             '=== Last 0 bytes of %s/info.log: ===\n\n' % logRoot)
 
         del config.getConfig()['logging']
+
+    def testDbStats(self):
+        profilingConfig = config.getConfig().setdefault('profiling', {})
+        resp = self.request(path='/collection')
+        self.assertStatusOk(resp)
+        self.assertNotIn('X-Girder-Db-Ops', resp.headers)
+
+        profilingConfig['db_stats'] = True
+        try:
+            resp = self.request(path='/collection')
+        finally:
+            profilingConfig['db_stats'] = False
+        self.assertStatusOk(resp)
+
+        ops = resp.headers['X-Girder-Db-Ops'].split('; ')
+        self.assertGreaterEqual(int(ops[0]), 1)
+        self.assertIn('collection.find=1', ops)
+        timings = resp.headers['Server-Timing'].split(', ')
+        self.assertTrue(timings[0].startswith('db;dur='))
+        self.assertTrue(any(
+            timing.startswith('db-collection;') for timing in timings))
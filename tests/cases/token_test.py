@@ -75,3 +75,52 @@ class TokensTestCase(base.TestCase):
         # Now the token is gone, so it should fail
         resp = self.request(path='/token/session', method='DELETE', token=token)
         self.assertStatus(resp, 401)
+
+    def testAuthCache(self):
+        user = self.model('user').createUser(
+            email='user@user.com', login='user', firstName='First',
+            lastName='Last', password='password')
+        token = self.model('token').createToken(user)
+
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['firstName'], 'First')
+
+        # Changes made behind the model's back are not seen while cached
+        self.model('user').collection.update_one(
+            {'_id': user['_id']}, {'$set': {'firstName': 'Changed'}})
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertEqual(resp.json['firstName'], 'First')
+
+        # Saving the user invalidates the cache
+        user = self.model('user').load(user['_id'], force=True)
+        user['firstName'] = 'Saved'
+        self.model('user').save(user)
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertEqual(resp.json['firstName'], 'Saved')
+
+        # So does joining a group
+        group = self.model('group').createGroup(name='group', creator=user)
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertEqual(resp.json['groups'], [str(group['_id'])])
+
+        # And deleting the group
+        self.model('group').remove(group)
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertEqual(resp.json['groups'], [])
+
+        # Deleting the token logs the user out immediately
+        resp = self.request(
+            path='/token/session', method='DELETE', token=token['_id'])
+        self.assertStatusOk(resp)
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, None)
+
+        # Removing the user invalidates all of its tokens
+        token = self.model('token').createToken(user)
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertEqual(resp.json['login'], 'user')
+        self.model('user').remove(user)
+        resp = self.request(path='/user/me', token=token['_id'])
+        self.assertEqual(resp.json, None)
@@ -17,13 +17,22 @@
 #  limitations under the License.
 ###############################################################################
 
+import datetime
 import json
+import mock
 import os
 import re
 import requests
+import six
 
+from bson.objectid import ObjectId
+from hashlib import sha512
 from .. import base
 from .. import mongo_replicaset
+from girder.constants import SettingKey
+from girder.models import upload as upload_model
+from girder.models.model_base import ValidationException
+from girder.utility import assetstore_utilities
 from girder.utility.s3_assetstore_adapter import botoConnectS3
 
 
@@ -331,3 +340,172 @@ class UploadTestCase(base.TestCase):
                             user=self.admin)
         self.assertStatusOk(resp)
         self.assertEqual(resp.json, [])
+
+    def _testParallelUpload(self):
+        """
+        Upload a file whose chunks are sent out of order, including a chunk
+        that is sent twice and one that overlaps data already received.
+        """
+        data = 'abcdefghijkl'
+        resp = self.request(
+            path='/file', method='POST', user=self.user, params={
+                'parentType': 'folder',
+                'parentId': self.folder['_id'],
+                'name': 'parallel.txt',
+                'size': len(data),
+                'parallel': True
+            })
+        self.assertStatusOk(resp)
+        upload = resp.json
+        self.assertTrue(upload['parallel'])
+
+        def sendChunk(offset, length, content=None):
+            if content is None:
+                content = data[offset:offset + length]
+            fields = [('offset', offset), ('uploadId', upload['_id'])]
+            files = [('chunk', 'parallel.txt', content)]
+            return self.multipartRequest(
+                path='/file/chunk', user=self.user, fields=fields, files=files)
+
+        resp = sendChunk(4, 4)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['received'], 4)
+        resp = sendChunk(4, 4)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['received'], 4)
+        # Overlapping chunks are rejected without storing their data
+        resp = sendChunk(0, 8, 'XXXXXXXX')
+        self.assertStatus(resp, 400)
+        self.assertEqual(
+            resp.json['message'],
+            'Chunk overlaps data that was already received.')
+
+        # While a chunk is being stored, its range is already claimed, so
+        # concurrent chunks that overlap it are rejected before they store
+        # anything. A chunk that fails to be stored releases its range.
+        adapterClass = type(assetstore_utilities.getAssetstoreAdapter(
+            self.model('assetstore').getCurrent()))
+        uploadChunkAt = adapterClass.uploadChunkAt
+
+        def concurrentChunks(adapter, uploadDoc, chunk, offset):
+            for start, content in ((8, 'YYYY'), (6, 'ZZZZ')):
+                with self.assertRaises(ValidationException):
+                    self.model('upload').handleChunk(
+                        uploadDoc, content, offset=start)
+            return uploadChunkAt(adapter, uploadDoc, chunk, offset)
+
+        with mock.patch.object(adapterClass, 'uploadChunkAt',
+                               side_effect=IOError('write failed')):
+            resp = sendChunk(8, 4)
+            self.assertStatus(resp, 500)
+        with mock.patch.object(adapterClass, 'uploadChunkAt',
+                               concurrentChunks):
+            resp = sendChunk(8, 4)
+            self.assertStatusOk(resp)
+
+        resp = self.request(path='/file/offset', user=self.user,
+                            params={'uploadId': upload['_id']})
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json, {
+            'received': 8,
+            'ranges': [[4, 8], [8, 12]]
+        })
+
+        # A range claimed by a chunk that was never stored, for instance
+        # because the process handling it stopped, can be sent again once
+        # the claim is stale.
+        claim = {'start': 0, 'end': 4, 'pending': True, 'claim': ObjectId(),
+                 'claimed': datetime.datetime.utcnow()}
+        self.model('upload').update({'_id': ObjectId(upload['_id'])}, {
+            '$push': {'ranges': claim}})
+        resp = sendChunk(0, 4)
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json['message'],
+                         'Chunk is already being received.')
+        self.model('upload').update({
+            '_id': ObjectId(upload['_id']),
+            'ranges.claim': claim['claim']
+        }, {'$set': {'ranges.$.claimed': claim['claimed'] -
+                     upload_model.PARALLEL_CLAIM_TIMEOUT}})
+
+        resp = sendChunk(0, 4)
+        self.assertStatusOk(resp)
+        file = self.model('file').load(resp.json['_id'], force=True)
+        self.assertEqual(file['size'], len(data))
+        self.assertEqual(file['sha512'],
+                         sha512(data.encode('utf8')).hexdigest())
+        resp = self.request(path='/file/%s/download' % file['_id'],
+                            user=self.user, isJson=False)
+        self.assertEqual(self.getBody(resp), data)
+
+    def testParallelUpload(self):
+        self.model('setting').set(SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE, 0)
+        self._testParallelUpload()
+
+        # GridFS chunks must be stored in whole pieces
+        base.dropGridFSDatabase('girder_test_upload_parallel')
+        self.assetstore = self.model('assetstore').createGridFsAssetstore(
+            name='Test', db='girder_test_upload_parallel')
+        self.assetstore['current'] = True
+        self.model('assetstore').save(self.assetstore)
+        with mock.patch(
+                'girder.utility.gridfs_assetstore_adapter.CHUNK_SIZE', 4):
+            self._testParallelUpload()
+
+    def testUploadWithKnownChecksum(self):
+        data = b'hello world'
+        checksum = sha512(data).hexdigest()
+        privateFolder = six.next(self.model('folder').childFolders(
+            parent=self.user, parentType='user', user=self.user,
+            filters={'public': False}))
+        original = self.model('upload').uploadFromFile(
+            six.BytesIO(data), len(data), 'original.txt', 'folder',
+            privateFolder, self.user)
+
+        def initUpload(user, folder, size=len(data), sha512=checksum):
+            return self.request(
+                path='/file', method='POST', user=user, params={
+                    'parentType': 'folder',
+                    'parentId': folder['_id'],
+                    'name': 'copy.txt',
+                    'size': size,
+                    'sha512': sha512
+                })
+
+        resp = initUpload(self.user, privateFolder, sha512='not a checksum')
+        self.assertStatus(resp, 400)
+        self.assertEqual(resp.json['field'], 'sha512')
+
+        # Data of another size is not reused
+        resp = initUpload(self.user, privateFolder, size=len(data) + 1)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['received'], 0)
+
+        # Neither is data that the user can't read
+        otherUser = self.model('user').createUser(
+            'other', 'otherpassword', 'Other', 'User', 'other@email.com')
+        otherFolder = six.next(self.model('folder').childFolders(
+            parent=otherUser, parentType='user', user=otherUser))
+        resp = initUpload(otherUser, otherFolder)
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['received'], 0)
+
+        resp = initUpload(self.user, self.folder, sha512=checksum.upper())
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['_modelType'], 'file')
+        self.assertEqual(resp.json['size'], len(data))
+        file = self.model('file').load(resp.json['_id'], force=True)
+        self.assertEqual(file['sha512'], checksum)
+        self.assertEqual(file['path'], original['path'])
+        self.assertEqual(file['name'], 'copy.txt')
+        self.assertEqual(file['creatorId'], self.user['_id'])
+        item = self.model('item').load(file['itemId'], force=True)
+        self.assertEqual(item['size'], len(data))
+        self.assertEqual(self.model('upload').find().count(), 2)
+
+        # The data stays until no file uses it
+        self.model('file').remove(original)
+        resp = self.request(path='/file/%s/download' % file['_id'],
+                            user=self.user, isJson=False)
+        self.assertStatusOk(resp)
+        self.assertEqual(self.getBody(resp), data.decode('utf8'))